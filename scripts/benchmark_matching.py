@@ -0,0 +1,312 @@
+"""
+Бенчмарк DriverMatchingService на синтетических городах.
+
+Для каждой комбинации режима поиска и распределения водителей скрипт:
+1. Размещает водителей на сетке через DriverProfileService.
+2. Публикует заказы в поток `order_events`.
+3. Запускает слушатель заказов матчера и ждет, пока все заказы будут обработаны.
+
+Отчет: p50/p95/p99 времени от чтения заказа до блокировки водителя
+и отправки предложения, команд и сетевых обращений к Redis на один
+подобранный заказ, подборов в секунду. Результаты пишутся в JSON, чтобы
+сравнивать прогоны между коммитами.
+
+Запуск из корня проекта (настройки читаются из .env):
+    python scripts/benchmark_matching.py                       # fakeredis
+    python scripts/benchmark_matching.py --redis-url redis://127.0.0.1:6379/15
+
+ВНИМАНИЕ: перед каждым прогоном выполняется FLUSHDB выбранной базы Redis.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+# Корень проекта в sys.path, чтобы импортировать пакет src при запуске из scripts/
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# --- Настройки по умолчанию ---
+MODES = ["redis", "local", "lua"]
+DISTRIBUTIONS = ["uniform", "clustered", "sparse"]
+LAYOUTS = ["classic", "compact"]
+GRID_SIZE = 100
+NUM_DRIVERS = 2000
+NUM_ORDERS = 500
+NUM_CLUSTERS = 5
+SPARSE_FACTOR = 10      # в разреженном городе водителей в SPARSE_FACTOR раз меньше
+SEED_CHUNK = 50         # водителей, размещаемых одновременно (не больше пула соединений)
+
+
+class CommandCounter:
+    """Счетчик команд и сетевых обращений (round trip) к Redis."""
+
+    def __init__(self):
+        self.commands = 0
+        self.round_trips = 0
+
+    def reset(self):
+        self.commands = 0
+        self.round_trips = 0
+
+
+def make_counting_client(client_cls, counter: CommandCounter):
+    """
+    Создает подкласс клиента Redis, считающий команды.
+    Одиночная команда — одно обращение; пайплайн — одно обращение на все его команды.
+    """
+    from redis.asyncio.client import Pipeline
+
+    class CountingPipeline(Pipeline):
+        async def execute(self, raise_on_error: bool = True):
+            counter.commands += len(self.command_stack)
+            counter.round_trips += 1
+            return await super().execute(raise_on_error)
+
+    class CountingRedis(client_cls):
+        async def execute_command(self, *args, **options):
+            counter.commands += 1
+            counter.round_trips += 1
+            return await super().execute_command(*args, **options)
+
+        def pipeline(self, transaction: bool = True, shard_hint=None):
+            return CountingPipeline(
+                self.connection_pool, self.response_callbacks, transaction, shard_hint
+            )
+
+    return CountingRedis
+
+
+def generate_points(distribution: str, count: int, grid: int, rng: random.Random, centers):
+    """Генерирует точки сетки по заданному распределению."""
+    if distribution == "clustered":
+        sigma = max(1.0, grid / 20)
+        points = []
+        for _ in range(count):
+            cx, cy = rng.choice(centers)
+            x = min(grid - 1, max(0, round(rng.gauss(cx, sigma))))
+            y = min(grid - 1, max(0, round(rng.gauss(cy, sigma))))
+            points.append((x, y))
+        return points
+    return [(rng.randrange(grid), rng.randrange(grid)) for _ in range(count)]
+
+
+def percentile(values, p: float) -> float:
+    """Перцентиль по методу ближайшего ранга."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(p / 100 * len(ordered) + 0.5) - 1))
+    return ordered[rank]
+
+
+async def seed_drivers(redis_client, points):
+    """Размещает водителей на сетке тем же путем, что и эндпоинт presence."""
+    from src.schemas.driver import DriverPresenceSchema, DriverLocationSchema, DriverStatus
+    from src.services.driver_profile_service import DriverProfileService
+
+    profile_service = DriverProfileService(redis=redis_client)
+    for start in range(0, len(points), SEED_CHUNK):
+        await asyncio.gather(*[
+            profile_service.update_presence(
+                driver_id,
+                DriverPresenceSchema(
+                    status=DriverStatus.ONLINE,
+                    location=DriverLocationSchema(x=x, y=y),
+                ),
+            )
+            for driver_id, (x, y) in enumerate(points[start:start + SEED_CHUNK], start=start + 1)
+        ])
+
+
+async def run_case(redis_client, counter: CommandCounter, mode: str, distribution: str, args) -> dict:
+    """Прогоняет один сценарий и возвращает его метрики."""
+    from src.core.config import settings
+    from src.services.matching_service import DriverMatchingService
+
+    rng = random.Random(f"{args.seed}:{distribution}")
+    grid = args.grid
+    centers = [(rng.randrange(grid), rng.randrange(grid)) for _ in range(args.clusters)]
+    num_drivers = args.drivers
+    if distribution == "sparse":
+        num_drivers = max(1, args.drivers // SPARSE_FACTOR)
+
+    await redis_client.flushdb()
+    await seed_drivers(redis_client, generate_points(distribution, num_drivers, grid, rng, centers))
+    keyspace = await keyspace_usage(redis_client)
+    order_points = generate_points(distribution, args.orders, grid, rng, centers)
+
+    matcher = DriverMatchingService(redis=redis_client, search_mode=mode)
+    if matcher.grid_index is not None:
+        await matcher.grid_index.load_snapshot(redis_client, settings.DRIVER_PRESENCE_STREAM, matcher.layout)
+    await matcher._ensure_consumer_group()
+
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for i, (x, y) in enumerate(order_points):
+            pipe.xadd(matcher.STREAM_KEY, {
+                "event": "OrderCreated",
+                "data": json.dumps({
+                    "ride_id": f"bench_ride_{i}", "start_x": x, "start_y": y,
+                    "end_x": rng.randrange(grid), "end_y": rng.randrange(grid), "price": 100.0,
+                }),
+            })
+        await pipe.execute()
+
+    # Оборачиваем обработку порций сообщений, чтобы замерить время до блокировки
+    latencies = []
+    done = asyncio.Event()
+    handle_messages = matcher._handle_messages
+
+    async def timed_handle_messages(messages):
+        started = time.perf_counter()
+        result = await handle_messages(messages)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        latencies.extend([elapsed_ms] * len(messages))
+        if len(latencies) >= len(order_points):
+            done.set()
+        return result
+
+    matcher._handle_messages = timed_handle_messages
+
+    counter.reset()
+    started = time.perf_counter()
+    listener = asyncio.create_task(matcher._order_events_listener(matcher.consumer_names[0]))
+    try:
+        await asyncio.wait_for(done.wait(), timeout=args.timeout)
+        while matcher._order_tasks:
+            await asyncio.sleep(0)
+    finally:
+        matcher.stop()
+        listener.cancel()
+        for task in list(matcher._order_tasks):
+            task.cancel()
+    duration = time.perf_counter() - started
+    commands, round_trips = counter.commands, counter.round_trips
+
+    matched = await redis_client.zcard(matcher.TIMEOUT_ZSET_KEY)
+    return {
+        "mode": mode,
+        "layout": matcher.layout.name,
+        "distribution": distribution,
+        "grid": grid,
+        "drivers": num_drivers,
+        "orders": len(order_points),
+        "matched": matched,
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "commands_per_match": round(commands / matched, 2) if matched else None,
+        "round_trips_per_match": round(round_trips / matched, 2) if matched else None,
+        "matches_per_sec": round(matched / duration, 1) if duration else None,
+        "duration_sec": round(duration, 3),
+        **keyspace,
+    }
+
+
+async def keyspace_usage(redis_client) -> dict:
+    """Число ключей и занятая память Redis после размещения водителей."""
+    used_memory = None
+    try:
+        used_memory = (await redis_client.info("memory")).get("used_memory")
+    except Exception:
+        pass  # fakeredis не считает память
+    return {"keys": await redis_client.dbsize(), "used_memory": used_memory}
+
+
+def git_commit():
+    """Возвращает короткий хеш текущего коммита или None."""
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Бенчмарк подбора водителей на синтетических городах.")
+    parser.add_argument("--redis-url", help="URL Redis (например redis://127.0.0.1:6379/15). По умолчанию fakeredis.")
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    parser.add_argument("--distributions", nargs="+", choices=DISTRIBUTIONS, default=DISTRIBUTIONS)
+    parser.add_argument("--grid", type=int, default=GRID_SIZE, help="Сторона квадратной сетки города")
+    parser.add_argument("--drivers", type=int, default=NUM_DRIVERS)
+    parser.add_argument("--orders", type=int, default=NUM_ORDERS)
+    parser.add_argument("--clusters", type=int, default=NUM_CLUSTERS, help="Число центров в распределении clustered")
+    parser.add_argument("--batch-size", type=int, help="MATCHING_BATCH_SIZE для прогона")
+    parser.add_argument("--concurrency", type=int, help="MATCHING_MAX_CONCURRENT_ORDERS для прогона")
+    parser.add_argument("--layout", choices=LAYOUTS, help="PRESENCE_STORAGE_LAYOUT для прогона")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--timeout", type=float, default=300.0, help="Таймаут одного сценария в секундах")
+    parser.add_argument("--output", help="Файл для JSON-результатов (по умолчанию stdout)")
+    return parser.parse_args()
+
+
+async def main():
+    args = parse_args()
+
+    # Размер сетки и параметры матчера читаются из настроек при импорте src
+    os.environ["CITY_GRID_N"] = str(args.grid)
+    os.environ["CITY_GRID_M"] = str(args.grid)
+    if args.batch_size:
+        os.environ["MATCHING_BATCH_SIZE"] = str(args.batch_size)
+    if args.concurrency:
+        os.environ["MATCHING_MAX_CONCURRENT_ORDERS"] = str(args.concurrency)
+    if args.layout:
+        os.environ["PRESENCE_STORAGE_LAYOUT"] = args.layout
+    logging.basicConfig(level=logging.WARNING)
+    logging.getLogger("src").setLevel(logging.ERROR)
+
+    counter = CommandCounter()
+    if args.redis_url:
+        import redis.asyncio as aioredis
+        redis_client = make_counting_client(aioredis.Redis, counter).from_url(
+            args.redis_url, decode_responses=True
+        )
+    else:
+        from fakeredis.aioredis import FakeRedis
+        redis_client = make_counting_client(FakeRedis, counter)(decode_responses=True)
+
+    results = []
+    try:
+        for distribution in args.distributions:
+            for mode in args.modes:
+                result = await run_case(redis_client, counter, mode, distribution, args)
+                results.append(result)
+                print(
+                    f"{distribution:>9} | {mode:>5} | подобрано {result['matched']}/{result['orders']} | "
+                    f"p50 {result['p50_ms']} мс, p95 {result['p95_ms']} мс, p99 {result['p99_ms']} мс | "
+                    f"{result['commands_per_match']} команд/подбор | {result['matches_per_sec']} подборов/с | "
+                    f"{result['keys']} ключей",
+                    file=sys.stderr,
+                )
+        await redis_client.flushdb()
+    finally:
+        await redis_client.aclose()
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "backend": "redis" if args.redis_url else "fakeredis",
+        "params": {
+            "grid": args.grid, "drivers": args.drivers, "orders": args.orders,
+            "clusters": args.clusters, "batch_size": args.batch_size,
+            "concurrency": args.concurrency, "layout": args.layout, "seed": args.seed,
+        },
+        "results": results,
+    }
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        Path(args.output).write_text(output, encoding="utf-8")
+        print(f"✅ Результаты сохранены в {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -17,6 +17,10 @@ REDIS_PORT = 6379
 NUM_DRIVERS = 100   
 GRID_N = 100
 GRID_M = 100
+TILE_SIZES = (8, 32)  # как GEO_TILE_SIZES в src/services/grid_search.py
+# Схема хранения геоиндекса: должна совпадать с PRESENCE_STORAGE_LAYOUT сервиса
+PRESENCE_LAYOUT = "classic"  # "classic" или "compact"
+LOCATION_BUCKET_SIZE = 100  # как PresenceLayout.LOCATION_BUCKET_SIZE
 
 HEARTBEAT_REQUESTS = 1000
 MATCHING_REQUESTS = 100    
@@ -30,11 +34,16 @@ async def setup_drivers(redis_client):
 
     for i in range(1, NUM_DRIVERS + 1):
         x, y = random.randint(0, GRID_N - 1), random.randint(0, GRID_M - 1)
-        cell_key = f"cell:{x}:{y}"
-        location_key = f"driver_location:{i}"
-        
-        pipe.hset(cell_key, str(i), "online")
-        pipe.set(location_key, f"{x}:{y}")
+        if PRESENCE_LAYOUT == "compact":
+            # Множество ID в ячейке и упакованная локация x * M + y в хеше-корзине
+            pipe.sadd(f"cellset:{x}:{y}", i)
+            pipe.hset(f"driver_locations:{i // LOCATION_BUCKET_SIZE}", str(i), x * GRID_M + y)
+        else:
+            pipe.hset(f"cell:{x}:{y}", str(i), "online")
+            pipe.set(f"driver_location:{i}", f"{x}:{y}")
+        # Счетчики тайлов, по которым матчер отсекает пустые области
+        for size in TILE_SIZES:
+            pipe.incr(f"tile:{size}:{x // size}:{y // size}")
 
     await pipe.execute()
     print("✅ Водители размещены на карте.")
@@ -3,20 +3,41 @@
 from typing import Optional
 from fastapi import HTTPException, status, Query, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 import jwt
 
 from src.core.config import settings
-from src.core.db import get_async_session
+from src.core.db import async_session_maker
 from src.models.user import User
+from src.services.user_cache import verified_user_cache
 
 security = HTTPBearer()
 
 
+async def _user_exists(user_id: int) -> bool:
+    """
+    Проверяет, что пользователь существует в базе данных.
+    Подтвержденные ID кешируются в памяти процесса (verified_user_cache),
+    поэтому повторные запросы того же пользователя не обращаются к БД.
+
+    При промахе кеша используется собственная короткая сессия: соединение
+    возвращается в пул сразу после проверки, а эндпоинтам, которым БД не
+    нужна (например, heartbeat водителя), сессия не навязывается.
+    """
+    if verified_user_cache.contains(user_id):
+        return True
+
+    async with async_session_maker() as session:
+        result = await session.execute(select(User.id).where(User.id == user_id))
+        if result.scalar_one_or_none() is None:
+            return False
+
+    verified_user_cache.add(user_id)
+    return True
+
+
 async def get_current_user_id(
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: AsyncSession = Depends(get_async_session)
 ) -> int:
     """
     Извлекает и валидирует JWT токен, возвращает ID текущего пользователя.
@@ -42,10 +63,8 @@ async def get_current_user_id(
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    # Проверяем, что пользователь существует в базе данных
-    result = await db.execute(select(User).where(User.id == int(user_id)))
-    user = result.scalar_one_or_none()
-    if user is None:
+    # Проверяем, что пользователь существует в базе данных (или недавно подтвержден)
+    if not await _user_exists(int(user_id)):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Пользователь не найден",
@@ -57,7 +76,6 @@ async def get_current_user_id(
 
 async def get_current_user_id_websocket(
     token: Optional[str] = Query(None, description="Токен аутентификации для WebSocket"),
-    db: AsyncSession = Depends(get_async_session)
 ) -> int:
     """
     Валидация JWT токена для WebSocket соединений.
@@ -88,10 +106,8 @@ async def get_current_user_id_websocket(
             detail="Неверный токен"
         )
     
-    # Проверяем, что пользователь существует в базе данных
-    result = await db.execute(select(User).where(User.id == int(user_id)))
-    user = result.scalar_one_or_none()
-    if user is None:
+    # Проверяем, что пользователь существует в базе данных (или недавно подтвержден)
+    if not await _user_exists(int(user_id)):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Пользователь не найден"
@@ -1,14 +1,51 @@
 """API эндпоинт для WebSocket-уведомлений."""
 
 import logging
+from typing import Optional
+
+import redis.asyncio as aioredis
 from fastapi import APIRouter, Depends, WebSocket, WebSocketDisconnect
+from pydantic import ValidationError
 
+from src.core.config import settings
+from src.core.redis import redis_pool
+from src.schemas.driver import DriverPresenceSchema, DriverLocationSchema, DriverStatus
+from src.services.driver_profile_service import DriverProfileService, PresenceBatcher
 from src.services.notification_service import notification_manager
 from .dependencies import get_current_user_id_websocket
 
 router = APIRouter(prefix="/notifications", tags=["Notifications"])
 logger = logging.getLogger(__name__)
 
+# Обновления присутствия по WebSocket идут через общий клиент пула,
+# скрипт регистрируется один раз на процесс
+presence_service = DriverProfileService(aioredis.Redis(connection_pool=redis_pool))
+presence_batcher: Optional[PresenceBatcher] = None
+if settings.PRESENCE_WS_BATCH_WINDOW_MS > 0:
+    presence_batcher = PresenceBatcher(presence_service, settings.PRESENCE_WS_BATCH_WINDOW_MS)
+
+# Префикс компактного кадра присутствия: "p:<status>:<x>:<y>", например "p:online:10:12"
+PRESENCE_FRAME_PREFIX = "p:"
+
+
+def parse_presence_frame(frame: str) -> DriverPresenceSchema:
+    """
+    Разбирает компактный кадр присутствия "p:<status>:<x>:<y>".
+
+    Raises:
+        ValueError: если кадр некорректен.
+    """
+    parts = frame.split(":")
+    if len(parts) != 4:
+        raise ValueError("Ожидается кадр вида p:<status>:<x>:<y>")
+    try:
+        return DriverPresenceSchema(
+            status=DriverStatus(parts[1]),
+            location=DriverLocationSchema(x=int(parts[2]), y=int(parts[3])),
+        )
+    except ValidationError as e:
+        raise ValueError(str(e)) from e
+
 
 @router.websocket("/ws")
 async def websocket_endpoint(
@@ -22,6 +59,9 @@ async def websocket_endpoint(
     ws://<host>/api/v1/notifications/ws?token=<jwt_token>
 
     Принимает соединение и держит его открытым, пока клиент не отключится.
+    Водитель может отправлять по этому соединению heartbeat в виде кадров
+    "p:<status>:<x>:<y>" вместо PUT /api/v1/drivers/me/presence: личность
+    установлена при подключении, поэтому обновление стоит один вызов скрипта в Redis.
     """
     await notification_manager.connect(user_id, websocket)
     try:
@@ -32,8 +72,27 @@ async def websocket_endpoint(
 
             if data == "ping":
                 await websocket.send_text("pong")
+            elif data.startswith(PRESENCE_FRAME_PREFIX):
+                try:
+                    presence_data = parse_presence_frame(data)
+                except ValueError as e:
+                    await websocket.send_json({"type": "PRESENCE_ERROR", "data": {"detail": str(e)}})
+                    continue
+
+                if presence_batcher is not None:
+                    presence_batcher.submit(user_id, presence_data)
+                    continue
+                try:
+                    await presence_service.update_presence(user_id, presence_data)
+                except Exception as e:
+                    # Сбой Redis не должен разрывать соединение: следующий heartbeat повторит обновление
+                    logger.error(f"Ошибка обновления присутствия водителя {user_id}: {e}", exc_info=True)
+                    await websocket.send_json({
+                        "type": "PRESENCE_ERROR",
+                        "data": {"detail": "Не удалось обновить присутствие, повторите позже"},
+                    })
 
     except WebSocketDisconnect:
         logger.info(f"Клиент {user_id} отключился.")
     finally:
-        notification_manager.disconnect(user_id)
\ No newline at end of file
+        notification_manager.disconnect(user_id)
@@ -1,29 +1,37 @@
 # ИЗМЕНЕНО
 """
 Эндпоинты для работы с поездками (rides).
-Добавлены: accept, update_status, history.
+Добавлены: accept, update_status, history, bulk.
 """
 
-from fastapi import APIRouter, Depends, HTTPException, status
+import logging
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
 from sqlalchemy.ext.asyncio import AsyncSession
-from typing import List
+from typing import List, Literal, Optional
+
+from pydantic import TypeAdapter, ValidationError
 
 from src.schemas.ride import (
     RideCreateSchema,
     RideResponseSchema,
     RideStatusUpdateSchema,
 )
+from src.core.config import settings
 from src.core.db import get_async_session
 from src.api.v1.dependencies import get_current_user_id
 
 from src.services.rides_service import (
     create_ride as create_ride_service,
+    create_rides_bulk as create_rides_bulk_service,
     assign_driver as assign_driver_service,
     update_ride_status as update_status_service,
     get_user_rides as get_user_rides_service,
+    get_ride as get_ride_service,
 )
 
 router = APIRouter(prefix="/rides", tags=["Rides"])
+logger = logging.getLogger(__name__)
 
 
 # POST /rides — создание заказа
@@ -43,6 +51,80 @@ async def create_ride(
         raise HTTPException(status_code=500, detail=str(exc))
 
 
+_ride_list_adapter = TypeAdapter(List[RideCreateSchema])
+
+
+def _parse_bulk_rides(body: bytes, content_type: str) -> List[RideCreateSchema]:
+    """
+    Разбирает тело массового заказа: JSON-массив или NDJSON (по поездке на строку).
+    Ошибки валидации — 422 с номером строки NDJSON.
+    """
+    if content_type.split(";")[0].strip() == "application/x-ndjson":
+        rides = []
+        for line_no, line in enumerate(body.splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                rides.append(RideCreateSchema.model_validate_json(line))
+            except ValidationError as e:
+                raise HTTPException(
+                    status_code=422,
+                    detail=f"Строка {line_no}: {e.errors(include_url=False)}",
+                )
+        return rides
+
+    try:
+        return _ride_list_adapter.validate_json(body)
+    except ValidationError as e:
+        raise HTTPException(
+            status_code=422,
+            detail=e.errors(include_url=False),
+        )
+
+
+# POST /rides/bulk — массовое создание заказов (JSON-массив или NDJSON)
+# Все поездки создаются одной транзакцией; ответ — в порядке входных данных
+@router.post(
+    "/bulk",
+    response_model=List[RideResponseSchema],
+    status_code=status.HTTP_201_CREATED,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {
+                    "schema": {"type": "array", "items": RideCreateSchema.model_json_schema()}
+                },
+                "application/x-ndjson": {"schema": {"type": "string"}},
+            },
+        }
+    },
+)
+async def create_rides_bulk(
+    request: Request,
+    db: AsyncSession = Depends(get_async_session),
+    current_user_id: int = Depends(get_current_user_id),
+):
+    rides_data = _parse_bulk_rides(await request.body(), request.headers.get("content-type", ""))
+    if not rides_data:
+        raise HTTPException(status_code=422, detail="Пустой список поездок")
+    if len(rides_data) > settings.RIDES_BULK_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Не более {settings.RIDES_BULK_MAX_ITEMS} поездок в одном запросе",
+        )
+
+    try:
+        return await create_rides_bulk_service(
+            rides_data=rides_data,
+            passenger_user_id=current_user_id,
+            db=db
+        )
+    except Exception as exc:
+        logger.error(f"Ошибка массового создания поездок: {exc}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(exc))
+
+
 # POST /rides/{id}/accept — водитель принимает заказ
 @router.post("/{ride_id}/accept", response_model=RideResponseSchema)
 async def accept_ride(
@@ -56,6 +138,8 @@ async def accept_ride(
             driver_user_id=current_user_id,
             db=db
         )
+    except HTTPException:
+        raise
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as exc:
@@ -74,8 +158,11 @@ async def update_ride_status(
         return await update_status_service(
             ride_id=str(ride_id),
             new_status=status_update.status,
-            db=db
+            db=db,
+            expected_version=status_update.version,
         )
+    except HTTPException:
+        raise
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as exc:
@@ -84,16 +171,63 @@ async def update_ride_status(
 
 
 # GET /rides/history — история поездок
+# Страницы от новых к старым; курсор следующей страницы — в заголовке X-Next-Cursor
 @router.get("/history", response_model=List[RideResponseSchema])
 async def get_user_rides(
+    response: Response,
+    role: Literal["passenger", "driver"] = Query("passenger", description="История пассажира или водителя"),
+    limit: int = Query(20, ge=1, le=100, description="Поездок на странице"),
+    cursor: Optional[str] = Query(None, description="Значение X-Next-Cursor предыдущей страницы"),
     db: AsyncSession = Depends(get_async_session),
     current_user_id: int = Depends(get_current_user_id),
 ):
     try:
-        return await get_user_rides_service(
+        rides, next_cursor = await get_user_rides_service(
             user_id=current_user_id,
-            db=db
+            db=db,
+            role=role,
+            limit=limit,
+            cursor=cursor,
         )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as exc:
         print(f"Error getting history: {exc}")
         raise HTTPException(status_code=500, detail=str(exc))
+
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return rides
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Проверяет заголовок If-None-Match (список тегов, в том числе слабых W/"...")."""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return etag in candidates or "*" in candidates
+
+
+# GET /rides/{id} — карточка поездки для опроса статуса
+# Объявлен после /history, чтобы не перехватывать его путь
+@router.get("/{ride_id}", response_model=RideResponseSchema)
+async def get_ride(
+    ride_id: int,
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_async_session),
+    current_user_id: int = Depends(get_current_user_id),
+):
+    """
+    Возвращает поездку из кеша Redis (при промахе — из БД).
+    ETag соответствует версии поездки: при совпадении с If-None-Match
+    возвращается 304 без тела.
+    """
+    ride, version = await get_ride_service(ride_id=ride_id, user_id=current_user_id, db=db)
+
+    headers = {"ETag": f'"{ride_id}-{version}"', "Cache-Control": "private, no-cache"}
+    if _etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    response.headers.update(headers)
+    return ride
@@ -43,12 +43,74 @@ class Settings(BaseSettings):
     JWT_SECRET_KEY: str
     JWT_ALGORITHM: str = "HS256"
     JWT_ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
+    # Кеш проверенных пользователей в процессе API (0 — проверять в БД каждый запрос)
+    USER_CACHE_TTL_SEC: float = 60.0
+    USER_CACHE_MAX_SIZE: int = 100_000
+    USER_CACHE_INVALIDATION_CHANNEL: str = "user_invalidations"  # Pub/Sub канал сброса кеша
+    # Хеширование паролей bcrypt в отдельных процессах: размер пула и число
+    # запросов, ожидающих свободный процесс (сверх него — 503)
+    PASSWORD_HASH_WORKERS: int = 2
+    PASSWORD_HASH_MAX_QUEUE: int = 32
+    # Доставка событий поездок из таблицы outbox_events в Redis Streams
+    OUTBOX_RELAY_BATCH_SIZE: int = 500          # событий за одну транзакцию и один пайплайн XADD
+    OUTBOX_RELAY_INTERVAL_SEC: float = 0.1      # пауза, когда очередь outbox пуста
+    # Общий публикатор событий в Redis Streams (src/services/redis_publisher.py)
+    EVENT_PUBLISHER_QUEUE_SIZE: int = 10_000    # событий в очереди, сверх — отказ
+    EVENT_PUBLISHER_BATCH_SIZE: int = 256       # событий в одном пайплайне XADD
+    EVENT_PUBLISHER_MAXLEN: int = 0             # MAXLEN ~ для потоков (0 — без обрезки)
+    # Кеш карточек поездок для GET /rides/{id} (ключ ride:{id}, версия Ride.version)
+    RIDE_CACHE_TTL_SEC: int = 300
+    # Массовое создание поездок (POST /rides/bulk)
+    RIDES_BULK_MAX_ITEMS: int = 5_000           # поездок в одном запросе, сверх — 413
+    RIDES_BULK_INSERT_CHUNK: int = 1_000        # строк в одном INSERT ... RETURNING
 
     # Параметры ценообразования
     PRICE_BASE_FARE: float = 50.0       # базовая стоимость
     PRICE_PER_CELL: float = 5.0         # стоимость за 1 ячейку (манхэттен)
     PRICE_T_CELL: float = 10.0          # время (в секундах) на 1 ячейку
 
+    # Параметры подбора водителя
+    # Режим поиска: "redis" — опрос ячеек cell:X:Y в Redis,
+    # "local" — поиск по in-memory индексу занятости сетки,
+    # "lua" — поиск и блокировка одним серверным скриптом (EVALSHA)
+    MATCHING_SEARCH_MODE: str = "redis"
+    MATCHING_MAX_SEARCH_RADIUS: int = 20        # манхэттенский радиус поиска водителя
+    # Отсечение пустых областей по счетчикам тайлов tile:{8|32}:TX:TY,
+    # которые ведет скрипт присутствия (при старте матчер пересчитывает их по ячейкам)
+    MATCHING_TILE_PRUNING: bool = True
+    # Пакетный подбор: до MATCHING_BATCH_SIZE заказов за окно MATCHING_BATCH_WINDOW_MS
+    # назначаются совместно (1 — жадная обработка по одному заказу)
+    MATCHING_BATCH_SIZE: int = 1
+    MATCHING_BATCH_WINDOW_MS: int = 50
+    MATCHING_BATCH_CANDIDATES: int = 5      # ближайших свободных кандидатов на заказ
+    # Масштабирование потребителей order_events
+    MATCHING_CONSUMER_TASKS: int = 1            # задач-слушателей в одном процессе
+    MATCHING_CONSUMER_HEARTBEAT_SEC: float = 5.0
+    MATCHING_CONSUMER_TTL_SEC: float = 30.0     # без heartbeat дольше — потребитель мертв
+    MATCHING_CLAIM_MIN_IDLE_MS: int = 60_000    # простой записи PEL перед XAUTOCLAIM
+    # Параллельная обработка заказов внутри процесса: заказы с пересекающимися
+    # областями поиска сериализуются по регионам сетки MATCHING_REGION_SIZE×MATCHING_REGION_SIZE
+    MATCHING_MAX_CONCURRENT_ORDERS: int = 32    # одновременно обрабатываемых заказов
+    MATCHING_REGION_SIZE: int = 0               # 0 — равен радиусу поиска
+    # Повторный поиск после таймаута предложения
+    MATCHING_RETRY_MAX_ATTEMPTS: int = 5
+    MATCHING_RETRY_RADIUS_STEP: int = 5         # расширение радиуса поиска с каждой попыткой
+    MATCHING_EXPIRY_BATCH_SIZE: int = 500       # истекших предложений за один вызов скрипта
+    DRIVER_PRESENCE_STREAM: str = "driver_presence_events"  # лента изменений присутствия
+    DRIVER_PRESENCE_STREAM_MAXLEN: int = 100_000            # примерная длина ленты (MAXLEN ~)
+    # Водитель без heartbeat дольше DRIVER_PRESENCE_TTL_SEC снимается с линии
+    DRIVER_PRESENCE_TTL_SEC: float = 30.0
+    DRIVER_SWEEP_BATCH_SIZE: int = 500          # водителей за один вызов скрипта вытеснения
+    # Схема хранения геоиндекса в Redis: "classic" (хеши cell:X:Y и ключ на водителя)
+    # или "compact" (intset-множества cellset:X:Y и упакованные локации в хешах-корзинах)
+    PRESENCE_STORAGE_LAYOUT: str = "classic"
+    # Обновления присутствия по WebSocket: окно пакетирования между соединениями
+    # (0 — каждое обновление записывается сразу отдельным вызовом скрипта)
+    PRESENCE_WS_BATCH_WINDOW_MS: int = 0
+    # Отложенная запись состояния водителей в таблицу drivers
+    DRIVER_STATE_FLUSH_INTERVAL_SEC: float = 5.0
+    DRIVER_STATE_REBUILD_ON_STARTUP: bool = True    # восстановить геоиндекс из БД, если Redis пуст
+
     model_config = ConfigDict(
         env_file=(".env", ".env.local"),
         env_file_encoding="utf-8",
@@ -1,6 +1,9 @@
 """"Модуль для настройки асинхронного взаимодействия с базой данных с использованием SQLAlchemy."""
 
-from typing import AsyncGenerator
+import time
+from contextvars import ContextVar
+from typing import Any, AsyncGenerator, Dict, MutableMapping, Optional
+from sqlalchemy import event
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import DeclarativeBase
 
@@ -21,6 +24,73 @@ async_session_maker = async_sessionmaker(
 )
 
 
+# ASGI scope текущего HTTP-запроса: по нему выдача соединения из пула
+# относится к маршруту. Устанавливается middleware в src/main.py.
+request_scope_var: ContextVar[Optional[MutableMapping[str, Any]]] = ContextVar("request_scope", default=None)
+
+
+class PoolCheckoutMetrics:
+    """
+    Счетчики выдачи соединений из пула SQLAlchemy по маршрутам API.
+    Показывают, какие эндпоинты держат соединения и как долго.
+    Соединения, взятые вне HTTP-запроса (фоновые задачи), учитываются как "background".
+    """
+
+    def __init__(self):
+        self._routes: Dict[str, Dict[str, float]] = {}
+
+
+    @staticmethod
+    def _route_label() -> str:
+        scope = request_scope_var.get()
+        if scope is None:
+            return "background"
+        route = scope.get("route")
+        path = getattr(route, "path", None) or scope.get("path", "")
+        return f"{scope.get('method', '')} {path}".strip()
+
+
+    def on_checkout(self, dbapi_connection, connection_record, connection_proxy) -> None:
+        route = self._route_label()
+        connection_record.info["checkout_route"] = route
+        connection_record.info["checkout_at"] = time.perf_counter()
+        stats = self._routes.setdefault(
+            route, {"checkouts": 0, "in_use": 0, "held_ms_total": 0.0, "held_ms_max": 0.0}
+        )
+        stats["checkouts"] += 1
+        stats["in_use"] += 1
+
+
+    def on_checkin(self, dbapi_connection, connection_record) -> None:
+        route = connection_record.info.pop("checkout_route", None)
+        started = connection_record.info.pop("checkout_at", None)
+        stats = self._routes.get(route)
+        if stats is None or started is None:
+            return
+        held_ms = (time.perf_counter() - started) * 1000
+        stats["in_use"] -= 1
+        stats["held_ms_total"] += held_ms
+        stats["held_ms_max"] = max(stats["held_ms_max"], held_ms)
+
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Возвращает счетчики по маршрутам (время удержания в миллисекундах)."""
+        return {
+            route: {
+                "checkouts": int(stats["checkouts"]),
+                "in_use": int(stats["in_use"]),
+                "held_ms_avg": round(stats["held_ms_total"] / stats["checkouts"], 2),
+                "held_ms_max": round(stats["held_ms_max"], 2),
+            }
+            for route, stats in self._routes.items()
+        }
+
+
+pool_metrics = PoolCheckoutMetrics()
+event.listen(engine.sync_engine.pool, "checkout", pool_metrics.on_checkout)
+event.listen(engine.sync_engine.pool, "checkin", pool_metrics.on_checkin)
+
+
 class Base(DeclarativeBase):
     """Базовый класс для всех моделей SQLAlchemy."""
     pass
@@ -30,6 +100,10 @@ async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
     """
     Функция-зависимость для FastAPI для получения асинхронной сессии БД.
     Обеспечивает корректное открытие и закрытие сессии для каждого запроса.
+
+    Сессия ленивая: соединение берется из пула только при первом запросе
+    к БД и возвращается при закрытии сессии. Эндпоинт, который к БД не
+    обращается, соединение не занимает.
     """
     async with async_session_maker() as session:
         yield session
\ No newline at end of file
@@ -15,13 +15,20 @@ import redis.asyncio as aioredis
 from src.core.redis import redis_pool
 from src.services.notification_service import notification_manager
 from src.core.logging_config import setup_logging, RequestIdFilter
-from src.core.db import engine, Base
+from src.core.db import engine, Base, async_session_maker, pool_metrics, request_scope_var
+from src.core.config import settings
+from src.services.driver_state_flusher import DriverStateFlusher
+from src.services.outbox import OutboxRelay
+from src.services.redis_publisher import event_publisher
+from src.services.password_hasher import password_hasher
+from src.services.user_cache import user_invalidation_listener, verified_user_cache
 
 # Импортируем модели, чтобы SQLAlchemy увидела их и создала таблицы
 from src.models.user import User
 from src.models.driver import Driver
 from src.models.passenger import Passenger
 from src.models.ride import Ride
+from src.models.outbox import OutboxEvent
 
 # Импортируем роутеры
 from src.api.v1 import drivers as drivers_v1
@@ -73,12 +80,24 @@ async def redis_pubsub_listener():
         logger.info("Подписка на Redis Pub/Sub закрыта.")
 
 
+def _create_missing_indexes(sync_conn) -> None:
+    """Создает индексы моделей, которых еще нет в БД."""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(sync_conn, checkfirst=True)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
     """
     Жизненный цикл:
     1. Создаем таблицы в БД (вместо Alembic).
-    2. Запускаем слушателя Redis.
+    2. Запускаем слушателя Redis и слушателя сброса кеша пользователей.
+    3. Запускаем пакетирование обновлений присутствия по WebSocket (если включено).
+    4. Восстанавливаем геоиндекс Redis из БД (если Redis пуст) и запускаем
+       отложенную запись состояния водителей в БД.
+    5. Запускаем общий публикатор событий и доставку событий поездок
+       из outbox в Redis Streams через него.
     """
     logger.info("Application startup...")
 
@@ -86,15 +105,44 @@ async def lifespan(app: FastAPI) -> AsyncGenerator[None, None]:
     async with engine.begin() as conn:
         # Эта команда создаст все таблицы, если их нет
         await conn.run_sync(Base.metadata.create_all)
+        # create_all не добавляет новые индексы в уже существующие таблицы
+        await conn.run_sync(_create_missing_indexes)
     logger.info("Database tables created successfully.")
 
+    driver_state_flusher = DriverStateFlusher(aioredis.Redis(connection_pool=redis_pool), async_session_maker)
+    if settings.DRIVER_STATE_REBUILD_ON_STARTUP:
+        await driver_state_flusher.rebuild_redis_index()
+    flusher_task = asyncio.create_task(driver_state_flusher.run())
+
+    publisher_task = asyncio.create_task(event_publisher.run())
+    outbox_relay = OutboxRelay(event_publisher, async_session_maker)
+    app.state.outbox_relay = outbox_relay
+    relay_task = asyncio.create_task(outbox_relay.run())
+
     listener_task = asyncio.create_task(redis_pubsub_listener())
+    user_cache_task = asyncio.create_task(user_invalidation_listener())
+    batcher_task = None
+    if notifications_v1.presence_batcher is not None:
+        batcher_task = asyncio.create_task(notifications_v1.presence_batcher.run())
 
     yield
 
     logger.info("Application shutdown...")
     listener_task.cancel()
     await listener_task
+    user_cache_task.cancel()
+    await user_cache_task
+    if batcher_task is not None:
+        batcher_task.cancel()
+        await batcher_task
+    flusher_task.cancel()
+    await flusher_task
+    relay_task.cancel()
+    await relay_task
+    # Публикатор останавливается последним и отправляет оставшиеся события
+    publisher_task.cancel()
+    await publisher_task
+    password_hasher.shutdown()
     await redis_pool.disconnect()
     logger.info("Redis pool disconnected.")
 
@@ -116,7 +164,8 @@ app.add_middleware(
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-    allow_headers=["Content-Type", "Authorization"],
+    allow_headers=["Content-Type", "Authorization", "If-None-Match"],
+    expose_headers=["X-Next-Cursor", "ETag"],
 )
 
 
@@ -124,6 +173,8 @@ app.add_middleware(
 async def add_request_id_middleware(request: Request, call_next):
     request_id = str(uuid.uuid4())
     request_id_var.set(request_id)
+    # Маршрут для метрик выдачи соединений из пула БД
+    request_scope_var.set(request.scope)
     fastapi_logger = logging.getLogger("fastapi")
     filter = RequestIdFilter(request_id_storage=request_id_var)
     fastapi_logger.addFilter(filter)
@@ -143,4 +194,25 @@ app.include_router(rides_v1.router, prefix="/api/v1", tags=["Rides"])
 
 @app.get("/healthcheck", tags=["Healthcheck"])
 async def healthcheck():
-    return {"status": "ok"}
\ No newline at end of file
+    return {"status": "ok"}
+
+
+@app.get("/metrics", tags=["Healthcheck"])
+async def metrics():
+    """
+    Счетчики процесса API: кеш пользователей, очередь хеширования паролей,
+    выдача соединений из пула БД по маршрутам, публикатор событий и отставание outbox.
+    """
+    outbox_relay = getattr(app.state, "outbox_relay", None)
+    return {
+        "user_cache": verified_user_cache.stats(),
+        "password_hasher": password_hasher.stats(),
+        "db_pool": {
+            "size": engine.pool.size(),
+            "checked_out": engine.pool.checkedout(),
+            "overflow": engine.pool.overflow(),
+            "routes": pool_metrics.stats(),
+        },
+        "event_publisher": event_publisher.stats(),
+        "outbox": outbox_relay.stats() if outbox_relay else None,
+    }
\ No newline at end of file
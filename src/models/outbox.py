@@ -0,0 +1,37 @@
+"""
+SQLAlchemy-модель исходящего события (transactional outbox).
+Событие пишется в той же транзакции, что и изменение поездки,
+и доставляется в Redis Streams фоновым OutboxRelay.
+"""
+
+from __future__ import annotations
+from datetime import datetime
+
+from sqlalchemy import BigInteger, DateTime, String, Text
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy.sql import func
+
+from src.core.db import Base
+
+
+class OutboxEvent(Base):
+    """
+    Событие, ожидающее публикации в поток Redis.
+    Строка удаляется после успешной публикации.
+    """
+    __tablename__ = "outbox_events"
+
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True)
+
+    stream: Mapped[str] = mapped_column(String(64), nullable=False)
+    event: Mapped[str] = mapped_column(String(64), nullable=False)
+    payload: Mapped[str] = mapped_column(Text, nullable=False)  # JSON
+
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        nullable=False
+    )
+
+    def __repr__(self) -> str:
+        return f"<OutboxEvent id={self.id} stream={self.stream} event={self.event}>"
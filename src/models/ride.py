@@ -6,6 +6,7 @@ SQLAlchemy-модель поездки (Ride).
 from __future__ import annotations
 from datetime import datetime
 from enum import Enum
+from typing import Dict, FrozenSet, List
 
 from sqlalchemy import (
     Integer,
@@ -14,6 +15,7 @@ from sqlalchemy import (
     String,
     DECIMAL,
     DateTime,
+    Index,
 )
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from sqlalchemy.sql import func
@@ -32,6 +34,24 @@ class RideStatusEnum(str, Enum):
     COMPLETED = "completed"
     CANCELLED = "cancelled"
 
+    @classmethod
+    def allowed_from(cls, target: str) -> List[str]:
+        """Возвращает статусы, из которых разрешен переход в `target`."""
+        return [source.value for source, targets in RIDE_STATUS_TRANSITIONS.items() if target in targets]
+
+
+# Таблица допустимых переходов статуса поездки: из статуса -> в статусы.
+# Переход выполняется одним условным UPDATE (см. rides_service._transition_ride).
+RIDE_STATUS_TRANSITIONS: Dict[RideStatusEnum, FrozenSet[RideStatusEnum]] = {
+    RideStatusEnum.PENDING: frozenset({RideStatusEnum.DRIVER_ASSIGNED, RideStatusEnum.CANCELLED}),
+    RideStatusEnum.DRIVER_ASSIGNED: frozenset({RideStatusEnum.DRIVER_ARRIVED, RideStatusEnum.CANCELLED}),
+    RideStatusEnum.DRIVER_ARRIVED: frozenset({RideStatusEnum.PASSENGER_ONBOARD, RideStatusEnum.CANCELLED}),
+    RideStatusEnum.PASSENGER_ONBOARD: frozenset({RideStatusEnum.IN_PROGRESS}),
+    RideStatusEnum.IN_PROGRESS: frozenset({RideStatusEnum.COMPLETED}),
+    RideStatusEnum.COMPLETED: frozenset(),
+    RideStatusEnum.CANCELLED: frozenset(),
+}
+
 
 class Ride(Base):
     """
@@ -87,5 +107,11 @@ class Ride(Base):
         backref="rides_as_driver"
     )
 
+    # История поездок: keyset-пагинация по (created_at, id) от новых к старым
+    __table_args__ = (
+        Index("ix_rides_passenger_history", "passenger_user_id", created_at.desc(), id.desc()),
+        Index("ix_rides_driver_history", "driver_user_id", created_at.desc(), id.desc()),
+    )
+
     def __repr__(self) -> str:
         return f"<Ride id={self.id} status={self.status} passenger={self.passenger_user_id} driver={self.driver_user_id}>"
@@ -48,3 +48,6 @@ class RideStatusUpdateSchema(BaseModel):
         "completed",
         "cancelled"
     ] = Field(..., description="Новый статус поездки")
+    version: Optional[int] = Field(
+        None, description="Ожидаемая версия поездки (из ETag); при несовпадении — 409"
+    )
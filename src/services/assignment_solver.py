@@ -0,0 +1,97 @@
+"""
+Решение задачи о назначениях (min-cost assignment) для пакетного подбора водителей.
+
+Реализован венгерский алгоритм с потенциалами за O(n^2 * m) для прямоугольной
+матрицы стоимостей n×m. Размеры пакета заказов невелики (десятки заказов
+и сотни кандидатов), поэтому чистого Python достаточно.
+"""
+
+from typing import List, Optional, Sequence
+
+# Стоимость "запрещенной" пары (водитель не является кандидатом для заказа)
+INF_COST = float("inf")
+
+
+def solve_min_cost_assignment(cost: Sequence[Sequence[float]]) -> List[Optional[int]]:
+    """
+    Находит назначение строк на столбцы с минимальной суммарной стоимостью.
+
+    Args:
+        cost: Матрица стоимостей (строки — заказы, столбцы — водители).
+              Значение INF_COST означает, что пара недопустима.
+
+    Returns:
+        Для каждой строки — индекс назначенного столбца или None, если строка
+        осталась без допустимой пары.
+    """
+    rows = len(cost)
+    cols = len(cost[0]) if rows else 0
+    if rows == 0 or cols == 0:
+        return [None] * rows
+
+    # Алгоритм требует rows <= cols: иначе решаем транспонированную задачу
+    if rows > cols:
+        transposed = [[cost[r][c] for r in range(rows)] for c in range(cols)]
+        col_to_row = solve_min_cost_assignment(transposed)
+        result: List[Optional[int]] = [None] * rows
+        for c, r in enumerate(col_to_row):
+            if r is not None:
+                result[r] = c
+        return result
+
+    # Недопустимые пары заменяем большой конечной стоимостью, чтобы потенциалы
+    # оставались конечными; такие назначения отбрасываются в конце
+    finite = [v for row in cost for v in row if v != INF_COST]
+    big = (max(finite) if finite else 0.0) * (rows + 1) + 1.0
+    a = [[big if v == INF_COST else float(v) for v in row] for row in cost]
+
+    # Классическая реализация с 1-индексацией: p[j] — строка, назначенная столбцу j
+    u = [0.0] * (rows + 1)
+    v = [0.0] * (cols + 1)
+    p = [0] * (cols + 1)
+    way = [0] * (cols + 1)
+
+    for i in range(1, rows + 1):
+        p[0] = i
+        j0 = 0
+        minv = [float("inf")] * (cols + 1)
+        used = [False] * (cols + 1)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            delta = float("inf")
+            j1 = 0
+            row = a[i0 - 1]
+            for j in range(1, cols + 1):
+                if not used[j]:
+                    cur = row[j - 1] - u[i0] - v[j]
+                    if cur < minv[j]:
+                        minv[j] = cur
+                        way[j] = j0
+                    if minv[j] < delta:
+                        delta = minv[j]
+                        j1 = j
+            for j in range(cols + 1):
+                if used[j]:
+                    u[p[j]] += delta
+                    v[j] -= delta
+                else:
+                    minv[j] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        # Разворачиваем увеличивающую цепочку
+        while True:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+            if j0 == 0:
+                break
+
+    assignment: List[Optional[int]] = [None] * rows
+    for j in range(1, cols + 1):
+        if p[j]:
+            r = p[j] - 1
+            if cost[r][j - 1] != INF_COST:
+                assignment[r] = j - 1
+    return assignment
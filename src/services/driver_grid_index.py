@@ -0,0 +1,152 @@
+"""
+In-memory индекс занятости сетки города для DriverMatchingService.
+
+Хранит для каждой ячейки количество онлайн-водителей и их ID, чтобы поиск
+ближайшего водителя выполнялся сканированием памяти, а не запросами HKEYS
+к Redis. Индекс синхронизируется с лентой присутствия, которую пишет
+DriverProfileService.update_presence.
+"""
+
+import logging
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from redis.asyncio import Redis
+
+from src.schemas.driver import DriverStatus
+from src.services.presence_layout import PresenceLayout
+
+logger = logging.getLogger(__name__)
+
+
+class DriverGridIndex:
+    """
+    Индекс онлайн-водителей по ячейкам сетки N×M.
+
+    - `_counts` — плоская сетка счетчиков (индекс ячейки = x * M + y),
+      позволяет пропускать пустые ячейки без обращения к словарям.
+    - `_cells` — множества ID водителей для непустых ячеек.
+    - `_positions` — текущая ячейка каждого водителя (для перемещений).
+    """
+
+    def __init__(self, grid_n: int, grid_m: int):
+        self.grid_n = grid_n
+        self.grid_m = grid_m
+        self._counts: List[int] = [0] * (grid_n * grid_m)
+        self._cells: Dict[int, Set[int]] = {}
+        self._positions: Dict[int, int] = {}
+
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+
+    def _cell_index(self, x: int, y: int) -> Optional[int]:
+        """Возвращает индекс ячейки или None, если координаты вне сетки."""
+        if 0 <= x < self.grid_n and 0 <= y < self.grid_m:
+            return x * self.grid_m + y
+        return None
+
+
+    def clear(self) -> None:
+        """Полностью очищает индекс."""
+        self._counts = [0] * (self.grid_n * self.grid_m)
+        self._cells.clear()
+        self._positions.clear()
+
+
+    def set_online(self, driver_id: int, x: int, y: int) -> None:
+        """Помещает водителя в ячейку (x, y), убирая его из предыдущей."""
+        cell = self._cell_index(x, y)
+        if cell is None:
+            logger.warning(f"Водитель {driver_id} вне сетки: ({x}, {y}). Пропускаем.")
+            self.remove(driver_id)
+            return
+
+        previous = self._positions.get(driver_id)
+        if previous == cell:
+            return
+        if previous is not None:
+            self._discard(driver_id, previous)
+
+        self._cells.setdefault(cell, set()).add(driver_id)
+        self._counts[cell] += 1
+        self._positions[driver_id] = cell
+
+
+    def remove(self, driver_id: int) -> None:
+        """Убирает водителя из индекса (offline/busy)."""
+        previous = self._positions.pop(driver_id, None)
+        if previous is not None:
+            self._discard(driver_id, previous)
+
+
+    def _discard(self, driver_id: int, cell: int) -> None:
+        drivers = self._cells.get(cell)
+        if drivers and driver_id in drivers:
+            drivers.remove(driver_id)
+            self._counts[cell] -= 1
+            if not drivers:
+                del self._cells[cell]
+
+
+    def apply_event(self, event: Dict[str, str]) -> None:
+        """Применяет событие из ленты присутствия."""
+        try:
+            driver_id = int(event["driver_id"])
+            if event.get("status") == DriverStatus.ONLINE.value:
+                self.set_online(driver_id, int(event["x"]), int(event["y"]))
+            else:
+                self.remove(driver_id)
+        except (KeyError, ValueError, TypeError) as e:
+            logger.error(f"Некорректное событие присутствия {event}: {e}")
+
+
+    def drivers_in_cells(self, cells: Iterable[Tuple[int, int]]) -> List[int]:
+        """Возвращает ID водителей во всех переданных ячейках."""
+        result: List[int] = []
+        counts = self._counts
+        for x, y in cells:
+            cell = self._cell_index(x, y)
+            if cell is not None and counts[cell]:
+                result.extend(self._cells[cell])
+        return result
+
+
+    def drivers_with_cells(self, cells: Iterable[Tuple[int, int]]) -> List[Tuple[int, int, int]]:
+        """Возвращает тройки (driver_id, x, y) для водителей в переданных ячейках."""
+        result: List[Tuple[int, int, int]] = []
+        counts = self._counts
+        for x, y in cells:
+            cell = self._cell_index(x, y)
+            if cell is not None and counts[cell]:
+                result.extend((driver_id, x, y) for driver_id in self._cells[cell])
+        return result
+
+
+    async def load_snapshot(
+        self, redis: Redis, stream_key: str, layout: Optional[PresenceLayout] = None
+    ) -> str:
+        """
+        Заполняет индекс текущими локациями водителей из Redis
+        (в формате схемы хранения `layout`).
+
+        Returns:
+            ID последнего события ленты присутствия на момент начала снимка.
+            Чтение ленты нужно продолжать с него: события, пришедшие во время
+            сканирования, будут применены повторно, что безопасно.
+        """
+        last_events = await redis.xrevrange(stream_key, count=1)
+        last_id = last_events[0][0] if last_events else "0-0"
+
+        layout = layout or PresenceLayout(grid_m=self.grid_m)
+        self.clear()
+        async for driver_id, value in layout.iter_locations(redis):
+            try:
+                x, y = layout.decode_location(value)
+                self.set_online(int(driver_id), x, y)
+            except (ValueError, TypeError):
+                logger.warning(f"Некорректная локация водителя {driver_id}: {value}")
+
+        logger.info(f"Индекс сетки загружен: {len(self)} водителей онлайн, лента с ID {last_id}.")
+        return last_id
+
@@ -1,81 +1,374 @@
 """Сервис для управления профилем и состоянием водителя."""
 
+import asyncio
 import logging
-from typing import Optional
+import time
+from typing import Dict, List, Optional
 from redis.asyncio import Redis
 
+from src.core.config import settings
 from src.schemas.driver import DriverPresenceSchema, DriverStatus
+from src.services.grid_search import GEO_TILE_SIZES
+from src.services.presence_layout import PresenceLayout
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
 
 
+# Общая часть скриптов геоиндекса: счетчики онлайн-водителей в тайлах
+# `tile:{size}:{TX}:{TY}` для каждого размера из GEO_TILE_SIZES. Счетчик меняется
+# только когда cell_add/cell_remove действительно добавили или удалили водителя
+# в ячейке, поэтому остается согласованным с ячейками геоиндекса.
+#
+# Скрипты ниже собираются в DriverProfileService вместе с Lua-функциями доступа
+# из PresenceLayout (get_location, cell_add и т.д.) для выбранной схемы хранения.
+TILE_COUNTERS_LUA = """
+local TILE_SIZES = {%s}
+
+local function adjust_tiles(location, delta)
+    local x, y = string.match(location, '^(%%d+):(%%d+)$')
+    if not x then
+        return
+    end
+    x, y = tonumber(x), tonumber(y)
+    for _, size in ipairs(TILE_SIZES) do
+        local tile_key = 'tile:' .. size .. ':' .. math.floor(x / size) .. ':' .. math.floor(y / size)
+        if redis.call('INCRBY', tile_key, delta) <= 0 then
+            redis.call('DEL', tile_key)
+        end
+    end
+end
+""" % ", ".join(str(size) for size in GEO_TILE_SIZES)
+
+
+# Атомарное обновление присутствия водителя за одно обращение к Redis:
+# отметка времени последнего heartbeat, чтение старой локации, перенос между
+# ячейками геоиндекса (вместе со счетчиками тайлов), запись новой локации и публикация события в ленту
+# присутствия. Если онлайн-водитель остался в той же ячейке, обновляется
+# только отметка времени; событие в ленту публикуется, лишь когда водитель
+# свободен (нет driver_lock) и есть ожидающие заказы — иначе водитель, стоящий
+# на месте после отказа или таймаута предложения, не попал бы в обратный подбор.
+# Состояние водителя (включая время heartbeat) при каждом вызове помечается
+# в `drivers_dirty` для отложенной записи в таблицу drivers: хеш хранит одну
+# запись на водителя, поэтому в БД за период сброса уходит не больше одной
+# строки на водителя, сколько бы heartbeat он ни прислал.
+#
+# KEYS: ключ локации водителя, лента присутствия, driver_last_seen, drivers_dirty,
+#       pending_orders, driver_lock:{driver_id}
+# ARGV: driver_id, status, x, y, maxlen ленты, текущее время
+# Возвращает: 1, если водитель сменил ячейку (или ушел с карты), иначе 0
+UPDATE_PRESENCE_LUA = TILE_COUNTERS_LUA + """
+local driver_id = ARGV[1]
+local status = ARGV[2]
+local new_location = ARGV[3] .. ':' .. ARGV[4]
+
+local previous = get_location(KEYS[1], driver_id)
+if previous and not string.match(previous, '^%d+:%d+$') then
+    redis.log(redis.LOG_WARNING, 'Invalid location for driver ' .. driver_id .. ': ' .. previous)
+    previous = false
+end
+
+redis.call('HSET', KEYS[4], driver_id, status .. ':' .. new_location .. ':' .. ARGV[6])
+
+local changed
+if status == 'online' then
+    redis.call('ZADD', KEYS[3], ARGV[6], driver_id)
+    changed = previous ~= new_location
+    if changed then
+        if previous and cell_remove(previous, driver_id) then
+            adjust_tiles(previous, -1)
+        end
+        if cell_add(new_location, driver_id) then
+            adjust_tiles(new_location, 1)
+        end
+        set_location(KEYS[1], driver_id, new_location)
+    elseif redis.call('HLEN', KEYS[5]) == 0 or redis.call('EXISTS', KEYS[6]) == 1 then
+        return 0
+    end
+else
+    redis.call('ZREM', KEYS[3], driver_id)
+    changed = previous ~= false
+    if previous and cell_remove(previous, driver_id) then
+        adjust_tiles(previous, -1)
+    end
+    del_location(KEYS[1], driver_id)
+end
+
+redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[5], '*',
+    'driver_id', driver_id, 'status', status, 'x', ARGV[3], 'y', ARGV[4])
+
+if changed then
+    return 1
+end
+return 0
+"""
+
+
+# Вытеснение водителей, переставших отправлять heartbeat: пачка самых давних
+# отметок старше порога снимается с карты так же, как при уходе в offline.
+#
+# KEYS: driver_last_seen, лента присутствия, drivers_dirty
+# ARGV: порог времени, размер пачки, maxlen ленты, текущее время
+# Возвращает: {число вытесненных, время самой давней оставшейся отметки или false}
+EVICT_STALE_DRIVERS_LUA = TILE_COUNTERS_LUA + """
+local stale = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+for _, driver_id in ipairs(stale) do
+    local key = location_key(driver_id)
+    local location = get_location(key, driver_id)
+    local x, y = '0', '0'
+    if location then
+        if cell_remove(location, driver_id) then
+            adjust_tiles(location, -1)
+        end
+        del_location(key, driver_id)
+        x, y = string.match(location, '^(%d+):(%d+)$')
+    end
+    redis.call('ZREM', KEYS[1], driver_id)
+    redis.call('XADD', KEYS[2], 'MAXLEN', '~', ARGV[3], '*',
+        'driver_id', driver_id, 'status', 'offline', 'x', x or '0', 'y', y or '0')
+    redis.call('HSET', KEYS[3], driver_id, 'offline:' .. (x or '0') .. ':' .. (y or '0') .. ':' .. ARGV[4])
+end
+
+local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+local oldest_seen = false
+if #oldest > 0 then
+    oldest_seen = oldest[2]
+end
+return {#stale, oldest_seen}
+"""
+
+
+# Пересчет счетчиков тайлов одного крупного тайла по размерам его ячеек
+# геоиндекса: счетчики всех вложенных тайлов перезаписываются (пустые удаляются).
+# Нужен для водителей, попавших в ячейки до появления счетчиков или мимо них;
+# дальше счетчики поддерживают скрипты присутствия. Скрипт атомарен, поэтому
+# параллельные heartbeat не расходятся с пересчитанными значениями.
+#
+# ARGV: TX, TY крупного тайла, grid_n, grid_m
+# Возвращает: число водителей в крупном тайле
+REBUILD_TILE_COUNTERS_LUA = TILE_COUNTERS_LUA + """
+local coarse = TILE_SIZES[#TILE_SIZES]
+local x0 = tonumber(ARGV[1]) * coarse
+local y0 = tonumber(ARGV[2]) * coarse
+local x1 = math.min(x0 + coarse, tonumber(ARGV[3])) - 1
+local y1 = math.min(y0 + coarse, tonumber(ARGV[4])) - 1
+
+local counts = {}
+local total = 0
+for x = x0, x1 do
+    for y = y0, y1 do
+        local size_of_cell = cell_size(x, y)
+        if size_of_cell > 0 then
+            total = total + size_of_cell
+            for _, size in ipairs(TILE_SIZES) do
+                local tile_key = 'tile:' .. size .. ':' .. math.floor(x / size) .. ':' .. math.floor(y / size)
+                counts[tile_key] = (counts[tile_key] or 0) + size_of_cell
+            end
+        end
+    end
+end
+
+for _, size in ipairs(TILE_SIZES) do
+    for tx = math.floor(x0 / size), math.floor((x0 + coarse) / size) - 1 do
+        for ty = math.floor(y0 / size), math.floor((y0 + coarse) / size) - 1 do
+            local tile_key = 'tile:' .. size .. ':' .. tx .. ':' .. ty
+            if counts[tile_key] then
+                redis.call('SET', tile_key, counts[tile_key])
+            else
+                redis.call('DEL', tile_key)
+            end
+        end
+    end
+end
+return total
+"""
+
+
 class DriverProfileService:
     """
     Инкапсулирует бизнес-логику, связанную с состоянием водителя.
     - Обновление статуса (online/offline)
     - Обновление местоположения в геоиндексе Redis
+    - Вытеснение водителей, переставших отправлять heartbeat
     """
-    def __init__(self, redis: Redis):
-        self.redis = redis
+    LAST_SEEN_KEY = "driver_last_seen" # ZSET: driver_id -> время последнего heartbeat
+    DIRTY_KEY = "drivers_dirty" # HASH: driver_id -> "status:x:y:время" для записи в БД
+    PENDING_ORDERS_KEY = "pending_orders" # Ожидающие заказы матчера (DriverMatchingService.PENDING_ORDERS_KEY)
 
-
-    async def _get_driver_previous_location(self, driver_id: int) -> Optional[tuple[int, int]]:
-        """Вспомогательный метод для получения предыдущей локации водителя из Redis."""
-        location_str = await self.redis.get(f"driver_location:{driver_id}")
-        if location_str:
-            try:
-                x_str, y_str = location_str.split(":")
-                return int(x_str), int(y_str)
-            except (ValueError, TypeError):
-                logger.warning(
-                    f"Некорректный формат локации для водителя {driver_id} в Redis: {location_str}"
-                )
-        return None
+    def __init__(self, redis: Redis, layout: Optional[PresenceLayout] = None):
+        self.redis = redis
+        self.layout = layout or PresenceLayout() # Схема хранения геоиндекса (PRESENCE_STORAGE_LAYOUT)
+        # Зарегистрированные скрипты: SHA загружается в Redis при первом вызове
+        self._update_presence_script = self.redis.register_script(
+            self.layout.lua_helpers + UPDATE_PRESENCE_LUA
+        )
+        self._evict_stale_drivers_script = self.redis.register_script(
+            self.layout.lua_helpers + EVICT_STALE_DRIVERS_LUA
+        )
+        self._rebuild_tile_counters_script = self.redis.register_script(
+            self.layout.lua_helpers + REBUILD_TILE_COUNTERS_LUA
+        )
 
 
-    async def update_presence(self, driver_id: int, presence_data: DriverPresenceSchema) -> None:
+    async def update_presence(self, driver_id: int, presence_data: DriverPresenceSchema) -> bool:
         """
         Обновляет статус и местоположение водителя в Redis.
 
+        Все шаги выполняются одним серверным скриптом, атомарно и за одно
+        обращение к Redis, поэтому параллельные heartbeat одного водителя
+        не могут оставить его в двух ячейках сразу.
+
         Алгоритм:
-        1. Получить предыдущую локацию водителя, чтобы очистить старую ячейку геоиндекса.
-        2. Если водитель был где-то на карте, удалить его ID из старой ячейки `cell:X:Y`.
-        3. Если новый статус - 'online', добавить водителя в новую ячейку геоиндекса `cell:X:Y`.
-        4. Сохранить новую локацию водителя в `driver_location:{driver_id}` для будущих обновлений.
+        0. Обновить время последнего heartbeat в `driver_last_seen` (для online)
+           или удалить его (для offline/busy).
+        1. Прочитать предыдущую локацию водителя (`driver_location:{driver_id}`
+           или поле корзины `driver_locations:*` в компактной схеме).
+           Если онлайн-водитель остался в той же ячейке, на этом все — кроме
+           случая, когда он свободен и есть ожидающие заказы: тогда событие
+           публикуется в ленту (шаг 6) для обратного подбора.
+        2. Если водитель сменил ячейку или ушел с линии, удалить его ID из старой ячейки геоиндекса.
+        3. Если новый статус - 'online', добавить водителя в новую ячейку геоиндекса.
+        4. Сохранить новую локацию водителя для будущих обновлений.
         5. Если новый статус - 'offline', удалить информацию о его локации.
+        6. Опубликовать изменение в ленту присутствия, по которой матчер
+           синхронизирует свой in-memory индекс сетки.
+        7. Пометить состояние водителя в `drivers_dirty` (и при heartbeat из
+           той же ячейки, чтобы в БД обновлялось время last_online): фоновый
+           DriverStateFlusher пачкой запишет его в таблицу drivers.
+
+        Returns:
+            True, если водитель сменил ячейку геоиндекса (или ушел с карты).
         """
         logger.info(f"Обновление присутствия для водителя {driver_id}: статус {presence_data.status.value}")
 
-        # Шаг 1: Получаем предыдущую локацию
-        previous_location = await self._get_driver_previous_location(driver_id)
-
-        # Используем Redis Pipeline для атомарного выполнения нескольких команд
-        async with self.redis.pipeline() as pipe:
-            # Шаг 2: Если водитель был на карте, удаляем его из старой ячейки
-            if previous_location:
-                prev_x, prev_y = previous_location
-                old_cell_key = f"cell:{prev_x}:{prev_y}"
-                pipe.hdel(old_cell_key, str(driver_id))
-                logger.debug(f"Водитель {driver_id} удален из старой ячейки {old_cell_key}")
-
-            # Шаги 3-5: Обрабатываем новый статус
-            new_location = presence_data.location
-            new_location_key = f"driver_location:{driver_id}"
-            new_location_str = f"{new_location.x}:{new_location.y}"
-
-            if presence_data.status == DriverStatus.ONLINE:
-                # Добавляем в новую ячейку и обновляем текущую позицию
-                new_cell_key = f"cell:{new_location.x}:{new_location.y}"
-                pipe.hset(new_cell_key, str(driver_id), presence_data.status.value)
-                pipe.set(new_location_key, new_location_str)
-                logger.debug(f"Водитель {driver_id} добавлен в ячейку {new_cell_key} и его локация обновлена")
-            else: # offline или busy
-                # Просто удаляем ключ с его локацией
-                pipe.delete(new_location_key)
-                logger.debug(f"Локация водителя {driver_id} удалена (статус offline/busy)")
-
-            # Выполняем все команды в транзакции
-            await pipe.execute()
-
-        logger.info(f"Присутствие для водителя {driver_id} успешно обновлено в Redis.")
\ No newline at end of file
+        changed = await self._update_presence_script(**self._presence_script_params(driver_id, presence_data))
+
+        logger.info(f"Присутствие для водителя {driver_id} успешно обновлено в Redis.")
+        return bool(changed)
+
+
+    async def update_presence_many(self, updates: Dict[int, DriverPresenceSchema]) -> List[bool]:
+        """
+        Обновляет присутствие нескольких водителей одним пайплайном:
+        вызовы скрипта для всех водителей уходят в Redis за одно обращение.
+
+        Returns:
+            Для каждого водителя (в порядке `updates`) — сменил ли он ячейку.
+        """
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for driver_id, presence_data in updates.items():
+                await self._update_presence_script(
+                    **self._presence_script_params(driver_id, presence_data), client=pipe
+                )
+            results = await pipe.execute()
+        return [bool(changed) for changed in results]
+
+
+    def _presence_script_params(self, driver_id: int, presence_data: DriverPresenceSchema) -> dict:
+        """Собирает KEYS и ARGV скрипта обновления присутствия."""
+        new_location = presence_data.location
+        return {
+            "keys": [
+                self.layout.location_key(driver_id), settings.DRIVER_PRESENCE_STREAM,
+                self.LAST_SEEN_KEY, self.DIRTY_KEY,
+                self.PENDING_ORDERS_KEY, f"driver_lock:{driver_id}",
+            ],
+            "args": [
+                driver_id,
+                presence_data.status.value,
+                new_location.x,
+                new_location.y,
+                settings.DRIVER_PRESENCE_STREAM_MAXLEN,
+                time.time(),
+            ],
+        }
+
+
+    async def evict_stale_drivers(
+        self, seen_before: float, batch_size: int
+    ) -> tuple[int, Optional[float]]:
+        """
+        Снимает с карты до `batch_size` водителей, чей последний heartbeat
+        был раньше `seen_before`. Для каждого в ленту присутствия публикуется
+        событие offline.
+
+        Returns:
+            Кортеж (число вытесненных водителей, время самого давнего
+            оставшегося heartbeat или None).
+        """
+        evicted, oldest_seen = await self._evict_stale_drivers_script(
+            keys=[self.LAST_SEEN_KEY, settings.DRIVER_PRESENCE_STREAM, self.DIRTY_KEY],
+            args=[seen_before, batch_size, settings.DRIVER_PRESENCE_STREAM_MAXLEN, time.time()],
+        )
+        if evicted:
+            logger.warning(f"Сняты с линии {evicted} водителей без heartbeat.")
+        return int(evicted), float(oldest_seen) if oldest_seen else None
+
+
+    async def rebuild_tile_counters(self, grid_n: int, grid_m: int) -> int:
+        """
+        Пересчитывает счетчики тайлов `tile:{size}:{TX}:{TY}` по ячейкам
+        геоиндекса — по одному вызову скрипта на крупный тайл, все вызовы
+        одним пайплайном.
+
+        Returns:
+            Число водителей в геоиндексе.
+        """
+        coarse = GEO_TILE_SIZES[-1]
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for tile_x in range(-(-grid_n // coarse)):
+                for tile_y in range(-(-grid_m // coarse)):
+                    await self._rebuild_tile_counters_script(
+                        args=[tile_x, tile_y, grid_n, grid_m], client=pipe
+                    )
+            results = await pipe.execute()
+        drivers = sum(int(count) for count in results)
+        logger.info(f"Счетчики тайлов геоиндекса пересчитаны: {drivers} водителей.")
+        return drivers
+
+
+class PresenceBatcher:
+    """
+    Пакетирует обновления присутствия, пришедшие по WebSocket от разных
+    водителей. Обновления копятся в течение окна `window_ms` (для каждого
+    водителя хранится только последнее) и записываются одним пайплайном.
+    """
+
+    def __init__(self, service: DriverProfileService, window_ms: int):
+        self.service = service
+        self.window = window_ms / 1000
+        self._pending: Dict[int, DriverPresenceSchema] = {}
+        self._wakeup = asyncio.Event()
+
+
+    def submit(self, driver_id: int, presence_data: DriverPresenceSchema) -> None:
+        """Ставит обновление в очередь; более раннее обновление водителя перезаписывается."""
+        self._pending[driver_id] = presence_data
+        self._wakeup.set()
+
+
+    async def flush(self) -> int:
+        """Записывает накопленные обновления. Возвращает число водителей в пачке."""
+        pending, self._pending = self._pending, {}
+        if pending:
+            await self.service.update_presence_many(pending)
+        return len(pending)
+
+
+    async def run(self):
+        """Фоновый цикл: после первого обновления ждет окно и сбрасывает пачку."""
+        logger.info(f"Пакетирование обновлений присутствия запущено (окно {self.window * 1000:.0f} мс).")
+        try:
+            while True:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+                await asyncio.sleep(self.window)
+                try:
+                    await self.flush()
+                except Exception as e:
+                    logger.error(f"Ошибка записи пачки обновлений присутствия: {e}", exc_info=True)
+        except asyncio.CancelledError:
+            logger.info("Пакетирование обновлений присутствия остановлено.")
+        finally:
+            # Не теряем обновления, пришедшие перед остановкой
+            await self.flush()
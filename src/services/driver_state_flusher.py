@@ -0,0 +1,189 @@
+"""
+Отложенная (write-behind) запись состояния водителей в таблицу drivers.
+
+Скрипт присутствия помечает изменившееся состояние водителя в хеше
+`drivers_dirty`. DriverStateFlusher раз в DRIVER_STATE_FLUSH_INTERVAL_SEC
+атомарно забирает накопленные записи и одним многострочным
+INSERT ... ON CONFLICT DO UPDATE записывает их в PostgreSQL, так что
+heartbeat не делает ни одной записи в БД. При старте таблица служит
+источником для восстановления геоиндекса, если Redis пуст.
+"""
+
+import asyncio
+import logging
+from typing import Any, Dict, List
+
+from redis.asyncio import Redis
+from sqlalchemy import Float, Integer, String, case, column, func, select, values
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from src.core.config import settings
+from src.models.driver import Driver, DriverStatusEnum
+from src.models.user import User
+from src.schemas.driver import DriverPresenceSchema, DriverLocationSchema, DriverStatus
+from src.services.driver_profile_service import DriverProfileService
+
+logger = logging.getLogger(__name__)
+
+
+class DriverStateFlusher:
+    """
+    Фоновый сброс состояния водителей из Redis в таблицу drivers
+    и восстановление геоиндекса Redis из таблицы.
+    """
+
+    def __init__(self, redis: Redis, session_maker: async_sessionmaker[AsyncSession]):
+        self.redis = redis
+        self.session_maker = session_maker
+        self.FLUSH_INTERVAL = settings.DRIVER_STATE_FLUSH_INTERVAL_SEC # Период сброса в секундах
+        self.REBUILD_BATCH_SIZE = 1000 # Водителей в одном пайплайне при восстановлении индекса
+
+
+    async def _take_dirty(self) -> Dict[str, str]:
+        """Атомарно забирает накопленные записи из `drivers_dirty`."""
+        async with self.redis.pipeline() as pipe:
+            pipe.hgetall(DriverProfileService.DIRTY_KEY)
+            pipe.delete(DriverProfileService.DIRTY_KEY)
+            dirty, _ = await pipe.execute()
+        return dirty
+
+
+    async def _return_dirty(self, dirty: Dict[str, str]) -> None:
+        """
+        Возвращает записи после неудачного сброса. HSETNX не перезаписывает
+        более свежие состояния, появившиеся за время попытки.
+        """
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for driver_id, state in dirty.items():
+                pipe.hsetnx(DriverProfileService.DIRTY_KEY, driver_id, state)
+            await pipe.execute()
+
+
+    @staticmethod
+    def _parse_dirty(dirty: Dict[str, str]) -> List[Dict[str, Any]]:
+        """Преобразует записи "status:x:y:время" в строки таблицы drivers."""
+        rows = []
+        for driver_id, state in dirty.items():
+            try:
+                status, x, y, seen_at = state.split(":")
+                rows.append({
+                    "id": int(driver_id),
+                    "status": status,
+                    "x": int(x),
+                    "y": int(y),
+                    "seen_at": float(seen_at),
+                })
+            except (ValueError, TypeError):
+                logger.warning(f"Некорректное состояние водителя {driver_id} в drivers_dirty: {state}")
+        return rows
+
+
+    async def flush(self) -> int:
+        """
+        Записывает накопленные состояния в таблицу drivers одним запросом.
+
+        Водители без записи в users (например, из нагрузочных тестов)
+        отсекаются соединением с таблицей users.
+
+        Returns:
+            Число записанных строк.
+        """
+        dirty = await self._take_dirty()
+        rows = self._parse_dirty(dirty)
+        if not rows:
+            return 0
+
+        states = values(
+            column("id", Integer),
+            column("status", String),
+            column("x", Integer),
+            column("y", Integer),
+            column("seen_at", Float),
+            name="states",
+        ).data([(r["id"], r["status"], r["x"], r["y"], r["seen_at"]) for r in rows])
+
+        # Время выхода на линию меняется только для online-состояний
+        last_online = case(
+            (states.c.status == DriverStatusEnum.ONLINE.value, func.to_timestamp(states.c.seen_at)),
+            else_=None,
+        )
+        stmt = insert(Driver).from_select(
+            ["id", "status", "x", "y", "last_online"],
+            select(states.c.id, states.c.status, states.c.x, states.c.y, last_online)
+            .join(User, User.id == states.c.id),
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Driver.id],
+            set_={
+                "status": stmt.excluded.status,
+                "x": stmt.excluded.x,
+                "y": stmt.excluded.y,
+                "last_online": func.coalesce(stmt.excluded.last_online, Driver.last_online),
+            },
+        )
+
+        try:
+            async with self.session_maker() as session:
+                result = await session.execute(stmt)
+                await session.commit()
+        except Exception:
+            await self._return_dirty(dirty)
+            raise
+
+        logger.info(f"Состояние {len(rows)} водителей записано в БД.")
+        return result.rowcount
+
+
+    async def rebuild_redis_index(self) -> int:
+        """
+        Восстанавливает геоиндекс Redis из таблицы drivers, если в Redis нет
+        ни одного водителя (например, после FLUSHDB или потери данных).
+        Водители проходят через обычный скрипт присутствия и получают
+        свежую отметку heartbeat.
+
+        Returns:
+            Число восстановленных водителей.
+        """
+        if await self.redis.zcard(DriverProfileService.LAST_SEEN_KEY):
+            return 0
+
+        async with self.session_maker() as session:
+            result = await session.execute(
+                select(Driver.id, Driver.x, Driver.y).where(Driver.status == DriverStatusEnum.ONLINE.value)
+            )
+            drivers = result.all()
+
+        profile_service = DriverProfileService(self.redis)
+        for start in range(0, len(drivers), self.REBUILD_BATCH_SIZE):
+            await profile_service.update_presence_many({
+                driver_id: DriverPresenceSchema(
+                    status=DriverStatus.ONLINE,
+                    location=DriverLocationSchema(x=x, y=y),
+                )
+                for driver_id, x, y in drivers[start:start + self.REBUILD_BATCH_SIZE]
+            })
+
+        if drivers:
+            logger.warning(f"Геоиндекс Redis восстановлен из БД: {len(drivers)} водителей онлайн.")
+        return len(drivers)
+
+
+    async def run(self):
+        """Фоновый цикл сброса состояния водителей."""
+        logger.info(f"Отложенная запись состояния водителей запущена (период {self.FLUSH_INTERVAL} с).")
+        try:
+            while True:
+                await asyncio.sleep(self.FLUSH_INTERVAL)
+                try:
+                    await self.flush()
+                except Exception as e:
+                    logger.error(f"Ошибка записи состояния водителей в БД: {e}", exc_info=True)
+        except asyncio.CancelledError:
+            logger.info("Отложенная запись состояния водителей остановлена.")
+        finally:
+            # Последний сброс при остановке, чтобы не потерять накопленное
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Не удалось записать состояние водителей при остановке: {e}")
@@ -0,0 +1,76 @@
+"""
+Порядок обхода ячеек сетки при поиске ближайшего водителя.
+
+Кольца строятся по манхэттенскому расстоянию |dx| + |dy| — той же метрике,
+по которой pricing_service считает стоимость и ETA поездки. Таблица смещений
+и строки ключей `cell:X:Y` вычисляются один раз при старте и общие для всех
+режимов поиска. Серверный Lua-скрипт матчера повторяет тот же порядок.
+"""
+
+from typing import List, Tuple
+
+# Размеры тайлов (в ячейках) для счетчиков онлайн-водителей `tile:{size}:{TX}:{TY}`:
+# от мелкого к крупному. Поиск спускается от крупных тайлов к мелким и
+# опрашивает только ячейки непустых мелких тайлов.
+GEO_TILE_SIZES = (8, 32)
+
+
+def tile_key(size: int, tile_x: int, tile_y: int) -> str:
+    """Возвращает ключ счетчика онлайн-водителей тайла."""
+    return f"tile:{size}:{tile_x}:{tile_y}"
+
+
+class ManhattanRings:
+    """
+    Предвычисленные кольца смещений по манхэттенскому расстоянию,
+    обрезаемые по границам сетки N×M.
+
+    Внутри кольца d смещения упорядочены по dx от -d до d, для каждого dx
+    сначала отрицательный dy, затем положительный.
+    """
+
+    def __init__(self, grid_n: int, grid_m: int, max_radius: int, cell_prefix: str = "cell"):
+        self.grid_n = grid_n
+        self.grid_m = grid_m
+        # Максимально возможное расстояние между двумя ячейками сетки
+        self.max_distance = grid_n + grid_m - 2
+        self._offsets: List[List[Tuple[int, int]]] = []
+        self._extend(min(max_radius, self.max_distance))
+
+        # Ключи геоиндекса строятся один раз, а не на каждый заказ
+        self.cell_keys: List[List[str]] = [
+            [f"{cell_prefix}:{x}:{y}" for y in range(grid_m)] for x in range(grid_n)
+        ]
+
+
+    def _extend(self, radius: int) -> None:
+        """Достраивает таблицу смещений до указанного радиуса."""
+        for d in range(len(self._offsets), radius + 1):
+            ring: List[Tuple[int, int]] = []
+            for dx in range(-d, d + 1):
+                rest = d - abs(dx)
+                ring.append((dx, -rest))
+                if rest:
+                    ring.append((dx, rest))
+            self._offsets.append(ring)
+
+
+    def cells(self, start_x: int, start_y: int, radius: int) -> List[Tuple[int, int]]:
+        """Возвращает ячейки сетки на манхэттенском расстоянии `radius` от точки."""
+        if radius > self.max_distance:
+            return []
+        if radius >= len(self._offsets):
+            self._extend(radius)
+
+        grid_n, grid_m = self.grid_n, self.grid_m
+        result = []
+        for dx, dy in self._offsets[radius]:
+            x, y = start_x + dx, start_y + dy
+            if 0 <= x < grid_n and 0 <= y < grid_m:
+                result.append((x, y))
+        return result
+
+
+    def cell_key(self, x: int, y: int) -> str:
+        """Возвращает предвычисленный ключ ячейки (`cell:X:Y` или `cellset:X:Y`)."""
+        return self.cell_keys[x][y]
@@ -4,12 +4,24 @@
 """
 
 import asyncio
+import contextlib
 import logging
-from typing import Optional, Dict, Any
+import os
+import socket
+import uuid
+from typing import Optional, Dict, Any, List, Set, Tuple
 from redis.asyncio import Redis
 import json
 import time
 
+from src.core.config import settings
+from src.services.assignment_solver import INF_COST, solve_min_cost_assignment
+from src.services.driver_grid_index import DriverGridIndex
+from src.services.driver_profile_service import DriverProfileService
+from src.services.grid_search import GEO_TILE_SIZES, ManhattanRings, tile_key
+from src.services.presence_layout import PresenceLayout
+from src.schemas.driver import DriverStatus
+
 # Настройка логирования
 logging.basicConfig(
     level=logging.INFO,
@@ -18,6 +30,219 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+# Серверный поиск и блокировка ближайшего свободного водителя за один EVALSHA.
+# Обход колец по манхэттенскому расстоянию повторяет grid_search.ManhattanRings
+# (включая обрезку по границам сетки): внутри кольца кандидаты сортируются по ID,
+# уже заблокированные пропускаются. При use_tiles = 1 ячейка опрашивается, только
+# если все содержащие ее тайлы (от крупного к мелкому) непусты. Состав ячейки
+# читает cell_members из Lua-функций схемы хранения (PresenceLayout).
+#
+# ARGV: start_x, start_y, max_radius, ride_id, lock_ttl, grid_n, grid_m, use_tiles,
+#       [excluded_driver_id, ...]
+# Возвращает: {driver_id, manhattan_distance, cells_scanned} или {false, -1, cells_scanned}
+FIND_AND_LOCK_DRIVER_LUA = """
+local TILE_SIZES = {%s}
+""" % ", ".join(str(size) for size in reversed(GEO_TILE_SIZES)) + """
+local start_x = tonumber(ARGV[1])
+local start_y = tonumber(ARGV[2])
+local max_radius = tonumber(ARGV[3])
+local ride_id = ARGV[4]
+local lock_ttl = tonumber(ARGV[5])
+local grid_n = tonumber(ARGV[6])
+local grid_m = tonumber(ARGV[7])
+local use_tiles = ARGV[8] == '1'
+local cells_scanned = 0
+local excluded = {}
+for i = 9, #ARGV do
+    excluded[tonumber(ARGV[i])] = true
+end
+
+local tile_occupied_cache = {}
+local function tiles_occupied(x, y)
+    for _, size in ipairs(TILE_SIZES) do
+        local key = 'tile:' .. size .. ':' .. math.floor(x / size) .. ':' .. math.floor(y / size)
+        local occupied = tile_occupied_cache[key]
+        if occupied == nil then
+            occupied = tonumber(redis.call('GET', key) or '0') > 0
+            tile_occupied_cache[key] = occupied
+        end
+        if not occupied then
+            return false
+        end
+    end
+    return true
+end
+
+local function scan_cell(x, y, candidates, distances)
+    if use_tiles and not tiles_occupied(x, y) then
+        return
+    end
+    cells_scanned = cells_scanned + 1
+    local ids = cell_members(x, y)
+    local distance = math.abs(x - start_x) + math.abs(y - start_y)
+    for _, id in ipairs(ids) do
+        local driver_id = tonumber(id)
+        if not excluded[driver_id] then
+            candidates[#candidates + 1] = driver_id
+            distances[driver_id] = distance
+        end
+    end
+end
+
+local function in_grid(y)
+    return y >= 0 and y < grid_m
+end
+
+for radius = 0, max_radius do
+    local candidates = {}
+    local distances = {}
+    for dx = -radius, radius do
+        local x = start_x + dx
+        if x >= 0 and x < grid_n then
+            local rest = radius - math.abs(dx)
+            if in_grid(start_y - rest) then
+                scan_cell(x, start_y - rest, candidates, distances)
+            end
+            if rest ~= 0 and in_grid(start_y + rest) then
+                scan_cell(x, start_y + rest, candidates, distances)
+            end
+        end
+    end
+
+    table.sort(candidates)
+    for _, driver_id in ipairs(candidates) do
+        if redis.call('SET', 'driver_lock:' .. driver_id, ride_id, 'EX', lock_ttl, 'NX') then
+            return {driver_id, distances[driver_id], cells_scanned}
+        end
+    end
+end
+
+return {false, -1, cells_scanned}
+"""
+
+
+# Атомарная обработка пачки истекших предложений. Безопасна при нескольких
+# репликах: каждое предложение удаляется из ZSET и обрабатывается ровно один раз.
+# Для каждого предложения "{ride_id}:{driver_id}" блокировка водителя снимается,
+# только если она все еще принадлежит заказу, и публикуется событие повторного поиска.
+#
+# KEYS: proposal_timeouts, retry_search_events
+# ARGV: now, batch_size
+# Возвращает: {обработано, {просроченные предложения с повторным поиском}, ближайший дедлайн или false}
+EXPIRE_PROPOSALS_LUA = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+local retried = {}
+
+for _, member in ipairs(expired) do
+    redis.call('ZREM', KEYS[1], member)
+    local ride_id, driver_id = string.match(member, '^(.*):([^:]*)$')
+    if ride_id then
+        local lock_key = 'driver_lock:' .. driver_id
+        if redis.call('GET', lock_key) == ride_id then
+            redis.call('DEL', lock_key)
+            redis.call('XADD', KEYS[2], '*', 'ride_id', ride_id, 'exclude_driver_id', driver_id)
+            retried[#retried + 1] = member
+        end
+    end
+end
+
+local next_deadline = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+return {#expired, retried, next_deadline[2] or false}
+"""
+
+
+# Обратный подбор: водитель вышел на линию или переместился — ищем для него
+# ближайший ожидающий заказ из индекса `pending_orders` и атомарно забираем его.
+# Пока ожидающих заказов немного, они перебираются напрямую; иначе обходятся
+# манхэттенские кольца ячеек `pending_cell:X:Y` вокруг водителя.
+#
+# KEYS: pending_orders
+# ARGV: driver_id, x, y, max_radius, lock_ttl, grid_n, grid_m, scan_limit
+# Возвращает: {ride_id, distance} или false
+CLAIM_PENDING_ORDER_LUA = """
+local pending_count = redis.call('HLEN', KEYS[1])
+if pending_count == 0 then
+    return false
+end
+
+local driver_id = ARGV[1]
+local x = tonumber(ARGV[2])
+local y = tonumber(ARGV[3])
+local max_radius = tonumber(ARGV[4])
+local lock_ttl = tonumber(ARGV[5])
+local grid_n = tonumber(ARGV[6])
+local grid_m = tonumber(ARGV[7])
+local scan_limit = tonumber(ARGV[8])
+local lock_key = 'driver_lock:' .. driver_id
+
+if redis.call('EXISTS', lock_key) == 1 then
+    return false
+end
+
+local function excluded(ride_id)
+    return redis.call('SISMEMBER', 'ride_exclusions:' .. ride_id, driver_id) == 1
+end
+
+local function claim(ride_id, ox, oy, distance)
+    redis.call('HDEL', KEYS[1], ride_id)
+    redis.call('SREM', 'pending_cell:' .. ox .. ':' .. oy, ride_id)
+    redis.call('SET', lock_key, ride_id, 'EX', lock_ttl)
+    return {ride_id, distance}
+end
+
+if pending_count <= scan_limit then
+    local best_ride, best_x, best_y, best_distance
+    local flat = redis.call('HGETALL', KEYS[1])
+    for i = 1, #flat, 2 do
+        local ride_id = flat[i]
+        local ox, oy = string.match(flat[i + 1], '^(%d+):(%d+)$')
+        ox, oy = tonumber(ox), tonumber(oy)
+        local distance = math.abs(ox - x) + math.abs(oy - y)
+        if distance <= max_radius
+            and (best_distance == nil or distance < best_distance
+                 or (distance == best_distance and ride_id < best_ride))
+            and not excluded(ride_id) then
+            best_ride, best_x, best_y, best_distance = ride_id, ox, oy, distance
+        end
+    end
+    if best_ride then
+        return claim(best_ride, best_x, best_y, best_distance)
+    end
+    return false
+end
+
+for radius = 0, max_radius do
+    for dx = -radius, radius do
+        local ox = x + dx
+        if ox >= 0 and ox < grid_n then
+            local rest = radius - math.abs(dx)
+            local ys = {y - rest}
+            if rest ~= 0 then
+                ys[2] = y + rest
+            end
+            for _, oy in ipairs(ys) do
+                if oy >= 0 and oy < grid_m then
+                    local cell_key = 'pending_cell:' .. ox .. ':' .. oy
+                    local rides = redis.call('SMEMBERS', cell_key)
+                    table.sort(rides)
+                    for _, ride_id in ipairs(rides) do
+                        if redis.call('HEXISTS', KEYS[1], ride_id) == 0 then
+                            -- Заказ уже снят с ожидания — убираем устаревшую запись ячейки
+                            redis.call('SREM', cell_key, ride_id)
+                        elseif not excluded(ride_id) then
+                            return claim(ride_id, ox, oy, radius)
+                        end
+                    end
+                end
+            end
+        end
+    end
+end
+
+return false
+"""
+
+
 class DriverMatchingService:
     """
     Слушает поток 'order_events', ищет водителя для новых заказов
@@ -28,30 +253,103 @@ class DriverMatchingService:
     NOTIFICATION_CHANNEL = "driver_notifications" # Имя канала для отправки уведомлений
     TIMEOUT_ZSET_KEY = "proposal_timeouts" # Ключ для отложенной очереди таймаутов
     RETRY_STREAM_KEY = "retry_search_events" # Имя стрима для повторного поиска
+    CONSUMERS_ZSET_KEY = "matching_consumers" # Реестр живых потребителей (score — время heartbeat)
+    RIDE_CONTEXT_KEY = "ride_pickup:{ride_id}" # Кеш координат и цены заказа для повторного поиска
+    RIDE_EXCLUSIONS_KEY = "ride_exclusions:{ride_id}" # Водители, которым заказ уже предлагался
+    PENDING_ORDERS_KEY = DriverProfileService.PENDING_ORDERS_KEY # Заказы без водителя: ride_id -> "x:y" точки подачи
+    PENDING_CELL_KEY = "pending_cell:{x}:{y}" # Заказы без водителя по ячейкам сетки
+    REVERSE_MATCHING_GROUP = "reverse_matching_group" # Группа чтения ленты присутствия для обратного подбора
+
 
+    SEARCH_MODE_REDIS = "redis" # Поиск опросом ячеек геоиндекса в Redis
+    SEARCH_MODE_LOCAL = "local" # Поиск по in-memory индексу сетки
+    SEARCH_MODE_LUA = "lua" # Поиск и блокировка серверным Lua-скриптом
 
-    def __init__(self, redis: Redis):
+
+    def __init__(
+        self, redis: Redis, search_mode: Optional[str] = None, layout: Optional[PresenceLayout] = None
+    ):
         self.redis = redis
+        self.layout = layout or PresenceLayout() # Схема хранения геоиндекса (PRESENCE_STORAGE_LAYOUT)
         self._running = False
-        self.MAX_SEARCH_RADIUS = 20 # Максимальный радиус поиска водителя
+        self.MAX_SEARCH_RADIUS = settings.MATCHING_MAX_SEARCH_RADIUS # Максимальный (манхэттенский) радиус поиска водителя
+        self.USE_TILES = settings.MATCHING_TILE_PRUNING # Пропускать пустые тайлы геоиндекса при поиске
         self.DRIVER_LOCK_TIMEOUT = 30 # Время блокировки водителя в секундах
         self.PROPOSAL_TIMEOUT = 25 # Время ожидания ответа водителя на предложение в секундах
 
+        # Пакетный режим: при BATCH_SIZE > 1 заказы назначаются совместно
+        self.BATCH_SIZE = max(1, settings.MATCHING_BATCH_SIZE) # Максимальный размер пакета заказов
+        self.BATCH_WINDOW_MS = settings.MATCHING_BATCH_WINDOW_MS # Окно добора пакета в миллисекундах
+        self.BATCH_CANDIDATES = settings.MATCHING_BATCH_CANDIDATES # Кандидатов на заказ в пакете
+
+        # Уникальные имена потребителей: по одному на каждую задачу-слушателя процесса
+        consumer_base = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.consumer_names = [
+            f"{consumer_base}-{i}" for i in range(max(1, settings.MATCHING_CONSUMER_TASKS))
+        ]
+        self.CONSUMER_HEARTBEAT_INTERVAL = settings.MATCHING_CONSUMER_HEARTBEAT_SEC # Период heartbeat в секундах
+        self.CONSUMER_TTL = settings.MATCHING_CONSUMER_TTL_SEC # Потребитель без heartbeat дольше считается мертвым
+        self.CLAIM_MIN_IDLE_MS = settings.MATCHING_CLAIM_MIN_IDLE_MS # Минимальный простой записи PEL для XAUTOCLAIM
+
+        # Параллельная обработка: общий пул слотов на все задачи-слушатели процесса
+        self.MAX_CONCURRENT_ORDERS = max(1, settings.MATCHING_MAX_CONCURRENT_ORDERS) # Заказов в обработке одновременно
+        self.REGION_SIZE = settings.MATCHING_REGION_SIZE or self.MAX_SEARCH_RADIUS # Сторона региона сетки в ячейках
+        self._order_slots = asyncio.Semaphore(self.MAX_CONCURRENT_ORDERS)
+        self._region_locks: Dict[Tuple[int, int], asyncio.Lock] = {}
+        self._order_tasks: Set[asyncio.Task] = set()
 
-    async def _ensure_consumer_group(self):
+        # Повторный поиск после отказа или молчания водителя
+        self.RIDE_CONTEXT_TTL = 3600 # Время жизни кеша заказа в секундах
+        self.RETRY_MAX_ATTEMPTS = settings.MATCHING_RETRY_MAX_ATTEMPTS # Попыток повторного поиска на заказ
+        self.RETRY_RADIUS_STEP = settings.MATCHING_RETRY_RADIUS_STEP # Расширение радиуса с каждой попыткой
+
+        self.search_mode = search_mode or settings.MATCHING_SEARCH_MODE
+        if self.search_mode not in (
+            self.SEARCH_MODE_REDIS, self.SEARCH_MODE_LOCAL, self.SEARCH_MODE_LUA
+        ):
+            raise ValueError(f"Неизвестный режим поиска водителя: {self.search_mode}")
+
+        # Предвычисленные кольца поиска, общие для всех режимов
+        self.rings = ManhattanRings(
+            settings.CITY_GRID_N, settings.CITY_GRID_M, self.MAX_SEARCH_RADIUS, self.layout.cell_prefix
+        )
+
+        # In-memory индекс занятости сетки (только для режима "local")
+        self.grid_index: Optional[DriverGridIndex] = None
+        self._presence_last_id = "0-0"
+        if self.search_mode == self.SEARCH_MODE_LOCAL:
+            self.grid_index = DriverGridIndex(settings.CITY_GRID_N, settings.CITY_GRID_M)
+
+        # Зарегистрированный скрипт: SHA загружается в Redis при первом вызове
+        self._find_and_lock_script = self.redis.register_script(
+            self.layout.lua_helpers + FIND_AND_LOCK_DRIVER_LUA
+        )
+        self._expire_proposals_script = self.redis.register_script(EXPIRE_PROPOSALS_LUA)
+        self._claim_pending_order_script = self.redis.register_script(CLAIM_PENDING_ORDER_LUA)
+        self.PENDING_SCAN_LIMIT = 256 # До этого числа ожидающих заказов они перебираются без обхода колец
+        self.EXPIRY_BATCH_SIZE = settings.MATCHING_EXPIRY_BATCH_SIZE # Истекших предложений за один вызов скрипта
+
+        # Вытеснение водителей без heartbeat, чтобы не предлагать заказы "призракам"
+        self.DRIVER_PRESENCE_TTL = settings.DRIVER_PRESENCE_TTL_SEC # Водитель без heartbeat дольше снимается с линии
+        self.DRIVER_SWEEP_BATCH_SIZE = settings.DRIVER_SWEEP_BATCH_SIZE # Водителей за один вызов скрипта
+        self.profile_service = DriverProfileService(self.redis, self.layout)
+
+
+    async def _ensure_consumer_group(self, stream_key: Optional[str] = None):
         """
         Убеждается, что группа потребителей существует.
         Если стрима или группы нет, они будут созданы.
         """
+        stream_key = stream_key or self.STREAM_KEY
         try:
             await self.redis.xgroup_create(
-                name=self.STREAM_KEY,
+                name=stream_key,
                 groupname=self.CONSUMER_GROUP,
                 id="0",  # Начинаем читать с самого начала
                 mkstream=True,  # Создать стрим, если его нет
             )
 
-            logger.info(f"Создана группа потребителей '{self.CONSUMER_GROUP}' для потока '{self.STREAM_KEY}'.")
+            logger.info(f"Создана группа потребителей '{self.CONSUMER_GROUP}' для потока '{stream_key}'.")
         except Exception as e:
             if "BUSYGROUP" in str(e):
                 logger.info(f"Группа потребителей '{self.CONSUMER_GROUP}' уже существует.")
@@ -79,56 +377,173 @@ class DriverMatchingService:
         return was_set
 
 
+    async def _get_drivers_in_cells(self, cells: List[Tuple[int, int]]) -> List[Tuple[int, int, int]]:
+        """
+        Возвращает тройки (driver_id, x, y) для водителей в указанных ячейках.
+        В режиме "local" читает in-memory индекс, иначе — состав ячеек одним пайплайном.
+        """
+        if self.grid_index is not None:
+            return self.grid_index.drivers_with_cells(cells)
+
+        pipe = self.redis.pipeline()
+        for x, y in cells:
+            self.layout.queue_cell_members(pipe, self.rings.cell_key(x, y))
+        results = await pipe.execute()
+
+        return [
+            (int(d), x, y)
+            for (x, y), driver_list in zip(cells, results)
+            for d in driver_list
+        ]
+
+
+    async def _occupied_tiles(
+        self, start_x: int, start_y: int, radius: int
+    ) -> Optional[Set[Tuple[int, int]]]:
+        """
+        Спускается по счетчикам тайлов от крупных к мелким (по одному MGET на
+        уровень) и возвращает мелкие тайлы с онлайн-водителями, которые
+        пересекаются с областью поиска радиуса `radius`.
+
+        Returns:
+            Множество (TX, TY) мелких тайлов или None, если отсечение по тайлам
+            выключено или используется in-memory индекс.
+        """
+        if not self.USE_TILES or self.grid_index is not None:
+            return None
+
+        min_x, max_x = max(0, start_x - radius), min(self.rings.grid_n - 1, start_x + radius)
+        min_y, max_y = max(0, start_y - radius), min(self.rings.grid_m - 1, start_y + radius)
+
+        def within_radius(size: int, tile_x: int, tile_y: int) -> bool:
+            # Минимальное манхэттенское расстояние от точки заказа до тайла
+            dx = max(tile_x * size - start_x, 0, start_x - (tile_x + 1) * size + 1)
+            dy = max(tile_y * size - start_y, 0, start_y - (tile_y + 1) * size + 1)
+            return dx + dy <= radius
+
+        parent_size = None
+        occupied: List[Tuple[int, int]] = []
+        for size in reversed(GEO_TILE_SIZES):
+            if parent_size is None:
+                tiles = [
+                    (tile_x, tile_y)
+                    for tile_x in range(min_x // size, max_x // size + 1)
+                    for tile_y in range(min_y // size, max_y // size + 1)
+                ]
+            else:
+                tiles = [
+                    (tile_x, tile_y)
+                    for parent_x, parent_y in occupied
+                    for tile_x in range(
+                        max(min_x, parent_x * parent_size) // size,
+                        min(max_x, (parent_x + 1) * parent_size - 1) // size + 1,
+                    )
+                    for tile_y in range(
+                        max(min_y, parent_y * parent_size) // size,
+                        min(max_y, (parent_y + 1) * parent_size - 1) // size + 1,
+                    )
+                ]
+            tiles = [tile for tile in tiles if within_radius(size, *tile)]
+            if not tiles:
+                return set()
+
+            counts = await self.redis.mget([tile_key(size, *tile) for tile in tiles])
+            occupied = [tile for tile, count in zip(tiles, counts) if count and int(count) > 0]
+            parent_size = size
+
+        return set(occupied)
+
+
+    @staticmethod
+    def _cells_in_tiles(
+        cells: List[Tuple[int, int]], occupied: Optional[Set[Tuple[int, int]]]
+    ) -> List[Tuple[int, int]]:
+        """Оставляет только ячейки, лежащие в непустых мелких тайлах."""
+        if occupied is None:
+            return cells
+        size = GEO_TILE_SIZES[0]
+        return [(x, y) for x, y in cells if (x // size, y // size) in occupied]
+
+
+    async def _find_free_candidates(
+        self, start_x: int, start_y: int, limit: int
+    ) -> List[Tuple[int, int]]:
+        """
+        Собирает до `limit` ближайших незаблокированных водителей без их блокировки.
+
+        Returns:
+            Пары (driver_id, манхэттенское расстояние до точки заказа).
+        """
+        candidates: List[Tuple[int, int]] = []
+        occupied = await self._occupied_tiles(start_x, start_y, self.MAX_SEARCH_RADIUS)
+        if occupied is not None and not occupied:
+            return candidates
+
+        for radius in range(0, self.MAX_SEARCH_RADIUS + 1):
+            cells = self._cells_in_tiles(self.rings.cells(start_x, start_y, radius), occupied)
+            if not cells:
+                continue
+            found = await self._get_drivers_in_cells(cells)
+            if not found:
+                continue
+
+            locks = await self.redis.mget([f"driver_lock:{d}" for d, _, _ in found])
+            candidates.extend(
+                (driver_id, abs(x - start_x) + abs(y - start_y))
+                for (driver_id, x, y), lock in zip(found, locks)
+                if lock is None
+            )
+            if len(candidates) >= limit:
+                break
+
+        candidates.sort(key=lambda c: (c[1], c[0]))
+        return candidates[:limit]
+
+
     async def _find_and_lock_nearest_driver(
-        self, start_x: int, start_y: int, ride_id: str
+        self,
+        start_x: int,
+        start_y: int,
+        ride_id: str,
+        exclude: Optional[Set[int]] = None,
+        max_radius: Optional[int] = None,
     ) -> Optional[int]:
         """
         Ищет ближайшего СВОБОДНОГО (не заблокированного) водителя и блокирует его.
 
+        Args:
+            exclude: ID водителей, которым этот заказ уже предлагался.
+            max_radius: Радиус поиска (по умолчанию MAX_SEARCH_RADIUS).
+
         Returns:
             ID заблокированного водителя или None.
         """
         logger.info(f"Начинаем поиск и блокировку водителя из точки ({start_x}, {start_y}) для заказа {ride_id}")
+        exclude = exclude or set()
+        max_radius = min(
+            max_radius if max_radius is not None else self.MAX_SEARCH_RADIUS,
+            self.rings.max_distance,
+        )
 
-        # Проверяем водителей в точке заказа (радиус 0)
-        cell_key = f"cell:{start_x}:{start_y}"
-        drivers_in_cell = await self.redis.hkeys(cell_key)
-        if drivers_in_cell:
-            candidate_ids = sorted([int(d) for d in drivers_in_cell])
-            logger.info(f"Найдены кандидаты в ячейке 0: {candidate_ids}")
-            # Пытаемся заблокировать каждого кандидата по очереди
-            for driver_id in candidate_ids:
-                if await self._lock_driver(driver_id, ride_id):
-                    logger.info(f"Водитель {driver_id} успешно заблокирован.")
-                    return driver_id
-
-        # Расширяем поиск по спирали
-        for radius in range(1, self.MAX_SEARCH_RADIUS + 1):
-            candidate_ids = []
-            # Итерируемся по периметру квадрата с текущим радиусом
-            for i in range(-radius, radius + 1):
-                # Горизонтальные стороны
-                keys_to_check = [
-                    f"cell:{start_x + i}:{start_y + radius}",
-                    f"cell:{start_x + i}:{start_y - radius}"
-                ]
-                # Вертикальные стороны (исключая углы, чтобы не проверять дважды)
-                if abs(i) != radius:
-                     keys_to_check.extend([
-                         f"cell:{start_x + radius}:{start_y + i}",
-                         f"cell:{start_x - radius}:{start_y + i}"
-                     ])
-                
-                # За один запрос получаем водителей из всех ячеек на периметре
-                if keys_to_check:
-                    pipe = self.redis.pipeline()
-                    for key in set(keys_to_check):
-                        pipe.hkeys(key)
-                    
-                    results = await pipe.execute()
-                    
-                    for driver_list in results:
-                        candidate_ids.extend([int(d) for d in driver_list])
+        if self.search_mode == self.SEARCH_MODE_LUA:
+            return await self._find_and_lock_nearest_driver_lua(
+                start_x, start_y, ride_id, exclude, max_radius
+            )
+
+        # Пустые тайлы отсекаются заранее: опрашиваются только ячейки непустых тайлов
+        occupied = await self._occupied_tiles(start_x, start_y, max_radius)
+        if occupied is not None and not occupied:
+            logger.warning(f"В радиусе {max_radius} от ({start_x}, {start_y}) нет онлайн-водителей.")
+            return None
+
+        # Расширяем поиск кольцами манхэттенского расстояния, начиная с ячейки заказа
+        for radius in range(0, max_radius + 1):
+            cells = self._cells_in_tiles(self.rings.cells(start_x, start_y, radius), occupied)
+            if not cells:
+                continue
+            candidate_ids = [
+                d for d, _, _ in await self._get_drivers_in_cells(cells) if d not in exclude
+            ]
 
             if candidate_ids:
                 sorted_candidates = sorted(candidate_ids)
@@ -139,156 +554,727 @@ class DriverMatchingService:
                         logger.info(f"Водитель {driver_id} успешно заблокирован.")
                         return driver_id
 
-        logger.warning(f"Свободные водители не найдены в радиусе {self.MAX_SEARCH_RADIUS} от ({start_x}, {start_y})")
+        logger.warning(f"Свободные водители не найдены в радиусе {max_radius} от ({start_x}, {start_y})")
         return None
-    
+
+
+    async def _find_and_lock_nearest_driver_lua(
+        self, start_x: int, start_y: int, ride_id: str, exclude: Set[int], max_radius: int
+    ) -> Optional[int]:
+        """
+        Ищет и блокирует ближайшего свободного водителя одним вызовом EVALSHA.
+
+        Returns:
+            ID заблокированного водителя или None.
+        """
+        driver_id, distance, cells_scanned = await self._find_and_lock_script(
+            args=[
+                start_x, start_y, max_radius, ride_id, self.DRIVER_LOCK_TIMEOUT,
+                self.rings.grid_n, self.rings.grid_m, int(self.USE_TILES), *sorted(exclude),
+            ]
+        )
+
+        if not driver_id:
+            logger.warning(
+                f"Свободные водители не найдены в радиусе {max_radius} от ({start_x}, {start_y}) "
+                f"(просмотрено ячеек: {cells_scanned})"
+            )
+            return None
+
+        logger.info(
+            f"Водитель {driver_id} успешно заблокирован скриптом: "
+            f"расстояние {distance}, просмотрено ячеек {cells_scanned}."
+        )
+        return int(driver_id)
+
+
+    async def _presence_feed_listener(self):
+        """
+        Фоновый воркер, который читает ленту присутствия водителей
+        и поддерживает in-memory индекс сетки в актуальном состоянии.
+        """
+        logger.info("Слушатель ленты присутствия запущен.")
+        while self._running:
+            try:
+                response = await self.redis.xread(
+                    {settings.DRIVER_PRESENCE_STREAM: self._presence_last_id},
+                    count=1000,
+                    block=1000,
+                )
+                if not response:
+                    continue
+
+                _, events = response[0]
+                for event_id, event in events:
+                    self.grid_index.apply_event(event)
+                    self._presence_last_id = event_id
+
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Ошибка в слушателе ленты присутствия: {e}", exc_info=True)
+                await asyncio.sleep(5)
+                # После сбоя соединения часть событий могла быть вытеснена из ленты —
+                # перечитываем снимок целиком
+                try:
+                    self._presence_last_id = await self.grid_index.load_snapshot(
+                        self.redis, settings.DRIVER_PRESENCE_STREAM, self.layout
+                    )
+                except Exception as reload_error:
+                    logger.error(f"Не удалось перезагрузить индекс сетки: {reload_error}")
+
+
+    async def _expire_proposals_batch(self) -> Tuple[int, List[str], Optional[float]]:
+        """
+        Обрабатывает одну пачку истекших предложений серверным скриптом.
+
+        Returns:
+            Количество обработанных предложений, предложения, отправленные
+            на повторный поиск, и ближайший оставшийся дедлайн (или None).
+        """
+        processed, retried, next_deadline = await self._expire_proposals_script(
+            keys=[self.TIMEOUT_ZSET_KEY, self.RETRY_STREAM_KEY],
+            args=[time.time(), self.EXPIRY_BATCH_SIZE],
+        )
+        return int(processed), list(retried), float(next_deadline) if next_deadline else None
+
 
     async def _timeout_checker(self):
         """
-        Фоновый воркер, который проверяет ZSET на наличие истекших предложений.
+        Фоновый воркер, который обрабатывает истекшие предложения.
+
+        Вместо опроса раз в секунду воркер спит ровно до ближайшего дедлайна
+        в ZSET. Если очередь пуста, новый дедлайн не может наступить раньше чем
+        через PROPOSAL_TIMEOUT, поэтому дольше этого воркер не спит.
         """
         logger.info("Воркер проверки таймаутов запущен.")
         while self._running:
             try:
-                # Находим все предложения, у которых истек срок
-                expired_proposals = await self.redis.zrangebyscore(
-                    self.TIMEOUT_ZSET_KEY, 0, time.time()
-                )
+                processed, retried, next_deadline = await self._expire_proposals_batch()
 
-                if not expired_proposals:
-                    await asyncio.sleep(1)  # Пауза, если нет работы
-                    continue
-                
-                logger.info(f"Обнаружены истекшие предложения: {expired_proposals}")
-
-                # Удаляем их из очереди, чтобы не обрабатывать повторно
-                await self.redis.zrem(self.TIMEOUT_ZSET_KEY, *expired_proposals)
-
-                for proposal in expired_proposals:
-                    ride_id, driver_id_str = proposal.split(":")
-                    driver_id = int(driver_id_str)
-
-                    # Снимаем блокировку, только если она все еще принадлежит этому заказу
-                    lock_key = f"driver_lock:{driver_id}"
-                    current_lock_ride_id = await self.redis.get(lock_key)
-
-                    if current_lock_ride_id == ride_id:
-                        logger.warning(f"Таймаут для водителя {driver_id} по заказу {ride_id}. Снимаем блокировку.")
-                        await self.redis.delete(lock_key)
-                        
-                        # Публикуем событие для повторного поиска
-                        await self.redis.xadd(
-                            self.RETRY_STREAM_KEY,
-                            {"ride_id": ride_id, "exclude_driver_id": driver_id}
-                        )
-                    else:
-                        logger.info(f"Таймаут для заказа {ride_id} проигнорирован, т.к. водитель {driver_id} уже не заблокирован этим заказом.")
-            
+                if processed:
+                    logger.info(f"Обработано истекших предложений: {processed}, на повторный поиск: {retried}")
+                if processed >= self.EXPIRY_BATCH_SIZE:
+                    continue  # Истекших предложений больше, чем помещается в пачку
+
+                delay = self.PROPOSAL_TIMEOUT
+                if next_deadline is not None:
+                    delay = min(max(next_deadline - time.time(), 0), self.PROPOSAL_TIMEOUT)
+                await asyncio.sleep(delay)
+
+            except asyncio.CancelledError:
+                break
             except Exception as e:
                 logger.error(f"Ошибка в воркере проверки таймаутов: {e}", exc_info=True)
                 await asyncio.sleep(5)
 
 
-    async def _order_events_listener(self):
+    async def _stale_driver_sweeper(self):
         """
-        Основной воркер, который слушает новые заказы и запускает поиск.
+        Фоновый воркер, который снимает с линии водителей, переставших
+        отправлять heartbeat (например, упало приложение).
+
+        Как и воркер таймаутов, спит до момента, когда самый давний heartbeat
+        станет просроченным, но не дольше DRIVER_PRESENCE_TTL.
         """
-        await self._ensure_consumer_group()
-        logger.info("Слушатель новых заказов запущен...")
-        self._running = True
+        logger.info("Воркер вытеснения неактивных водителей запущен.")
+        while self._running:
+            try:
+                evicted, oldest_seen = await self.profile_service.evict_stale_drivers(
+                    time.time() - self.DRIVER_PRESENCE_TTL, self.DRIVER_SWEEP_BATCH_SIZE
+                )
+                if evicted >= self.DRIVER_SWEEP_BATCH_SIZE:
+                    continue  # Просроченных водителей больше, чем помещается в пачку
+
+                delay = self.DRIVER_PRESENCE_TTL
+                if oldest_seen is not None:
+                    delay = min(max(oldest_seen + self.DRIVER_PRESENCE_TTL - time.time(), 0), delay)
+                await asyncio.sleep(delay)
+
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                logger.error(f"Ошибка в воркере вытеснения водителей: {e}", exc_info=True)
+                await asyncio.sleep(5)
+
+
+    def _decode_event(
+        self, message_id: str, raw_data: Dict[str, Any]
+    ) -> Tuple[Optional[str], Dict[str, Any]]:
+        """
+        Извлекает тип события и его данные из сообщения потока заказов.
+
+        Returns:
+            Пара (тип события, данные) или (None, {}) для нечитаемого сообщения.
+        """
+        try:
+            raw_payload = raw_data['data']
+
+            if isinstance(raw_payload, str):
+                data = json.loads(raw_payload)
+            elif isinstance(raw_payload, dict):
+                data = raw_payload
+            else:
+                logger.error(f"Unknown data type: {type(raw_payload)}")
+                return None, {}
+
+            return raw_data.get('event', data.get('event')), data
+
+        except (KeyError, ValueError) as e:
+            logger.error(f"Некорректные данные в сообщении о заказе {message_id}: {e}")
+            return None, {}
+
+
+    def _parse_order_message(self, message_id: str, raw_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Разбирает сообщение из потока заказов.
+
+        Returns:
+            Словарь с данными заказа или None, если сообщение не является
+            корректным событием OrderCreated и его нужно просто подтвердить.
+        """
+        return self._order_from_event(message_id, *self._decode_event(message_id, raw_data))
+
+
+    def _order_from_event(
+        self, message_id: str, event_type: Optional[str], data: Dict[str, Any]
+    ) -> Optional[Dict[str, Any]]:
+        """Строит словарь заказа из данных события OrderCreated."""
+        # Проверка типа события
+        if event_type != 'OrderCreated':
+            return None
+
+        try:
+            # Валидируем, что данные о координатах пришли
+            return {
+                "ride_id": data['ride_id'],
+                "start_x": int(data['start_x']),
+                "start_y": int(data['start_y']),
+                "end_x": int(data.get('end_x', 0)),
+                "end_y": int(data.get('end_y', 0)),
+                "price": data.get('price', 0),
+            }
+
+        except (KeyError, ValueError) as e:
+            logger.error(f"Некорректные данные в сообщении о заказе {message_id}: {e}")
+            return None
+
+
+    def _queue_ride_context(self, pipe, order: Dict[str, Any]) -> None:
+        """
+        Добавляет в пайплайн кеширование данных заказа, чтобы повторный
+        и обратный подбор обходились без обращения к БД.
+        """
+        context_key = self.RIDE_CONTEXT_KEY.format(ride_id=order["ride_id"])
+        pipe.hset(context_key, mapping={
+            field: order[field] for field in ("start_x", "start_y", "end_x", "end_y", "price")
+        })
+        pipe.expire(context_key, self.RIDE_CONTEXT_TTL)
+
+
+    @staticmethod
+    def _order_from_context(ride_id: str, context: Dict[str, str]) -> Dict[str, Any]:
+        """Восстанавливает словарь заказа из кеша `ride_pickup:{ride_id}`."""
+        return {
+            "ride_id": ride_id,
+            "start_x": int(context["start_x"]),
+            "start_y": int(context["start_y"]),
+            "end_x": int(context["end_x"]),
+            "end_y": int(context["end_y"]),
+            "price": float(context["price"]),
+        }
+
+
+    def _queue_pending_order(self, pipe, order: Dict[str, Any]) -> None:
+        """
+        Добавляет в пайплайн постановку заказа в индекс ожидающих:
+        его заберет первый подходящий водитель, вышедший на линию рядом.
+        """
+        self._queue_ride_context(pipe, order)
+        pipe.hset(self.PENDING_ORDERS_KEY, order["ride_id"], f"{order['start_x']}:{order['start_y']}")
+        pipe.sadd(
+            self.PENDING_CELL_KEY.format(x=order["start_x"], y=order["start_y"]), order["ride_id"]
+        )
+
+
+    def _queue_proposal(self, pipe, order: Dict[str, Any], driver_id: int) -> None:
+        """
+        Добавляет в пайплайн отправку предложения водителю, постановку таймаута
+        и кеширование данных заказа.
+        """
+        self._queue_ride_context(pipe, order)
+
+        notification_payload = {
+            "type": "NEW_ORDER_PROPOSAL",
+            "recipient_user_id": driver_id,
+            "data": {
+                "ride_id": order["ride_id"],
+                "start_x": order["start_x"],
+                "start_y": order["start_y"],
+                "end_x": order["end_x"],
+                "end_y": order["end_y"],
+                "price": order["price"],
+            }
+        }
+        pipe.publish(self.NOTIFICATION_CHANNEL, json.dumps(notification_payload))
+
+        proposal_member = f"{order['ride_id']}:{driver_id}"
+        timeout_score = time.time() + self.PROPOSAL_TIMEOUT
+        pipe.zadd(self.TIMEOUT_ZSET_KEY, {proposal_member: timeout_score})
+
+
+    async def _read_orders(self, consumer_name: str) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        Читает очередную порцию сообщений из потока заказов.
+
+        В пакетном режиме после первого сообщения дочитывает поток, пока пакет
+        не наполнится или не истечет окно MATCHING_BATCH_WINDOW_MS.
+        """
+        try:
+            response = await self.redis.xreadgroup(
+                groupname=self.CONSUMER_GROUP,
+                consumername=consumer_name,
+                streams={self.STREAM_KEY: ">"},
+                count=self.BATCH_SIZE,
+                block=0,
+            )
+        except Exception as e:
+            if "NOGROUP" in str(e):
+                logger.warning("Группа потребителей не найдена (был flushdb?). Пересоздаем...")
+                await self._ensure_consumer_group()
+                return []
+            # Если другая ошибка — пробрасываем дальше
+            raise e
+
+        if not response:
+            return []
+        messages = list(response[0][1])
+
+        deadline = time.monotonic() + self.BATCH_WINDOW_MS / 1000
+        while len(messages) < self.BATCH_SIZE:
+            remaining_ms = int((deadline - time.monotonic()) * 1000)
+            if remaining_ms <= 0:
+                break
+            response = await self.redis.xreadgroup(
+                groupname=self.CONSUMER_GROUP,
+                consumername=consumer_name,
+                streams={self.STREAM_KEY: ">"},
+                count=self.BATCH_SIZE - len(messages),
+                block=remaining_ms,
+            )
+            if not response:
+                break
+            messages.extend(response[0][1])
+
+        return messages
+
+
+    async def _process_order(self, message_id: str, order: Dict[str, Any]) -> bool:
+        """
+        Жадно подбирает водителя для одного заказа.
+
+        Если свободных водителей рядом нет, заказ переносится в индекс
+        ожидающих заказов, а сообщение подтверждается.
+
+        Returns:
+            True, если водитель найден и ему отправлено предложение.
+        """
+        ride_id = order["ride_id"]
+        driver_id = await self._find_and_lock_nearest_driver(
+            order["start_x"], order["start_y"], ride_id
+        )
+
+        if not driver_id:
+            logger.warning(f"Не удалось найти водителя для заказа {ride_id}. Заказ ожидает появления водителя.")
+            async with self.redis.pipeline(transaction=False) as pipe:
+                self._queue_pending_order(pipe, order)
+                pipe.xack(self.STREAM_KEY, self.CONSUMER_GROUP, message_id)
+                await pipe.execute()
+            return False
+
+        logger.info(f"Найден и заблокирован водитель: ID {driver_id} для заказа {ride_id}")
+        async with self.redis.pipeline(transaction=False) as pipe:
+            self._queue_proposal(pipe, order, driver_id)
+            pipe.xack(self.STREAM_KEY, self.CONSUMER_GROUP, message_id)
+            await pipe.execute()
+
+        logger.info(f"Заказ {ride_id} успешно обработан и подтвержден.")
+        return True
+
+
+    def _search_regions(self, start_x: int, start_y: int) -> List[Tuple[int, int]]:
+        """
+        Возвращает регионы сетки, которые задевает область поиска заказа,
+        в отсортированном порядке. Пересекающиеся области поиска всегда
+        имеют общий регион, поэтому блокировки регионов сериализуют именно
+        конкурирующие за водителей заказы.
+        """
+        size = self.REGION_SIZE
+        radius = self.MAX_SEARCH_RADIUS
+        min_x = max(0, start_x - radius) // size
+        max_x = min(self.rings.grid_n - 1, start_x + radius) // size
+        min_y = max(0, start_y - radius) // size
+        max_y = min(self.rings.grid_m - 1, start_y + radius) // size
+        return [
+            (region_x, region_y)
+            for region_x in range(min_x, max_x + 1)
+            for region_y in range(min_y, max_y + 1)
+        ]
+
+
+    async def _process_order_in_region(self, message_id: str, order: Dict[str, Any]) -> bool:
+        """
+        Обрабатывает заказ под блокировками регионов его области поиска.
+
+        Блокировки берутся в отсортированном порядке, что исключает взаимные
+        блокировки между задачами. Заказы в непересекающихся частях города
+        обрабатываются параллельно.
+        """
+        async with contextlib.AsyncExitStack() as stack:
+            for region in self._search_regions(order["start_x"], order["start_y"]):
+                lock = self._region_locks.setdefault(region, asyncio.Lock())
+                await stack.enter_async_context(lock)
+            return await self._process_order(message_id, order)
+
+
+    async def _process_order_batch(self, orders: List[Tuple[str, Dict[str, Any]]]) -> bool:
+        """
+        Пакетный подбор: назначает водителей заказам пакета так, чтобы суммарное
+        манхэттенское расстояние подачи было минимальным.
+
+        1. Для каждого заказа собираются ближайшие свободные кандидаты.
+        2. Задача о назначениях решается венгерским алгоритмом.
+        3. Все пары блокируются и получают предложения пайплайнами.
+        4. Заказы без пары или с проигранной блокировкой подбираются жадно.
+
+        Returns:
+            True, если все заказы пакета получили водителя.
+        """
+        candidates = [
+            await self._find_free_candidates(
+                order["start_x"], order["start_y"], self.BATCH_CANDIDATES
+            )
+            for _, order in orders
+        ]
+
+        driver_ids = sorted({driver_id for order_candidates in candidates for driver_id, _ in order_candidates})
+        column = {driver_id: j for j, driver_id in enumerate(driver_ids)}
+        cost = [[INF_COST] * len(driver_ids) for _ in orders]
+        for i, order_candidates in enumerate(candidates):
+            for driver_id, distance in order_candidates:
+                cost[i][column[driver_id]] = distance
+
+        assignment = solve_min_cost_assignment(cost)
+        pairs = [
+            (message_id, order, driver_ids[j], cost[i][j])
+            for i, ((message_id, order), j) in enumerate(zip(orders, assignment))
+            if j is not None
+        ]
+
+        # Блокируем всех назначенных водителей одним пайплайном
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for _, order, driver_id, _ in pairs:
+                pipe.set(
+                    f"driver_lock:{driver_id}", order["ride_id"],
+                    ex=self.DRIVER_LOCK_TIMEOUT, nx=True,
+                )
+            locked = await pipe.execute()
+
+        locked_pairs = [pair for pair, was_set in zip(pairs, locked) if was_set]
+        if locked_pairs:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for message_id, order, driver_id, _ in locked_pairs:
+                    self._queue_proposal(pipe, order, driver_id)
+                    pipe.xack(self.STREAM_KEY, self.CONSUMER_GROUP, message_id)
+                await pipe.execute()
+            logger.info(
+                f"Пакет из {len(orders)} заказов: назначено {len(locked_pairs)}, "
+                f"суммарное расстояние подачи {sum(distance for *_, distance in locked_pairs)}."
+            )
+
+        # Оставшиеся заказы обрабатываем по одному
+        matched_ids = {message_id for message_id, *_ in locked_pairs}
+        all_matched = True
+        for message_id, order in orders:
+            if message_id not in matched_ids:
+                all_matched = await self._process_order_in_region(message_id, order) and all_matched
+        return all_matched
+
+
+    async def _handle_messages(self, messages: List[Tuple[str, Dict[str, Any]]]) -> bool:
+        """
+        Обрабатывает прочитанные или перехваченные сообщения потока заказов.
+
+        Returns:
+            True, если для всех корректных заказов найден водитель.
+        """
+        orders = []
+        for message_id, raw_data in messages:
+            logger.info(f"Получен новый заказ {raw_data} с ID {message_id}")
+            event_type, data = self._decode_event(message_id, raw_data)
+            if event_type == 'DriverAssigned':
+                await self._close_ride_search(message_id, data)
+                continue
+
+            order = self._order_from_event(message_id, event_type, data)
+            if order is None:
+                await self.redis.xack(self.STREAM_KEY, self.CONSUMER_GROUP, message_id)
+            else:
+                orders.append((message_id, order))
+
+        if not orders:
+            return True
+        if len(orders) > 1:
+            return await self._process_order_batch(orders)
+        return await self._process_order_in_region(*orders[0])
+
+
+    async def _close_ride_search(self, message_id: str, data: Dict[str, Any]) -> None:
+        """
+        Водитель принял заказ: снимаем таймаут предложения и очищаем состояние
+        повторного поиска, чтобы заказ больше не переназначался.
+        """
+        ride_id = data.get('ride_id')
+        async with self.redis.pipeline(transaction=False) as pipe:
+            if ride_id:
+                pipe.zrem(self.TIMEOUT_ZSET_KEY, f"{ride_id}:{data.get('driver_user_id')}")
+                pipe.hdel(self.PENDING_ORDERS_KEY, ride_id)
+                pipe.delete(
+                    self.RIDE_CONTEXT_KEY.format(ride_id=ride_id),
+                    self.RIDE_EXCLUSIONS_KEY.format(ride_id=ride_id),
+                )
+            pipe.xack(self.STREAM_KEY, self.CONSUMER_GROUP, message_id)
+            await pipe.execute()
+
+
+    async def _process_retry(self, message_id: str, fields: Dict[str, Any]) -> bool:
+        """
+        Повторно ищет водителя для заказа, по которому истек таймаут предложения.
+
+        Водитель из события добавляется в множество исключений заказа, радиус
+        поиска расширяется с каждой попыткой. Координаты берутся из кеша
+        `ride_pickup:{ride_id}`, записанного при первом подборе.
+
+        Если водитель не найден, заказ переносится в индекс ожидающих заказов.
+
+        Returns:
+            True, если сообщение обработано и подтверждено.
+        """
+        ride_id = fields.get("ride_id")
+        context_key = self.RIDE_CONTEXT_KEY.format(ride_id=ride_id)
+        exclusions_key = self.RIDE_EXCLUSIONS_KEY.format(ride_id=ride_id)
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            if fields.get("exclude_driver_id"):
+                pipe.sadd(exclusions_key, fields["exclude_driver_id"])
+            pipe.expire(exclusions_key, self.RIDE_CONTEXT_TTL)
+            pipe.smembers(exclusions_key)
+            pipe.hgetall(context_key)
+            results = await pipe.execute()
+        excluded, context = results[-2], results[-1]
+
+        if not ride_id or not context:
+            logger.error(f"Нет данных для повторного поиска по заказу {ride_id}. Событие {message_id} отброшено.")
+            await self.redis.xack(self.RETRY_STREAM_KEY, self.CONSUMER_GROUP, message_id)
+            return True
+
+        attempt = await self.redis.hincrby(context_key, "attempts", 1)
+        if attempt > self.RETRY_MAX_ATTEMPTS:
+            logger.error(f"Заказ {ride_id} не назначен за {self.RETRY_MAX_ATTEMPTS} попыток повторного поиска.")
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.delete(context_key, exclusions_key)
+                pipe.xack(self.RETRY_STREAM_KEY, self.CONSUMER_GROUP, message_id)
+                await pipe.execute()
+            return True
+
+        order = self._order_from_context(ride_id, context)
+        radius = min(
+            self.MAX_SEARCH_RADIUS + attempt * self.RETRY_RADIUS_STEP,
+            self.rings.max_distance,
+        )
+        logger.info(
+            f"Повторный поиск #{attempt} для заказа {ride_id}: радиус {radius}, исключены {sorted(excluded)}"
+        )
+
+        driver_id = await self._find_and_lock_nearest_driver(
+            order["start_x"], order["start_y"], ride_id,
+            exclude={int(d) for d in excluded},
+            max_radius=radius,
+        )
+        if not driver_id:
+            logger.warning(f"Повторный поиск для заказа {ride_id} не дал результата. Заказ ожидает появления водителя.")
+            async with self.redis.pipeline(transaction=False) as pipe:
+                self._queue_pending_order(pipe, order)
+                pipe.xack(self.RETRY_STREAM_KEY, self.CONSUMER_GROUP, message_id)
+                await pipe.execute()
+            return True
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            self._queue_proposal(pipe, order, driver_id)
+            pipe.xack(self.RETRY_STREAM_KEY, self.CONSUMER_GROUP, message_id)
+            await pipe.execute()
+        logger.info(f"Заказ {ride_id} повторно предложен водителю {driver_id}.")
+        return True
+
+
+    async def _retry_events_listener(self, consumer_name: str):
+        """
+        Воркер, который читает `retry_search_events` и повторно подбирает водителей.
+        """
+        await self._ensure_consumer_group(self.RETRY_STREAM_KEY)
+        logger.info(f"Слушатель повторного поиска '{consumer_name}' запущен...")
 
         while self._running:
             try:
-                try:
-                    response = await self.redis.xreadgroup(
-                        groupname=self.CONSUMER_GROUP,
-                        consumername="consumer-1",
-                        streams={self.STREAM_KEY: ">"},
-                        count=1,
-                        block=0,
-                    )
-                except Exception as e:
-                    if "NOGROUP" in str(e):
-                        logger.warning("Группа потребителей не найдена (был flushdb?). Пересоздаем...")
-                        await self._ensure_consumer_group()
-                        continue
-                    # Если другая ошибка — пробрасываем дальше
-                    raise e
+                response = await self.redis.xreadgroup(
+                    groupname=self.CONSUMER_GROUP,
+                    consumername=consumer_name,
+                    streams={self.RETRY_STREAM_KEY: ">"},
+                    count=1,
+                    block=0,
+                )
+                if not response:
+                    continue
+
+                for message_id, fields in response[0][1]:
+                    await self._process_retry(message_id, fields)
+
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                if "NOGROUP" in str(e):
+                    await self._ensure_consumer_group(self.RETRY_STREAM_KEY)
+                    continue
+                logger.error(f"Ошибка в слушателе повторного поиска: {e}", exc_info=True)
+                await asyncio.sleep(5)
+
+
+    async def _match_pending_order(self, driver_id: int, x: int, y: int) -> Optional[str]:
+        """
+        Обратный подбор: забирает для водителя ближайший ожидающий заказ
+        и отправляет ему предложение.
+
+        Returns:
+            ID предложенного заказа или None.
+        """
+        claimed = await self._claim_pending_order_script(
+            keys=[self.PENDING_ORDERS_KEY],
+            args=[
+                driver_id, x, y, self.MAX_SEARCH_RADIUS, self.DRIVER_LOCK_TIMEOUT,
+                self.rings.grid_n, self.rings.grid_m, self.PENDING_SCAN_LIMIT,
+            ],
+        )
+        if not claimed:
+            return None
+
+        ride_id, distance = claimed
+        context = await self.redis.hgetall(self.RIDE_CONTEXT_KEY.format(ride_id=ride_id))
+        if not context:
+            # Кеш заказа истек — заказ слишком старый, освобождаем водителя
+            logger.warning(f"Ожидающий заказ {ride_id} устарел и снят с ожидания.")
+            await self.redis.delete(f"driver_lock:{driver_id}")
+            return None
+
+        async with self.redis.pipeline(transaction=False) as pipe:
+            self._queue_proposal(pipe, self._order_from_context(ride_id, context), driver_id)
+            await pipe.execute()
+        logger.info(f"Ожидающий заказ {ride_id} предложен водителю {driver_id} (расстояние {distance}).")
+        return ride_id
+
 
+    async def _reverse_matching_listener(self, consumer_name: str):
+        """
+        Воркер обратного подбора: читает ленту присутствия водителей и для
+        каждого водителя, вышедшего на линию или переместившегося, проверяет
+        ожидающие заказы рядом. Группа потребителей гарантирует, что каждое
+        событие обрабатывается одной репликой.
+        """
+        stream_key = settings.DRIVER_PRESENCE_STREAM
+        try:
+            # Обратный подбор интересуют только новые события ленты
+            await self.redis.xgroup_create(stream_key, self.REVERSE_MATCHING_GROUP, id="$", mkstream=True)
+        except Exception as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        logger.info(f"Слушатель обратного подбора '{consumer_name}' запущен...")
+
+        while self._running:
+            try:
+                response = await self.redis.xreadgroup(
+                    groupname=self.REVERSE_MATCHING_GROUP,
+                    consumername=consumer_name,
+                    streams={stream_key: ">"},
+                    count=100,
+                    block=1000,
+                )
                 if not response:
                     continue
 
-                stream_key, messages = response[0]
-                message_id, raw_data = messages[0]
+                events = response[0][1]
+                # Из пачки событий берем последнее состояние каждого водителя
+                latest: Dict[int, Dict[str, Any]] = {}
+                for _, event in events:
+                    latest[int(event["driver_id"])] = event
 
-                logger.info(f"Получен новый заказ {raw_data} с ID {message_id}")
+                for driver_id, event in latest.items():
+                    if event.get("status") == DriverStatus.ONLINE.value:
+                        await self._match_pending_order(driver_id, int(event["x"]), int(event["y"]))
 
-                try:
-                    raw_payload = raw_data['data']
-                    
-                    if isinstance(raw_payload, str):
-                        data = json.loads(raw_payload)
-                    elif isinstance(raw_payload, dict):
-                        data = raw_payload
-                    else:
-                        logger.error(f"Unknown data type: {type(raw_payload)}")
-                        await self.redis.xack(self.STREAM_KEY, self.CONSUMER_GROUP, message_id)
-                        continue
-
-                    # Проверка типа события
-                    event_type = raw_data.get('event', data.get('event'))
-                    
-                    if event_type != 'OrderCreated':
-                        await self.redis.xack(self.STREAM_KEY, self.CONSUMER_GROUP, message_id)
-                        continue
-                    # Валидируем, что данные о координатах пришли
-                    start_x = int(data['start_x'])
-                    start_y = int(data['start_y'])
-                    ride_id = data['ride_id']
-                    end_x = int(data.get('end_x', 0))
-                    end_y = int(data.get('end_y', 0))
-                    price = data.get('price', 0)
-                    
-                except (KeyError, ValueError) as e:
-                    logger.error(f"Некорректные данные в сообщении о заказе {message_id}: {e}")
-                    await self.redis.xack(self.STREAM_KEY, self.CONSUMER_GROUP, message_id)
+                await self.redis.xack(
+                    stream_key, self.REVERSE_MATCHING_GROUP, *[event_id for event_id, _ in events]
+                )
+
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                if "NOGROUP" in str(e):
+                    await self.redis.xgroup_create(stream_key, self.REVERSE_MATCHING_GROUP, id="$", mkstream=True)
                     continue
+                logger.error(f"Ошибка в слушателе обратного подбора: {e}", exc_info=True)
+                await asyncio.sleep(5)
 
-                driver_id = await self._find_and_lock_nearest_driver(start_x, start_y, ride_id)
-
-                if driver_id:
-                    logger.info(f"Найден и заблокирован водитель: ID {driver_id} для заказа {ride_id}")
-
-                    notification_payload = {
-                        "type": "NEW_ORDER_PROPOSAL",
-                        "recipient_user_id": driver_id,
-                        "data": {
-                            "ride_id": ride_id,
-                            "start_x": start_x,
-                            "start_y": start_y,
-                            "end_x": int(data['end_x']), 
-                            "end_y": int(data['end_y']),
-                            "price": data.get('price', 0)
-                        }
-                    }
-
-                    await self.redis.publish(
-                        self.NOTIFICATION_CHANNEL,
-                        json.dumps(notification_payload)
-                    )
-                    
-                    proposal_member = f"{ride_id}:{driver_id}"
-                    timeout_score = int(time.time() + self.PROPOSAL_TIMEOUT)
-                    await self.redis.zadd(self.TIMEOUT_ZSET_KEY, {proposal_member: timeout_score})
-                    
-                    await self.redis.xack(self.STREAM_KEY, self.CONSUMER_GROUP, message_id)
-                    logger.info(f"Заказ {ride_id} успешно обработан и подтвержден.")
 
-                else:
-                    logger.warning(f"Не удалось найти водителя для заказа {data.get('ride_id')}. Заказ остается в очереди.")
-                    await asyncio.sleep(1)
+    async def _handle_messages_in_slot(self, messages: List[Tuple[str, Dict[str, Any]]]) -> None:
+        """
+        Обрабатывает прочитанные сообщения в отдельной задаче и освобождает
+        слот пула. При ошибке сообщения остаются в PEL и будут перехвачены.
+        """
+        try:
+            await self._handle_messages(messages)
+        except Exception as e:
+            logger.error(f"Ошибка обработки заказов {[message_id for message_id, _ in messages]}: {e}", exc_info=True)
+        finally:
+            self._order_slots.release()
+
+
+    async def _order_events_listener(self, consumer_name: str):
+        """
+        Основной воркер, который слушает новые заказы и запускает поиск.
+
+        Каждая прочитанная порция обрабатывается в отдельной задаче, пока
+        есть свободные слоты пула. Когда пул заполнен, слушатель перестает
+        читать поток: новые заказы остаются в Redis и достаются другим репликам.
+        """
+        await self._ensure_consumer_group()
+        logger.info(f"Слушатель новых заказов '{consumer_name}' запущен...")
+        self._running = True
+
+        while self._running:
+            try:
+                await self._order_slots.acquire()
+                try:
+                    messages = await self._read_orders(consumer_name)
+                except BaseException:
+                    self._order_slots.release()
+                    raise
+                if not messages:
+                    self._order_slots.release()
                     continue
 
+                task = asyncio.create_task(self._handle_messages_in_slot(messages))
+                self._order_tasks.add(task)
+                task.add_done_callback(self._order_tasks.discard)
+
             except asyncio.CancelledError:
                 logger.info("Цикл обработки остановлен.")
                 break
@@ -297,29 +1283,162 @@ class DriverMatchingService:
                 await asyncio.sleep(5)
 
 
+    async def _claim_stale_entries(self, stream_key: str) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        Перехватывает записи PEL, которые слишком долго не подтверждены
+        (например, прочитаны упавшей репликой), через XAUTOCLAIM.
+        """
+        claimed: List[Tuple[str, Dict[str, Any]]] = []
+        start_id = "0-0"
+        while True:
+            result = await self.redis.xautoclaim(
+                stream_key,
+                self.CONSUMER_GROUP,
+                self.consumer_names[0],
+                min_idle_time=self.CLAIM_MIN_IDLE_MS,
+                start_id=start_id,
+                count=100,
+            )
+            start_id, messages = result[0], result[1]
+            # Удаленные из потока записи приходят без данных — их просто пропускаем
+            claimed.extend((message_id, fields) for message_id, fields in messages if fields)
+            if start_id in ("0-0", b"0-0"):
+                break
+        return claimed
+
+
+    async def _release_dead_consumer(self, consumer_name: str) -> Dict[str, List[Tuple[str, Dict[str, Any]]]]:
+        """
+        Забирает записи PEL мертвого потребителя во всех потоках матчера
+        и удаляет его из групп. Освобождением занимается только та реплика,
+        которой удалось убрать потребителя из реестра.
+
+        Returns:
+            Перехваченные сообщения, сгруппированные по ключу потока.
+        """
+        claimed: Dict[str, List[Tuple[str, Dict[str, Any]]]] = {}
+        if not await self.redis.zrem(self.CONSUMERS_ZSET_KEY, consumer_name):
+            return claimed
+
+        logger.warning(f"Потребитель '{consumer_name}' перестал отправлять heartbeat. Забираем его заказы.")
+        for stream_key in (self.STREAM_KEY, self.RETRY_STREAM_KEY):
+            stream_claimed = claimed.setdefault(stream_key, [])
+            while True:
+                pending = await self.redis.xpending_range(
+                    stream_key, self.CONSUMER_GROUP,
+                    min="-", max="+", count=100, consumername=consumer_name,
+                )
+                if not pending:
+                    break
+                messages = await self.redis.xclaim(
+                    stream_key, self.CONSUMER_GROUP, self.consumer_names[0],
+                    min_idle_time=0,
+                    message_ids=[entry["message_id"] for entry in pending],
+                )
+                stream_claimed.extend((message_id, fields) for message_id, fields in messages if fields)
+                if len(pending) < 100:
+                    break
+
+            await self.redis.xgroup_delconsumer(stream_key, self.CONSUMER_GROUP, consumer_name)
+        return claimed
+
+
+    async def _consumer_registry_worker(self):
+        """
+        Фоновый воркер реестра потребителей:
+        - публикует heartbeat своих потребителей в `matching_consumers`;
+        - забирает заказы у потребителей, переставших отправлять heartbeat;
+        - периодически перехватывает зависшие записи PEL через XAUTOCLAIM.
+        """
+        logger.info(f"Реестр потребителей запущен: {self.consumer_names}")
+        while self._running:
+            try:
+                now = time.time()
+                await self.redis.zadd(
+                    self.CONSUMERS_ZSET_KEY, {name: now for name in self.consumer_names}
+                )
+
+                claimed: Dict[str, List[Tuple[str, Dict[str, Any]]]] = {
+                    self.STREAM_KEY: [], self.RETRY_STREAM_KEY: [],
+                }
+                dead_consumers = await self.redis.zrangebyscore(
+                    self.CONSUMERS_ZSET_KEY, 0, now - self.CONSUMER_TTL
+                )
+                for consumer_name in dead_consumers:
+                    for stream_key, messages in (await self._release_dead_consumer(consumer_name)).items():
+                        claimed[stream_key].extend(messages)
+                for stream_key in claimed:
+                    claimed[stream_key].extend(await self._claim_stale_entries(stream_key))
+
+                if claimed[self.STREAM_KEY]:
+                    logger.info(f"Перехвачено {len(claimed[self.STREAM_KEY])} неподтвержденных заказов.")
+                    await self._handle_messages(claimed[self.STREAM_KEY])
+                for message_id, fields in claimed[self.RETRY_STREAM_KEY]:
+                    await self._process_retry(message_id, fields)
+
+                await asyncio.sleep(self.CONSUMER_HEARTBEAT_INTERVAL)
+
+            except asyncio.CancelledError:
+                break
+            except Exception as e:
+                if "NOGROUP" in str(e):
+                    await self._ensure_consumer_group()
+                    await self._ensure_consumer_group(self.RETRY_STREAM_KEY)
+                else:
+                    logger.error(f"Ошибка в реестре потребителей: {e}", exc_info=True)
+                await asyncio.sleep(self.CONSUMER_HEARTBEAT_INTERVAL)
+
+
     async def run(self):
         """
         Основной цикл работы сервиса.
         Слушает новые сообщения в потоке и обрабатывает их.
         """
         self._running = True
-        
-        # Запускаем оба воркера параллельно
-        listener_task = asyncio.create_task(self._order_events_listener())
-        timeout_task = asyncio.create_task(self._timeout_checker())
-        
-        logger.info("DriverMatchingService запущен с двумя воркерами.")
-        
-        # Ожидаем завершения любой из задач (в случае ошибки)
-        done, pending = await asyncio.wait(
-            [listener_task, timeout_task],
-            return_when=asyncio.FIRST_COMPLETED,
-        )
 
-        # Если одна задача завершилась, отменяем другую для чистого выхода
-        for task in pending:
-            task.cancel()
-        
+        # Индекс сетки должен быть заполнен до того, как начнется обработка заказов
+        if self.grid_index is not None:
+            self._presence_last_id = await self.grid_index.load_snapshot(
+                self.redis, settings.DRIVER_PRESENCE_STREAM, self.layout
+            )
+
+        # Счетчики тайлов поддерживаются скриптами присутствия только при смене
+        # ячейки — пересчитываем их для водителей, уже стоящих в геоиндексе
+        if self.USE_TILES and self.grid_index is None:
+            await self.profile_service.rebuild_tile_counters(self.rings.grid_n, self.rings.grid_m)
+
+        # Запускаем воркеры параллельно
+        tasks = [
+            asyncio.create_task(self._order_events_listener(consumer_name))
+            for consumer_name in self.consumer_names
+        ]
+        tasks.append(asyncio.create_task(self._retry_events_listener(self.consumer_names[0])))
+        tasks.append(asyncio.create_task(self._reverse_matching_listener(self.consumer_names[0])))
+        tasks.append(asyncio.create_task(self._timeout_checker()))
+        tasks.append(asyncio.create_task(self._stale_driver_sweeper()))
+        tasks.append(asyncio.create_task(self._consumer_registry_worker()))
+        if self.grid_index is not None:
+            tasks.append(asyncio.create_task(self._presence_feed_listener()))
+
+        logger.info(f"DriverMatchingService запущен с {len(tasks)} воркерами (режим поиска: {self.search_mode}).")
+
+        try:
+            # Ожидаем завершения любой из задач (в случае ошибки)
+            await asyncio.wait(
+                tasks,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+        finally:
+            # Если одна задача завершилась (или сервис отменен), отменяем остальные
+            for task in (*tasks, *self._order_tasks):
+                task.cancel()
+
+            # Снимаем себя с реестра: неподтвержденные заказы заберут другие реплики
+            try:
+                await self.redis.zrem(self.CONSUMERS_ZSET_KEY, *self.consumer_names)
+            except Exception as e:
+                logger.warning(f"Не удалось удалить потребителей из реестра: {e}")
+
         logger.info("DriverMatchingService остановлен.")
 
     def stop(self):
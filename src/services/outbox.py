@@ -0,0 +1,155 @@
+"""
+Transactional outbox для событий поездок.
+
+Сервис поездок не публикует события в Redis напрямую: enqueue_event добавляет
+строку в таблицу outbox_events в той же транзакции, что и изменение поездки.
+Если транзакция зафиксирована, событие гарантированно будет доставлено;
+запрос при этом не ждет обращения к Redis.
+
+OutboxRelay в фоне забирает события пачками (FOR UPDATE SKIP LOCKED, поэтому
+несколько процессов API не мешают друг другу), публикует их через общий
+EventPublisher (пайплайны XADD с обрезкой потока MAXLEN ~), дожидается
+подтверждения каждого события и только затем удаляет пачку. Доставка "хотя бы
+один раз": при сбое между XADD и фиксацией удаления пачка будет опубликована повторно.
+"""
+
+import asyncio
+import json
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Mapping, Optional, Tuple
+
+from sqlalchemy import delete, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from src.core.config import settings
+from src.models.outbox import OutboxEvent
+from src.services.redis_publisher import STREAM_ORDERS, EventPublisher
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_event(
+    db: AsyncSession, event_name: str, payload: Mapping[str, Any], stream: str = STREAM_ORDERS
+) -> None:
+    """
+    Добавляет событие в outbox текущей транзакции.
+    Событие будет опубликовано после коммита сессии.
+    """
+    db.add(OutboxEvent(
+        stream=stream,
+        event=event_name,
+        payload=json.dumps(payload, ensure_ascii=False),
+    ))
+
+
+async def enqueue_events(
+    db: AsyncSession, events: Iterable[Tuple[str, Mapping[str, Any]]], stream: str = STREAM_ORDERS
+) -> None:
+    """
+    Добавляет пачку событий (имя, данные) в outbox текущей транзакции
+    одним многострочным INSERT. Используется при массовых операциях.
+    """
+    rows = [
+        {"stream": stream, "event": event_name, "payload": json.dumps(payload, ensure_ascii=False)}
+        for event_name, payload in events
+    ]
+    if rows:
+        await db.execute(insert(OutboxEvent).values(rows))
+
+
+class OutboxRelay:
+    """
+    Фоновая доставка событий из outbox_events в Redis Streams.
+    """
+
+    def __init__(self, publisher: EventPublisher, session_maker: async_sessionmaker[AsyncSession]):
+        self.publisher = publisher # Должен быть запущен (EventPublisher.run) в том же процессе
+        self.session_maker = session_maker
+        self.BATCH_SIZE = settings.OUTBOX_RELAY_BATCH_SIZE # Событий за одну транзакцию
+        self.INTERVAL = settings.OUTBOX_RELAY_INTERVAL_SEC # Пауза, когда очередь пуста
+
+        # Метрики
+        self.relayed = 0 # Всего опубликовано событий
+        self.failures = 0 # Неудачных попыток публикации пачки
+        self.last_batch_size = 0
+        self.max_delay_sec = 0.0 # Наибольшая задержка события от коммита до публикации
+        self.lag_sec = 0.0 # Возраст самого старого неопубликованного события
+
+
+    async def relay_batch(self) -> int:
+        """
+        Публикует одну пачку событий и удаляет ее из outbox в одной транзакции.
+
+        Returns:
+            Число опубликованных событий.
+        """
+        async with self.session_maker() as session:
+            async with session.begin():
+                result = await session.execute(
+                    select(OutboxEvent.id, OutboxEvent.stream, OutboxEvent.event,
+                           OutboxEvent.payload, OutboxEvent.created_at)
+                    .order_by(OutboxEvent.id)
+                    .limit(self.BATCH_SIZE)
+                    .with_for_update(skip_locked=True)
+                )
+                rows = result.all()
+                if not rows:
+                    self.last_batch_size = 0
+                    self.lag_sec = 0.0
+                    return 0
+
+                # Ошибка любой публикации откатывает транзакцию: пачка останется в outbox
+                await asyncio.gather(*(
+                    self.publisher.publish_encoded(row.event, row.payload, stream=row.stream, wait=True)
+                    for row in rows
+                ))
+
+                await session.execute(
+                    delete(OutboxEvent).where(OutboxEvent.id.in_([row.id for row in rows]))
+                )
+
+        now = datetime.now(timezone.utc)
+        self.relayed += len(rows)
+        self.last_batch_size = len(rows)
+        self.max_delay_sec = max(self.max_delay_sec, (now - rows[0].created_at).total_seconds())
+        await self._update_lag()
+        return len(rows)
+
+
+    async def _update_lag(self) -> None:
+        """Обновляет возраст самого старого неопубликованного события."""
+        async with self.session_maker() as session:
+            oldest: Optional[datetime] = await session.scalar(
+                select(OutboxEvent.created_at).order_by(OutboxEvent.id).limit(1)
+            )
+        self.lag_sec = (datetime.now(timezone.utc) - oldest).total_seconds() if oldest else 0.0
+
+
+    def stats(self) -> Dict[str, float]:
+        """Возвращает счетчики для метрик."""
+        return {
+            "relayed": self.relayed,
+            "failures": self.failures,
+            "last_batch_size": self.last_batch_size,
+            "lag_sec": round(self.lag_sec, 3),
+            "max_delay_sec": round(self.max_delay_sec, 3),
+        }
+
+
+    async def run(self):
+        """Фоновый цикл доставки: полные пачки публикуются подряд, иначе пауза INTERVAL."""
+        logger.info(f"Доставка событий из outbox запущена (пачка {self.BATCH_SIZE}).")
+        try:
+            while True:
+                try:
+                    if await self.relay_batch() >= self.BATCH_SIZE:
+                        continue
+                except Exception as e:
+                    self.failures += 1
+                    logger.error(f"Ошибка доставки событий из outbox: {e}", exc_info=True)
+                    await asyncio.sleep(1)
+                    continue
+                await asyncio.sleep(self.INTERVAL)
+        except asyncio.CancelledError:
+            logger.info("Доставка событий из outbox остановлена.")
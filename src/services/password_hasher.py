@@ -0,0 +1,116 @@
+"""
+Хеширование и проверка паролей bcrypt вне event loop.
+
+bcrypt намеренно медленный (десятки миллисекунд на вызов), поэтому синхронный
+вызов в обработчике останавливает весь воркер API вместе с heartbeat и
+WebSocket. PasswordHasher выполняет bcrypt в ограниченном пуле процессов:
+одновременно работает не больше `workers` вызовов, еще `max_queue` ждут
+свободный процесс, остальные сразу отклоняются исключением PasswordHasherBusy.
+"""
+
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional
+
+from passlib.context import CryptContext
+
+from src.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Настройка хеширования паролей bcrypt
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+def _hash_password(password: str) -> str:
+    """Выполняется в процессе пула."""
+    return pwd_context.hash(password)
+
+
+def _verify_password(password: str, hashed_password: str) -> bool:
+    """Выполняется в процессе пула."""
+    return pwd_context.verify(password, hashed_password)
+
+
+class PasswordHasherBusy(Exception):
+    """Очередь на хеширование переполнена."""
+
+
+class PasswordHasher:
+    """
+    Ограниченный пул процессов для bcrypt.
+
+    - `_slots` — семафор на `workers` одновременных вызовов в пуле.
+    - `_in_flight` — вызовы в пуле и в очереди к нему; при `workers + max_queue`
+      новые вызовы отклоняются.
+    """
+
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self._slots = asyncio.Semaphore(self.workers)
+        self._in_flight = 0
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self.completed = 0
+        self.rejected = 0
+
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # Пул создается при первом вызове; spawn вместо fork, чтобы дочерние
+        # процессы не наследовали состояние event loop и потоков родителя
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+
+    async def _run(self, func, *args):
+        if self._in_flight >= self.workers + self.max_queue:
+            self.rejected += 1
+            raise PasswordHasherBusy()
+
+        self._in_flight += 1
+        try:
+            async with self._slots:
+                loop = asyncio.get_running_loop()
+                result = await loop.run_in_executor(self._get_executor(), func, *args)
+            self.completed += 1
+            return result
+        finally:
+            self._in_flight -= 1
+
+
+    async def hash(self, password: str) -> str:
+        """Возвращает bcrypt-хеш пароля. Raises: PasswordHasherBusy."""
+        return await self._run(_hash_password, password)
+
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        """Проверяет пароль по хешу. Raises: PasswordHasherBusy."""
+        return await self._run(_verify_password, password, hashed_password)
+
+
+    def stats(self) -> Dict[str, int]:
+        """Возвращает счетчики для метрик."""
+        return {
+            "workers": self.workers,
+            "in_flight": self._in_flight,
+            "queued": max(0, self._in_flight - self.workers),
+            "max_queue": self.max_queue,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+
+    def shutdown(self) -> None:
+        """Останавливает процессы пула."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# Общий пул процесса API
+password_hasher = PasswordHasher(settings.PASSWORD_HASH_WORKERS, settings.PASSWORD_HASH_MAX_QUEUE)
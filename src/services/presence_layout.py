@@ -0,0 +1,193 @@
+"""
+Схемы хранения присутствия водителей в Redis.
+
+- "classic": хеш `cell:X:Y` (driver_id -> "online") на каждую ячейку и строка
+  `driver_location:{id}` ("x:y") на каждого водителя.
+- "compact": множества `cellset:X:Y` из целых ID (кодировка intset) и позиции,
+  упакованные в число x * M + y внутри хешей-корзин `driver_locations:{id // 100}`.
+  Корзины по 100 полей остаются в компактной кодировке listpack, поэтому вместо
+  десятков тысяч мелких ключей Redis хранит сотни небольших структур.
+
+Скрипты DriverProfileService и DriverMatchingService получают от схемы набор
+Lua-функций доступа к геоиндексу и не зависят от конкретного формата ключей.
+"""
+
+from typing import AsyncIterator, Optional, Tuple
+
+from redis.asyncio import Redis
+
+from src.core.config import settings
+
+
+# Lua-функции доступа для схемы "classic". Локация передается строкой "x:y".
+CLASSIC_LUA_HELPERS = """
+local function location_key(driver_id)
+    return 'driver_location:' .. driver_id
+end
+
+local function get_location(key, driver_id)
+    return redis.call('GET', key)
+end
+
+local function set_location(key, driver_id, location)
+    redis.call('SET', key, location)
+end
+
+local function del_location(key, driver_id)
+    redis.call('DEL', key)
+end
+
+local function cell_add(location, driver_id)
+    return redis.call('HSET', 'cell:' .. location, driver_id, 'online') == 1
+end
+
+local function cell_remove(location, driver_id)
+    return redis.call('HDEL', 'cell:' .. location, driver_id) == 1
+end
+
+local function cell_members(x, y)
+    return redis.call('HKEYS', 'cell:' .. x .. ':' .. y)
+end
+
+local function cell_size(x, y)
+    return redis.call('HLEN', 'cell:' .. x .. ':' .. y)
+end
+"""
+
+# Lua-функции доступа для схемы "compact". Снаружи локация — та же строка "x:y".
+COMPACT_LUA_HELPERS = """
+local GRID_M = %d
+local LOCATION_BUCKET_SIZE = %d
+
+local function location_key(driver_id)
+    return 'driver_locations:' .. math.floor(tonumber(driver_id) / LOCATION_BUCKET_SIZE)
+end
+
+local function get_location(key, driver_id)
+    local packed = tonumber(redis.call('HGET', key, driver_id))
+    if not packed then
+        return false
+    end
+    return math.floor(packed / GRID_M) .. ':' .. math.floor(packed %% GRID_M)
+end
+
+local function set_location(key, driver_id, location)
+    local x, y = string.match(location, '^(%%d+):(%%d+)$')
+    redis.call('HSET', key, driver_id, tonumber(x) * GRID_M + tonumber(y))
+end
+
+local function del_location(key, driver_id)
+    redis.call('HDEL', key, driver_id)
+end
+
+local function cell_add(location, driver_id)
+    return redis.call('SADD', 'cellset:' .. location, driver_id) == 1
+end
+
+local function cell_remove(location, driver_id)
+    return redis.call('SREM', 'cellset:' .. location, driver_id) == 1
+end
+
+local function cell_members(x, y)
+    return redis.call('SMEMBERS', 'cellset:' .. x .. ':' .. y)
+end
+
+local function cell_size(x, y)
+    return redis.call('SCARD', 'cellset:' .. x .. ':' .. y)
+end
+"""
+
+class PresenceLayout:
+    """Схема хранения геоиндекса водителей, выбранная в PRESENCE_STORAGE_LAYOUT."""
+
+    CLASSIC = "classic"
+    COMPACT = "compact"
+    LOCATION_BUCKET_SIZE = 100 # Водителей в одной корзине `driver_locations:{id // 100}`
+
+    def __init__(self, name: Optional[str] = None, grid_m: Optional[int] = None):
+        self.name = name or settings.PRESENCE_STORAGE_LAYOUT
+        if self.name not in (self.CLASSIC, self.COMPACT):
+            raise ValueError(f"Неизвестная схема хранения присутствия: {self.name}")
+        self.grid_m = grid_m or settings.CITY_GRID_M
+        self.compact = self.name == self.COMPACT
+        self.cell_prefix = "cellset" if self.compact else "cell"
+
+        if self.compact:
+            self.lua_helpers = COMPACT_LUA_HELPERS % (self.grid_m, self.LOCATION_BUCKET_SIZE)
+        else:
+            self.lua_helpers = CLASSIC_LUA_HELPERS
+
+
+    def cell_key(self, x: int, y: int) -> str:
+        """Возвращает ключ ячейки геоиндекса."""
+        return f"{self.cell_prefix}:{x}:{y}"
+
+
+    def location_key(self, driver_id: int) -> str:
+        """Возвращает ключ, в котором хранится локация водителя."""
+        if self.compact:
+            return f"driver_locations:{driver_id // self.LOCATION_BUCKET_SIZE}"
+        return f"driver_location:{driver_id}"
+
+
+    def encode_location(self, x: int, y: int) -> str:
+        """Кодирует локацию в формат хранения."""
+        if self.compact:
+            return str(x * self.grid_m + y)
+        return f"{x}:{y}"
+
+
+    def decode_location(self, value: str) -> Tuple[int, int]:
+        """Декодирует локацию из формата хранения. Raises: ValueError."""
+        if self.compact:
+            return divmod(int(value), self.grid_m)
+        x_str, y_str = value.split(":")
+        return int(x_str), int(y_str)
+
+
+    def queue_cell_members(self, pipe, cell_key: str) -> None:
+        """Добавляет в пайплайн чтение ID водителей ячейки по ее ключу."""
+        if self.compact:
+            pipe.smembers(cell_key)
+        else:
+            pipe.hkeys(cell_key)
+
+
+    def queue_add_driver(self, pipe, driver_id: int, x: int, y: int) -> None:
+        """Добавляет в пайплайн запись водителя в ячейку и его локации (для сидирования)."""
+        if self.compact:
+            pipe.sadd(self.cell_key(x, y), driver_id)
+            pipe.hset(self.location_key(driver_id), str(driver_id), self.encode_location(x, y))
+        else:
+            pipe.hset(self.cell_key(x, y), str(driver_id), "online")
+            pipe.set(self.location_key(driver_id), self.encode_location(x, y))
+
+
+    async def iter_locations(self, redis: Redis, batch_size: int = 1000) -> AsyncIterator[Tuple[str, str]]:
+        """Перебирает все сохраненные локации: пары (ID водителя, значение в формате хранения)."""
+        if self.compact:
+            async for key in redis.scan_iter(match="driver_locations:*", count=batch_size):
+                for driver_id, value in (await redis.hgetall(key)).items():
+                    yield driver_id, value
+            return
+
+        batch = []
+        async for key in redis.scan_iter(match="driver_location:*", count=batch_size):
+            batch.append(key)
+            if len(batch) >= batch_size:
+                for item in await self._read_location_keys(redis, batch):
+                    yield item
+                batch = []
+        if batch:
+            for item in await self._read_location_keys(redis, batch):
+                yield item
+
+
+    @staticmethod
+    async def _read_location_keys(redis: Redis, keys):
+        values = await redis.mget(keys)
+        return [
+            (key.split(":", 1)[1], value)
+            for key, value in zip(keys, values)
+            if value
+        ]
@@ -9,7 +9,7 @@
 Значения берутся из src.core.config.settings (поля, добавленные ниже).
 """
 
-from typing import TypedDict
+from typing import Iterable, List, Tuple, TypedDict
 
 from src.core.config import settings
 
@@ -33,3 +33,11 @@ def calculate_price_and_eta(start_x: int, start_y: int, end_x: int, end_y: int)
     price = float(settings.PRICE_BASE_FARE) + distance * float(settings.PRICE_PER_CELL)
 
     return PricingResult(distance=distance, eta_seconds=eta_seconds, price=price)
+
+
+def calculate_prices_and_etas(routes: Iterable[Tuple[int, int, int, int]]) -> List[PricingResult]:
+    """
+    Пакетный вариант calculate_price_and_eta для массового создания поездок.
+    Принимает маршруты (start_x, start_y, end_x, end_y), результаты — в том же порядке.
+    """
+    return [calculate_price_and_eta(*route) for route in routes]
@@ -1,43 +1,184 @@
 """
 Публикация событий в Redis Streams.
+
+Все события процесса проходят через один долгоживущий EventPublisher: вызов
+publish_event только ставит событие в ограниченную очередь в памяти, а фоновая
+задача (запускается в lifespan приложения) сбрасывает накопившиеся события
+одним пайплайном XADD. Вызывающий выбирает режим: "отправил и забыл" или
+ожидание ID записи в потоке.
+
+Основной источник событий API — OutboxRelay (src/services/outbox.py): он
+публикует события из outbox с ожиданием подтверждения и удаляет их из таблицы
+только после XADD.
 """
 
-from typing import Mapping, Any
+from typing import Mapping, Any, Dict, List, Optional, Tuple
 import json
 import asyncio
+import logging
 
 from redis.asyncio import Redis
+from src.core.config import settings
 from src.core.redis import redis_pool
 
+logger = logging.getLogger(__name__)
+
 STREAM_ORDERS = "order_events"
 
 
-async def _get_redis_client() -> Redis:
-    return Redis(connection_pool=redis_pool)
+class PublisherQueueFull(Exception):
+    """Очередь публикатора переполнена."""
+
+
+class EventPublisher:
+    """
+    Пакетная публикация событий в Redis Streams.
+
+    Пачка — все, что накопилось в очереди, пока выполнялся предыдущий пайплайн
+    (но не больше `batch_size`), поэтому под нагрузкой события идут пачками,
+    а одиночное событие уходит без дополнительной задержки.
+    """
+
+    def __init__(
+        self,
+        redis: Optional[Redis] = None,
+        queue_size: int = settings.EVENT_PUBLISHER_QUEUE_SIZE,
+        batch_size: int = settings.EVENT_PUBLISHER_BATCH_SIZE,
+        maxlen: int = settings.EVENT_PUBLISHER_MAXLEN,
+    ):
+        self.redis = redis or Redis(connection_pool=redis_pool)
+        self.batch_size = max(1, batch_size)
+        self.maxlen = maxlen or None
+        self._queue: "asyncio.Queue[Tuple[str, Dict[str, str], Optional[asyncio.Future]]]" = (
+            asyncio.Queue(maxsize=queue_size)
+        )
+
+        # Метрики
+        self.published = 0
+        self.failed = 0
+        self.rejected = 0
+        self.batches = 0
 
 
-async def publish_event(event_name: str, payload: Mapping[str, Any]) -> str:
-    client = await _get_redis_client()
-    try:
+    async def publish(
+        self, event_name: str, payload: Mapping[str, Any], stream: str = STREAM_ORDERS, wait: bool = False
+    ) -> Optional[str]:
+        """
+        Ставит событие в очередь публикации.
+
+        - wait=False: возвращает None сразу; при переполненной очереди
+          выбрасывает PublisherQueueFull.
+        - wait=True: при переполненной очереди ждет места, возвращает ID записи
+          в потоке; ошибка Redis пробрасывается вызывающему.
+        """
+        return await self.publish_encoded(
+            event_name, json.dumps(payload, ensure_ascii=False), stream=stream, wait=wait
+        )
+
+
+    async def publish_encoded(
+        self, event_name: str, payload_json: str, stream: str = STREAM_ORDERS, wait: bool = False
+    ) -> Optional[str]:
+        """То же, что publish, для данных события, уже сериализованных в JSON."""
         data = {
             "event": event_name,
-            "data": json.dumps(payload, ensure_ascii=False),
+            "data": payload_json,
         }
-        return await client.xadd(STREAM_ORDERS, data)
-    finally:
+        if not wait:
+            try:
+                self._queue.put_nowait((stream, data, None))
+            except asyncio.QueueFull:
+                self.rejected += 1
+                raise PublisherQueueFull()
+            return None
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((stream, data, future))
+        return await future
+
+
+    async def flush_batch(self) -> int:
+        """Ждет хотя бы одно событие и публикует пачку. Возвращает ее размер."""
+        batch = [await self._queue.get()] + self._take(self.batch_size - 1)
+        await self._send(batch)
+        return len(batch)
+
+
+    def _take(self, limit: int) -> list:
+        """Забирает из очереди до `limit` событий без ожидания."""
+        items = []
+        while len(items) < limit and not self._queue.empty():
+            items.append(self._queue.get_nowait())
+        return items
+
+
+    async def _send(self, batch: List[Tuple[str, Dict[str, str], Optional[asyncio.Future]]]) -> None:
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for stream, data, _ in batch:
+                    pipe.xadd(stream, data, maxlen=self.maxlen, approximate=True)
+                results = await pipe.execute(raise_on_error=False)
+        except Exception as e:
+            results = [e] * len(batch)
+
+        self.batches += 1
+        for (stream, data, future), result in zip(batch, results):
+            if isinstance(result, Exception):
+                self.failed += 1
+                if future is None:
+                    logger.error(f"Не удалось опубликовать {data['event']} в {stream}: {result}")
+            else:
+                self.published += 1
+            if future is not None and not future.done():
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+
+    def stats(self) -> Dict[str, int]:
+        """Возвращает счетчики для метрик."""
+        return {
+            "queued": self._queue.qsize(),
+            "published": self.published,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "batches": self.batches,
+        }
+
+
+    async def run(self):
+        """Фоновый цикл публикации. При остановке отправляет оставшиеся события."""
+        logger.info(f"Публикатор событий запущен (пачка до {self.batch_size}).")
+        # Отмена во время выполнения пайплайна может быть поглощена клиентом
+        # Redis, поэтому запрос отмены проверяется и явно
+        current_task = asyncio.current_task()
         try:
-            await client.close()
-        except Exception:
-            await asyncio.sleep(0)
+            while not current_task.cancelling():
+                await self.flush_batch()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            while not self._queue.empty():
+                await self._send(self._take(self.batch_size))
+            logger.info("Публикатор событий остановлен.")
+
+
+# Общий публикатор процесса API
+event_publisher = EventPublisher()
+
+
+async def publish_event(event_name: str, payload: Mapping[str, Any], wait: bool = False) -> Optional[str]:
+    return await event_publisher.publish(event_name, payload, wait=wait)
 
 
-async def publish_order_created(payload: Mapping[str, Any]) -> str:
-    return await publish_event("OrderCreated", payload)
+async def publish_order_created(payload: Mapping[str, Any], wait: bool = False) -> Optional[str]:
+    return await publish_event("OrderCreated", payload, wait=wait)
 
 
-async def publish_driver_assigned(payload: Mapping[str, Any]) -> str:
-    return await publish_event("DriverAssigned", payload)
+async def publish_driver_assigned(payload: Mapping[str, Any], wait: bool = False) -> Optional[str]:
+    return await publish_event("DriverAssigned", payload, wait=wait)
 
 
-async def publish_ride_completed(payload: Mapping[str, Any]) -> str:
-    return await publish_event("RideCompleted", payload)
+async def publish_ride_completed(payload: Mapping[str, Any], wait: bool = False) -> Optional[str]:
+    return await publish_event("RideCompleted", payload, wait=wait)
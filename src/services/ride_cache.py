@@ -0,0 +1,69 @@
+"""
+Read-through кеш карточек поездок в Redis для GET /rides/{id}.
+
+Запись `ride:{id}` хранит версию поездки (Ride.version) и данные карточки
+в виде "<version>|<json>". Запись обновляется только скриптом, который не
+перезаписывает более новую версию более старой: читатель, загрузивший
+поездку из БД до коммита изменения, не может вернуть в кеш устаревшие данные.
+После каждого изменения поездки сервис поездок записывает новую версию
+(write-through), поэтому опрос статуса почти всегда обходится одним GET.
+"""
+
+import json
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+from redis.asyncio import Redis
+
+from src.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+# KEYS: ride:{id}
+# ARGV: версия, значение "<version>|<json>", TTL в секундах
+# Возвращает: 1, если запись обновлена, 0 — если в кеше более новая версия
+SET_IF_NEWER_LUA = """
+local current = redis.call('GET', KEYS[1])
+if current then
+    local current_version = tonumber(string.match(current, '^(%d+)|'))
+    if current_version and current_version > tonumber(ARGV[1]) then
+        return 0
+    end
+end
+redis.call('SET', KEYS[1], ARGV[2], 'EX', tonumber(ARGV[3]))
+return 1
+"""
+
+
+class RideCache:
+    """Кеш карточек поездок: данные ответа, участники поездки и версия."""
+
+    KEY = "ride:{ride_id}"
+
+    def __init__(self, redis: Redis):
+        self.redis = redis
+        self.TTL = settings.RIDE_CACHE_TTL_SEC # Время жизни записи в секундах
+        self._set_if_newer_script = self.redis.register_script(SET_IF_NEWER_LUA)
+
+
+    async def get(self, ride_id: int) -> Optional[Tuple[int, Dict[str, Any]]]:
+        """Возвращает (версия, запись) или None при промахе."""
+        value = await self.redis.get(self.KEY.format(ride_id=ride_id))
+        if value is None:
+            return None
+        try:
+            version, data = value.split("|", 1)
+            return int(version), json.loads(data)
+        except ValueError:
+            logger.warning(f"Некорректная запись кеша поездки {ride_id}: {value}")
+            return None
+
+
+    async def store(self, ride_id: int, version: int, entry: Dict[str, Any]) -> bool:
+        """Записывает версию поездки, если в кеше нет более новой."""
+        stored = await self._set_if_newer_script(
+            keys=[self.KEY.format(ride_id=ride_id)],
+            args=[version, f"{version}|{json.dumps(entry, ensure_ascii=False)}", self.TTL],
+        )
+        return bool(stored)
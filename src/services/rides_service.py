@@ -1,28 +1,51 @@
 """
 Сервис для управления поездками (Rides).
-- создание поездки
+- создание поездки (по одной и пачкой)
 - назначение водителя
 - обновление статуса
-- история поездок
+- история поездок (keyset-пагинация)
 - публикация событий OrderCreated / DriverAssigned / RideCompleted
+  через transactional outbox (src/services/outbox.py)
 """
 
-from typing import Dict, Any, List
+import base64
+import logging
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
 from fastapi import HTTPException, status
 
-from sqlalchemy import select
+import redis.asyncio as aioredis
+from sqlalchemy import insert, literal, select, tuple_, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from src.core.config import settings
+from src.core.redis import redis_pool
+
 from src.models.ride import Ride, RideStatusEnum
 from src.schemas.ride import (
     RideCreateSchema,
     RideResponseSchema,
 )
-from src.services.pricing_service import calculate_price_and_eta
-from src.services.redis_publisher import (
-    publish_order_created,
-    publish_driver_assigned,
-    publish_ride_completed,
+from src.services.pricing_service import (
+    PricingResult,
+    calculate_price_and_eta,
+    calculate_prices_and_etas,
+)
+from src.services.outbox import enqueue_event, enqueue_events
+from src.services.ride_cache import RideCache
+
+logger = logging.getLogger(__name__)
+
+# Кеш карточек поездок для опроса статуса, общий клиент пула на процесс
+ride_cache = RideCache(aioredis.Redis(connection_pool=redis_pool))
+
+
+# Колонки, нужные RideResponseSchema: история читает только их, без загрузки
+# ORM-объектов и связанных пользователей
+_HISTORY_COLUMNS = (
+    Ride.id, Ride.price, Ride.status,
+    Ride.start_x, Ride.start_y, Ride.end_x, Ride.end_y,
+    Ride.created_at,
 )
 
 
@@ -40,12 +63,48 @@ def _build_ride_response(ride: Ride) -> RideResponseSchema:
     )
 
 
+def _ride_cache_entry(ride: Ride) -> Dict[str, Any]:
+    """Запись кеша карточки: ответ API и участники поездки для проверки доступа."""
+    return {
+        "ride": _build_ride_response(ride).model_dump(),
+        "passenger_user_id": ride.passenger_user_id,
+        "driver_user_id": ride.driver_user_id,
+    }
+
+
+async def _cache_ride(ride: Ride) -> None:
+    """
+    Записывает зафиксированную версию поездки в кеш (write-through).
+    Ошибка Redis не отменяет уже зафиксированное изменение.
+    """
+    try:
+        await ride_cache.store(ride.id, ride.version, _ride_cache_entry(ride))
+    except Exception as e:
+        logger.warning(f"Не удалось обновить кеш поездки {ride.id} (версия {ride.version}): {e}")
+
+
+def _order_created_payload(ride: Ride, pricing: PricingResult) -> Dict[str, Any]:
+    """Данные события OrderCreated по созданной поездке и ее расчету цены."""
+    return {
+        "ride_id": str(ride.id),
+        "passenger_user_id": str(ride.passenger_user_id),
+        "start_x": ride.start_x,
+        "start_y": ride.start_y,
+        "end_x": ride.end_x,
+        "end_y": ride.end_y,
+        "price": float(pricing["price"]),
+        "eta_seconds": float(pricing["eta_seconds"]),
+        "status": ride.status,
+        "created_at": ride.created_at.isoformat() if ride.created_at else None
+    }
+
+
 async def create_ride(
     ride_data: RideCreateSchema,
     passenger_user_id: int,
     db: AsyncSession
 ) -> RideResponseSchema:
-    """Создает новую поездку и публикует событие OrderCreated."""
+    """Создает новую поездку и в той же транзакции ставит в outbox событие OrderCreated."""
 
     pricing = calculate_price_and_eta(
         start_x=ride_data.start_x,
@@ -64,55 +123,136 @@ async def create_ride(
         price=pricing["price"],
     )
     db.add(new_ride)
-    await db.commit()
+    # ID и время создания нужны для события до коммита
+    await db.flush()
     await db.refresh(new_ride)
 
     # Публикация OrderCreated
-    payload: Dict[str, Any] = {
-        "ride_id": str(new_ride.id),
-        "passenger_user_id": str(new_ride.passenger_user_id),
-        "start_x": new_ride.start_x,
-        "start_y": new_ride.start_y,
-        "end_x": new_ride.end_x,
-        "end_y": new_ride.end_y,
-        "price": float(pricing["price"]),
-        "eta_seconds": float(pricing["eta_seconds"]),
-        "status": new_ride.status,
-        "created_at": new_ride.created_at.isoformat() if new_ride.created_at else None
-    }
+    payload = _order_created_payload(new_ride, pricing)
 
-    try:
-        await publish_order_created(payload)
-    except Exception:
-        pass
+    enqueue_event(db, "OrderCreated", payload)
+    await db.commit()
 
     return _build_ride_response(new_ride)
 
 
-async def assign_driver(
-    ride_id: str,
-    driver_user_id: int,
+async def create_rides_bulk(
+    rides_data: List[RideCreateSchema],
+    passenger_user_id: int,
     db: AsyncSession
-) -> RideResponseSchema:
-    """Назначает водителя на поездку и публикует событие DriverAssigned."""
-
-    ride = await db.get(Ride, int(ride_id))
-    if not ride:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Поездка не найдена")
+) -> List[RideResponseSchema]:
+    """
+    Создает пачку поездок одной транзакцией: цены считаются одним проходом,
+    поездки вставляются многострочными INSERT ... RETURNING (по
+    RIDES_BULK_INSERT_CHUNK строк), события OrderCreated — многострочным
+    INSERT в outbox. Ответ — в порядке входных данных.
+    """
+    pricings = calculate_prices_and_etas(
+        (item.start_x, item.start_y, item.end_x, item.end_y) for item in rides_data
+    )
 
-    # НОВОЕ: Проверка статуса. Принять можно только ожидающий заказ.
-    if ride.status != RideStatusEnum.PENDING.value:
-        raise HTTPException(
-            status_code=status.HTTP_409_CONFLICT,
-            detail=f"Невозможно принять заказ. Его текущий статус: '{ride.status}'"
+    responses: List[RideResponseSchema] = []
+    chunk_size = max(1, settings.RIDES_BULK_INSERT_CHUNK)
+    for offset in range(0, len(rides_data), chunk_size):
+        chunk = rides_data[offset:offset + chunk_size]
+        chunk_pricings = pricings[offset:offset + chunk_size]
+        result = await db.execute(
+            insert(Ride)
+            .values([
+                {
+                    "passenger_user_id": passenger_user_id,
+                    "start_x": item.start_x,
+                    "start_y": item.start_y,
+                    "end_x": item.end_x,
+                    "end_y": item.end_y,
+                    "status": RideStatusEnum.PENDING.value,
+                    "price": pricing["price"],
+                    "version": 1,
+                }
+                for item, pricing in zip(chunk, chunk_pricings)
+            ])
+            .returning(*_HISTORY_COLUMNS, Ride.passenger_user_id)
         )
-    
-    ride.driver_user_id = driver_user_id
-    ride.status = RideStatusEnum.DRIVER_ASSIGNED.value
-    ride.version += 1
+        # Многострочный VALUES не гарантирует порядок RETURNING, а ID растут
+        # в порядке вставки строк — восстанавливаем порядок входных данных
+        rides = sorted(result.all(), key=lambda row: row.id)
+
+        await enqueue_events(db, (
+            ("OrderCreated", _order_created_payload(ride, pricing))
+            for ride, pricing in zip(rides, chunk_pricings)
+        ))
+        responses.extend(_build_ride_response(ride) for ride in rides)
 
     await db.commit()
-    await db.refresh(ride)
+    logger.info(f"Создано поездок пачкой: {len(responses)} (пассажир {passenger_user_id})")
+
+    return responses
+
+
+async def _transition_ride(
+    db: AsyncSession,
+    ride_id: int,
+    new_status: RideStatusEnum,
+    expected_version: Optional[int] = None,
+    **values: Any,
+):
+    """
+    Переводит поездку в `new_status` одним условным UPDATE ... RETURNING:
+    строка меняется, только если текущий статус допускает переход по
+    RIDE_STATUS_TRANSITIONS (и версия совпадает с ожидаемой, если она задана).
+    Параллельные переходы из одного статуса не могут пройти оба: второй
+    UPDATE не найдет строку в исходном статусе. Блокировки строк не нужны.
+
+    Returns:
+        Строка с колонками карточки, версией и участниками поездки.
+
+    Raises:
+        HTTPException 404: поездка не найдена.
+        HTTPException 409: переход недопустим из текущего статуса или версия устарела.
+    """
+    conditions = [Ride.id == ride_id, Ride.status.in_(RideStatusEnum.allowed_from(new_status))]
+    if expected_version is not None:
+        conditions.append(Ride.version == expected_version)
+
+    result = await db.execute(
+        update(Ride)
+        .where(*conditions)
+        .values(status=new_status.value, version=Ride.version + 1, **values)
+        .returning(*_HISTORY_COLUMNS, Ride.version, Ride.passenger_user_id, Ride.driver_user_id)
+        .execution_options(synchronize_session=False)
+    )
+    row = result.one_or_none()
+    if row is not None:
+        return row
+
+    # Переход не состоялся: выясняем причину (только на пути ошибки)
+    current = (await db.execute(
+        select(Ride.status, Ride.version).where(Ride.id == ride_id)
+    )).one_or_none()
+    await db.rollback()
+    if current is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Поездка не найдена")
+    raise HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail=(
+            f"Невозможно перевести поездку в статус '{new_status.value}': "
+            f"текущий статус '{current.status}', версия {current.version}"
+        ),
+    )
+
+
+async def assign_driver(
+    ride_id: str,
+    driver_user_id: int,
+    db: AsyncSession
+) -> RideResponseSchema:
+    """
+    Назначает водителя на поездку и в той же транзакции ставит в outbox событие DriverAssigned.
+    Принять можно только ожидающий заказ; из двух одновременных принятий проходит одно.
+    """
+    ride = await _transition_ride(
+        db, int(ride_id), RideStatusEnum.DRIVER_ASSIGNED, driver_user_id=driver_user_id
+    )
 
     # Публикуем DriverAssigned
     payload = {
@@ -120,10 +260,10 @@ async def assign_driver(
         "driver_user_id": str(driver_user_id),
         "status": ride.status
     }
-    try:
-        await publish_driver_assigned(payload)
-    except Exception:
-        pass
+    enqueue_event(db, "DriverAssigned", payload)
+
+    await db.commit()
+    await _cache_ride(ride)
 
     return _build_ride_response(ride)
 
@@ -131,42 +271,144 @@ async def assign_driver(
 async def update_ride_status(
     ride_id: str,
     new_status: str,
-    db: AsyncSession
+    db: AsyncSession,
+    expected_version: Optional[int] = None,
 ) -> RideResponseSchema:
-    """Обновляет статус поездки и публикует событие RideCompleted, если применимо."""
-
-    ride = await db.get(Ride, int(ride_id))
-    if not ride:
-        raise ValueError("Ride not found")
-
-    ride.status = new_status
-    ride.version += 1
-    await db.commit()
-    await db.refresh(ride)
+    """
+    Обновляет статус поездки по таблице переходов и ставит в outbox событие
+    RideCompleted, если применимо.
+    """
+    ride = await _transition_ride(
+        db, int(ride_id), RideStatusEnum(new_status), expected_version=expected_version
+    )
 
     # Если поездка завершена → публикуем RideCompleted
-    if new_status == RideStatusEnum.COMPLETED.value:
+    if ride.status == RideStatusEnum.COMPLETED.value:
         payload = {
             "ride_id": str(ride.id),
             "status": ride.status
         }
-        try:
-            await publish_ride_completed(payload)
-        except Exception:
-            pass
+        enqueue_event(db, "RideCompleted", payload)
+
+    await db.commit()
+    await _cache_ride(ride)
 
     return _build_ride_response(ride)
 
 
+async def get_ride(
+    ride_id: int,
+    user_id: int,
+    db: AsyncSession,
+) -> Tuple[RideResponseSchema, int]:
+    """
+    Возвращает карточку поездки и ее версию для участника поездки.
+
+    Сначала читается кеш `ride:{id}`; при промахе поездка загружается из БД
+    (только нужные колонки, без связанных пользователей) и кладется в кеш.
+    Недоступный Redis не мешает ответу: ошибка чтения считается промахом,
+    ошибка записи только логируется.
+
+    Raises:
+        HTTPException 404: поездка не найдена.
+        HTTPException 403: пользователь не пассажир и не водитель поездки.
+    """
+    try:
+        cached = await ride_cache.get(ride_id)
+    except Exception as e:
+        logger.warning(f"Не удалось прочитать кеш поездки {ride_id}: {e}")
+        cached = None
+
+    if cached is not None:
+        version, entry = cached
+    else:
+        result = await db.execute(
+            select(
+                *_HISTORY_COLUMNS, Ride.version, Ride.passenger_user_id, Ride.driver_user_id
+            ).where(Ride.id == ride_id)
+        )
+        row = result.one_or_none()
+        if row is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Поездка не найдена")
+        version = row.version
+        entry = _ride_cache_entry(row)
+        await _cache_ride(row)
+
+    if user_id not in (entry["passenger_user_id"], entry["driver_user_id"]):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Нет доступа к поездке")
+
+    return RideResponseSchema(**entry["ride"]), version
+
+
+def encode_history_cursor(created_at: datetime, ride_id: int) -> str:
+    """Кодирует позицию (created_at, id) последней поездки страницы в курсор."""
+    raw = f"{created_at.isoformat()}|{ride_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_history_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Декодирует курсор истории. Raises: ValueError."""
+    try:
+        created_at, ride_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(ride_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError("Некорректный курсор истории") from e
+
+
 async def get_user_rides(
     user_id: int,
-    db: AsyncSession
-) -> List[RideResponseSchema]:
-    """Возвращает историю поездок пользователя."""
+    db: AsyncSession,
+    role: str = "passenger",
+    limit: int = 20,
+    cursor: Optional[str] = None,
+) -> Tuple[List[RideResponseSchema], Optional[str]]:
+    """
+    Возвращает страницу истории поездок пользователя (от новых к старым)
+    как пассажира или как водителя.
 
-    result = await db.execute(
-        select(Ride).where(Ride.passenger_user_id == user_id)
+    Пагинация по ключу (created_at, id) опирается на индексы
+    ix_rides_passenger_history / ix_rides_driver_history, поэтому время
+    ответа не зависит от длины истории.
+
+    Returns:
+        Пара (поездки страницы, курсор следующей страницы или None).
+
+    Raises:
+        ValueError: если курсор некорректен.
+    """
+    owner_column = Ride.driver_user_id if role == "driver" else Ride.passenger_user_id
+
+    # Берем на одну строку больше, чтобы узнать, есть ли следующая страница
+    query = (
+        select(*_HISTORY_COLUMNS)
+        .where(owner_column == user_id)
+        .order_by(Ride.created_at.desc(), Ride.id.desc())
+        .limit(limit + 1)
     )
-    rides = result.scalars().all()
+    if cursor:
+        created_at, ride_id = decode_history_cursor(cursor)
+        query = query.where(
+            tuple_(Ride.created_at, Ride.id)
+            < tuple_(literal(created_at, Ride.created_at.type), literal(ride_id, Ride.id.type))
+        )
+
+    rows = (await db.execute(query)).all()
 
-    return [_build_ride_response(r) for r in rides]
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_history_cursor(rows[-1].created_at, rows[-1].id)
+
+    rides = [
+        RideResponseSchema(
+            ride_id=str(row.id),
+            estimated_price=float(row.price),
+            status=row.status,
+            start_x=row.start_x,
+            start_y=row.start_y,
+            end_x=row.end_x,
+            end_y=row.end_y,
+        )
+        for row in rows
+    ]
+    return rides, next_cursor
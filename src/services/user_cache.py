@@ -0,0 +1,145 @@
+"""
+Кеш проверенных пользователей для зависимостей аутентификации.
+
+JWT подтверждает личность, но зависимости API дополнительно проверяют, что
+пользователь существует в БД. Без кеша это SELECT на каждый heartbeat водителя
+и каждый опрос истории. VerifiedUserCache хранит ID уже проверенных
+пользователей в памяти процесса с ограничением по времени жизни (TTL) и
+размеру (LRU). При изменении или удалении пользователя его ID публикуется в
+Redis Pub/Sub канал, и каждый процесс API сбрасывает запись у себя.
+"""
+
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import redis.asyncio as aioredis
+from redis.asyncio import Redis
+
+from src.core.config import settings
+from src.core.redis import redis_pool
+
+logger = logging.getLogger(__name__)
+
+
+class VerifiedUserCache:
+    """
+    LRU-кеш ID пользователей, существование которых подтверждено в БД.
+
+    - `_expires` — ID пользователя -> момент истечения записи (time.monotonic),
+      в порядке последнего обращения.
+    - `hits`/`misses` — счетчики обращений для метрик.
+    """
+
+    def __init__(self, max_size: int, ttl_sec: float):
+        self.max_size = max_size
+        self.ttl = ttl_sec
+        self._expires: "OrderedDict[int, float]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+
+    def __len__(self) -> int:
+        return len(self._expires)
+
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_size > 0
+
+
+    def contains(self, user_id: int) -> bool:
+        """Проверяет, что пользователь недавно подтвержден. Учитывается в hits/misses."""
+        expires_at = self._expires.get(user_id)
+        if expires_at is not None and expires_at > time.monotonic():
+            self._expires.move_to_end(user_id)
+            self.hits += 1
+            return True
+        if expires_at is not None:
+            del self._expires[user_id]
+        self.misses += 1
+        return False
+
+
+    def add(self, user_id: int) -> None:
+        """Запоминает пользователя как подтвержденного, вытесняя самые давние записи."""
+        if not self.enabled:
+            return
+        self._expires[user_id] = time.monotonic() + self.ttl
+        self._expires.move_to_end(user_id)
+        while len(self._expires) > self.max_size:
+            self._expires.popitem(last=False)
+
+
+    def invalidate(self, user_id: int) -> None:
+        """Удаляет запись о пользователе."""
+        self._expires.pop(user_id, None)
+
+
+    def clear(self) -> None:
+        """Полностью очищает кеш."""
+        self._expires.clear()
+
+
+    def stats(self) -> Dict[str, float]:
+        """Возвращает счетчики для метрик."""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._expires),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+# Общий кеш процесса API
+verified_user_cache = VerifiedUserCache(settings.USER_CACHE_MAX_SIZE, settings.USER_CACHE_TTL_SEC)
+
+
+async def publish_user_invalidation(redis: Redis, user_id: int) -> int:
+    """
+    Сообщает всем процессам API, что пользователь изменен или удален.
+    Вызывается после коммита изменения пользователя в БД.
+
+    Returns:
+        Число подписчиков, получивших сообщение.
+    """
+    verified_user_cache.invalidate(user_id)
+    return await redis.publish(settings.USER_CACHE_INVALIDATION_CHANNEL, str(user_id))
+
+
+async def user_invalidation_listener(
+    redis_client: Optional[Redis] = None, cache: VerifiedUserCache = verified_user_cache
+):
+    """
+    Слушает канал сброса кеша пользователей. Пока подписки нет (старт или
+    разрыв соединения), сообщения теряются, поэтому при каждой (пере)подписке
+    кеш очищается целиком.
+    """
+    redis_client = redis_client or aioredis.Redis(connection_pool=redis_pool)
+    channel = settings.USER_CACHE_INVALIDATION_CHANNEL
+    try:
+        while True:
+            pubsub = redis_client.pubsub()
+            try:
+                await pubsub.subscribe(channel)
+                cache.clear()
+                logger.info(f"Подписка на сброс кеша пользователей '{channel}' установлена.")
+                while True:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=None)
+                    if message and message["type"] == "message":
+                        try:
+                            cache.invalidate(int(message["data"]))
+                        except (TypeError, ValueError):
+                            logger.error(f"Некорректное сообщение сброса кеша: {message['data']}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка подписки на сброс кеша пользователей: {e}", exc_info=True)
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+    except asyncio.CancelledError:
+        logger.info("Слушатель сброса кеша пользователей остановлен.")
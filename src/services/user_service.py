@@ -8,32 +8,47 @@ from datetime import datetime, timedelta
 from fastapi import HTTPException, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from passlib.context import CryptContext
 import jwt
 
 from src.models.user import User
 from src.schemas.user import UserCreateSchema, UserLoginSchema
 from src.core.config import settings
+from src.services.password_hasher import PasswordHasherBusy, password_hasher
 
-# Настройка хеширования паролей bcrypt
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+def _password_hasher_busy() -> HTTPException:
+    """503 при переполненной очереди bcrypt: клиенту стоит повторить позже."""
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Сервис аутентификации перегружен, повторите попытку позже",
+        headers={"Retry-After": "1"},
+    )
 
 
 async def register_user(user_data: UserCreateSchema, db: AsyncSession) -> User:
     """
     Регистрирует нового пользователя.
     
-    Проверяет уникальность email, хеширует пароль и сохраняет пользователя в БД.
+    Проверяет уникальность email, хеширует пароль (в пуле процессов bcrypt)
+    и сохраняет пользователя в БД.
     """
-    result = await db.execute(select(User).where(User.email == user_data.email))
-    existing_user: Optional[User] = result.scalar_one_or_none()
-    if existing_user:
+    existing_user_id: Optional[int] = await db.scalar(
+        select(User.id).where(User.email == user_data.email)
+    )
+    # Соединение с БД не держим, пока bcrypt работает в пуле процессов;
+    # для записи пользователя сессия возьмет соединение заново
+    await db.close()
+    if existing_user_id is not None:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Пользователь с таким email уже существует"
         )
 
-    hashed_password = pwd_context.hash(user_data.password)
+    try:
+        hashed_password = await password_hasher.hash(user_data.password)
+    except PasswordHasherBusy:
+        raise _password_hasher_busy()
+
     new_user = User(email=user_data.email, hashed_password=hashed_password)
     db.add(new_user)
     await db.commit()
@@ -47,11 +62,21 @@ async def authenticate_user(
     """
     Проверяет email и пароль пользователя.
     Если аутентификация успешна — возвращает объект User.
-    Если нет — HTTP 401 Unauthorized.
+    Если нет — HTTP 401 Unauthorized, при перегрузке bcrypt — HTTP 503.
     """
     result = await db.execute(select(User).where(User.email == user_data.email))
     user: Optional[User] = result.scalar_one_or_none()
-    if not user or not pwd_context.verify(user_data.password, user.hashed_password):
+    # Соединение с БД не держим, пока bcrypt работает в пуле процессов
+    await db.close()
+
+    try:
+        password_ok = user is not None and await password_hasher.verify(
+            user_data.password, user.hashed_password
+        )
+    except PasswordHasherBusy:
+        raise _password_hasher_busy()
+
+    if not password_ok:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Неверный email или пароль",
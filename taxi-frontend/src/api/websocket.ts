@@ -33,6 +33,15 @@ class WebSocketService {
     };
   }
 
+  // Отправляет текстовый кадр, если соединение открыто
+  send(data: string): boolean {
+    if (this.ws && this.ws.readyState === WebSocket.OPEN) {
+      this.ws.send(data);
+      return true;
+    }
+    return false;
+  }
+
   subscribe(handler: MessageHandler) {
     this.handlers.push(handler);
     // Функция отписки
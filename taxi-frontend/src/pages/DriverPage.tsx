@@ -25,10 +25,14 @@ export const DriverPage = ({ onBack }: { onBack: () => void }) => {
     let intervalId: any;
     const sendHeartbeat = async () => {
       try {
-        await api.put('/drivers/me/presence', {
-          status: 'online',
-          location: { x: Number(location.x), y: Number(location.y) }
-        });
+        // Heartbeat по открытому WebSocket; HTTP PUT — пока сокет не подключен
+        const frame = `p:online:${Number(location.x)}:${Number(location.y)}`;
+        if (!wsService.send(frame)) {
+          await api.put('/drivers/me/presence', {
+            status: 'online',
+            location: { x: Number(location.x), y: Number(location.y) }
+          });
+        }
         setLastUpdate(new Date().toLocaleTimeString());
         setStatus('online');
       } catch (e) { setStatus('error'); }
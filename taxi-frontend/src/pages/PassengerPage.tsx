@@ -16,10 +16,9 @@ export const PassengerPage = ({ onBack }: { onBack: () => void }) => {
     if (step === 'ordered' && rideInfo?.ride_id) {
       interval = setInterval(async () => {
         try {
-          const res = await api.get('/rides/history');
-          const myRides = res.data;
-          // Берем последний заказ с таким же ID
-          const currentRide = myRides.find((r: any) => r.ride_id === rideInfo.ride_id);
+          // Карточка поездки отдается из кеша; браузер сам перепроверяет ее по ETag
+          const res = await api.get(`/rides/${rideInfo.ride_id}`);
+          const currentRide = res.data;
           
           if (currentRide) {
             setRideInfo(currentRide);
@@ -0,0 +1,57 @@
+"""Unit-тесты для разбора тела массового создания поездок."""
+
+import pytest
+from fastapi import HTTPException
+
+from src.api.v1.rides import _parse_bulk_rides
+from src.schemas.ride import RideCreateSchema
+
+
+def test_parse_bulk_rides_json_array_and_ndjson():
+    """
+    Тест-кейс: Одни и те же поездки переданы JSON-массивом и NDJSON.
+
+    Ожидаемый результат:
+    1. Оба формата разбираются в одинаковый список в порядке входных данных.
+    2. Пустые строки NDJSON пропускаются, параметры Content-Type не мешают.
+    """
+    # Arrange
+    expected = [
+        RideCreateSchema(start_x=1, start_y=2, end_x=3, end_y=4),
+        RideCreateSchema(start_x=0, start_y=0, end_x=5, end_y=5),
+    ]
+    json_body = b'[{"start_x": 1, "start_y": 2, "end_x": 3, "end_y": 4}, {"start_x": 0, "start_y": 0, "end_x": 5, "end_y": 5}]'
+    ndjson_body = b'{"start_x": 1, "start_y": 2, "end_x": 3, "end_y": 4}\n\n{"start_x": 0, "start_y": 0, "end_x": 5, "end_y": 5}\n'
+
+    # Act
+    from_json = _parse_bulk_rides(json_body, "application/json")
+    from_ndjson = _parse_bulk_rides(ndjson_body, "application/x-ndjson; charset=utf-8")
+
+    # Assert
+    assert from_json == expected
+    assert from_ndjson == expected
+
+
+def test_parse_bulk_rides_rejects_invalid_input():
+    """
+    Тест-кейс: Некорректная строка NDJSON и пустые тела запроса.
+
+    Ожидаемый результат:
+    1. Ошибка в NDJSON — 422 с номером строки.
+    2. Пустое тело JSON — 422; пустой NDJSON дает пустой список
+       (эндпоинт отвечает на него 422).
+    """
+    # Arrange
+    ndjson_body = b'{"start_x": 1, "start_y": 2, "end_x": 3, "end_y": 4}\n{"start_x": -1, "start_y": 2, "end_x": 3, "end_y": 4}\n'
+
+    # Act / Assert
+    with pytest.raises(HTTPException) as bad_line:
+        _parse_bulk_rides(ndjson_body, "application/x-ndjson")
+    assert bad_line.value.status_code == 422
+    assert bad_line.value.detail.startswith("Строка 2:")
+
+    with pytest.raises(HTTPException) as empty_json:
+        _parse_bulk_rides(b"", "application/json")
+    assert empty_json.value.status_code == 422
+
+    assert _parse_bulk_rides(b"", "application/x-ndjson") == []
@@ -0,0 +1,37 @@
+"""Unit-тесты для метрик выдачи соединений из пула БД."""
+
+from types import SimpleNamespace
+
+from src.core.db import PoolCheckoutMetrics, request_scope_var
+
+
+def test_checkouts_are_attributed_to_route_template():
+    """
+    Тест-кейс: Соединение берется внутри запроса к маршруту с параметром и вне запроса.
+
+    Ожидаемый результат:
+    1. Выдача учитывается по шаблону пути маршрута, а не по конкретному URL.
+    2. После возврата соединения счетчик in_use обнуляется.
+    3. Выдача вне HTTP-запроса учитывается как "background".
+    """
+    # Arrange
+    metrics = PoolCheckoutMetrics()
+    record = SimpleNamespace(info={})
+    scope = {"method": "GET", "path": "/api/v1/rides/42", "route": SimpleNamespace(path="/api/v1/rides/{ride_id}")}
+
+    # Act
+    token = request_scope_var.set(scope)
+    try:
+        metrics.on_checkout(None, record, None)
+        in_use = metrics.stats()["GET /api/v1/rides/{ride_id}"]["in_use"]
+        metrics.on_checkin(None, record)
+    finally:
+        request_scope_var.reset(token)
+    metrics.on_checkout(None, SimpleNamespace(info={}), None)
+
+    # Assert
+    stats = metrics.stats()
+    assert in_use == 1
+    assert stats["GET /api/v1/rides/{ride_id}"]["checkouts"] == 1
+    assert stats["GET /api/v1/rides/{ride_id}"]["in_use"] == 0
+    assert stats["background"]["in_use"] == 1
@@ -0,0 +1,38 @@
+"""Unit-тесты для решателя задачи о назначениях."""
+
+from src.services.assignment_solver import INF_COST, solve_min_cost_assignment
+
+
+def test_square_matrix_finds_global_minimum():
+    """
+    Тест-кейс: Жадный выбор по строкам дает сумму 1 + 4 = 5, оптимум — 2 + 1 = 3.
+
+    Ожидаемый результат: назначение с минимальной суммарной стоимостью.
+    """
+    cost = [
+        [1, 2],
+        [1, 4],
+    ]
+    assert solve_min_cost_assignment(cost) == [1, 0]
+
+
+def test_rectangular_and_forbidden_pairs():
+    """
+    Тест-кейс: Заказов больше, чем водителей, часть пар недопустима.
+
+    Ожидаемый результат:
+    1. Строки без допустимой пары получают None.
+    2. Каждый столбец назначен не более чем одной строке.
+    """
+    cost = [
+        [INF_COST, 3],
+        [INF_COST, 1],
+        [2, INF_COST],
+    ]
+    assert solve_min_cost_assignment(cost) == [None, 1, 0]
+
+
+def test_empty_matrix():
+    """Тест-кейс: Пустой пакет или отсутствие кандидатов."""
+    assert solve_min_cost_assignment([]) == []
+    assert solve_min_cost_assignment([[], []]) == [None, None]
@@ -3,8 +3,10 @@
 import pytest
 from fakeredis.aioredis import FakeRedis
 
+from src.core.config import settings
 from src.schemas.driver import DriverPresenceSchema, DriverLocationSchema, DriverStatus
-from src.services.driver_profile_service import DriverProfileService
+from src.services.driver_profile_service import DriverProfileService, PresenceBatcher
+from src.services.presence_layout import PresenceLayout
 
 # Помечаем все тесты в этом модуле как асинхронные
 pytestmark = pytest.mark.asyncio
@@ -136,4 +138,207 @@ async def test_update_presence_driver_goes_offline(
 
     # Проверяем, что ключ с локацией удален
     location_exists = await redis_client.exists(location_key)
-    assert not location_exists
\ No newline at end of file
+    assert not location_exists
+
+async def test_update_presence_reports_cell_change(
+    driver_profile_service: DriverProfileService,
+    redis_client: FakeRedis
+):
+    """
+    Тест-кейс: Водитель отправляет heartbeat из той же ячейки, затем переезжает.
+
+    Ожидаемый результат:
+    1. Первый выход на линию и переезд возвращают True, повторный heartbeat — False.
+    2. Водитель находится ровно в одной ячейке геоиндекса.
+    3. Последнее состояние водителя помечено в `drivers_dirty`, в том числе
+       после heartbeat из той же ячейки.
+    """
+    # Arrange
+    driver_id = 104
+
+    def presence(x: int, y: int) -> DriverPresenceSchema:
+        return DriverPresenceSchema(status=DriverStatus.ONLINE, location=DriverLocationSchema(x=x, y=y))
+
+    # Act
+    went_online = await driver_profile_service.update_presence(driver_id, presence(1, 1))
+    same_cell = await driver_profile_service.update_presence(driver_id, presence(1, 1))
+    moved = await driver_profile_service.update_presence(driver_id, presence(2, 1))
+
+    # Assert
+    assert (went_online, same_cell, moved) == (True, False, True)
+    assert await redis_client.hgetall("cell:1:1") == {}
+    assert await redis_client.hgetall("cell:2:1") == {str(driver_id): "online"}
+    # Последнее состояние помечено для отложенной записи в БД
+    dirty = await redis_client.hget(driver_profile_service.DIRTY_KEY, str(driver_id))
+    assert dirty.startswith("online:2:1:")
+    await redis_client.delete(driver_profile_service.DIRTY_KEY)
+    assert await driver_profile_service.update_presence(driver_id, presence(2, 1)) is False
+    dirty = await redis_client.hget(driver_profile_service.DIRTY_KEY, str(driver_id))
+    assert dirty.startswith("online:2:1:")
+
+
+async def test_evict_stale_drivers(
+    driver_profile_service: DriverProfileService,
+    redis_client: FakeRedis
+):
+    """
+    Тест-кейс: Один водитель перестал отправлять heartbeat, другой активен.
+
+    Ожидаемый результат:
+    1. Неактивный водитель удален из геоиндекса и `driver_last_seen`.
+    2. В ленту присутствия опубликовано событие offline для него.
+    3. Активный водитель остается на карте.
+    """
+    # Arrange
+    for driver_id, x in ((105, 3), (106, 4)):
+        await driver_profile_service.update_presence(
+            driver_id,
+            DriverPresenceSchema(status=DriverStatus.ONLINE, location=DriverLocationSchema(x=x, y=3)),
+        )
+    await redis_client.zadd(driver_profile_service.LAST_SEEN_KEY, {"105": 100.0})
+
+    # Act
+    evicted, oldest_seen = await driver_profile_service.evict_stale_drivers(seen_before=200.0, batch_size=10)
+
+    # Assert
+    assert evicted == 1
+    assert oldest_seen == await redis_client.zscore(driver_profile_service.LAST_SEEN_KEY, "106")
+    assert await redis_client.hgetall("cell:3:3") == {}
+    assert await redis_client.get("driver_location:105") is None
+    assert await redis_client.hgetall("cell:4:3") == {"106": "online"}
+    events = await redis_client.xrevrange(settings.DRIVER_PRESENCE_STREAM, count=1)
+    assert events[0][1] == {"driver_id": "105", "status": "offline", "x": "3", "y": "3"}
+
+
+async def test_presence_batcher_keeps_latest_update_per_driver(
+    driver_profile_service: DriverProfileService,
+    redis_client: FakeRedis
+):
+    """
+    Тест-кейс: За окно пакетирования один водитель прислал два обновления, другой — одно.
+
+    Ожидаемый результат:
+    1. Пачка содержит по одному (последнему) обновлению на водителя.
+    2. Оба водителя записаны в геоиндекс.
+    """
+    # Arrange
+    batcher = PresenceBatcher(driver_profile_service, window_ms=10)
+
+    def presence(x: int, y: int) -> DriverPresenceSchema:
+        return DriverPresenceSchema(status=DriverStatus.ONLINE, location=DriverLocationSchema(x=x, y=y))
+
+    batcher.submit(107, presence(1, 1))
+    batcher.submit(107, presence(2, 2))
+    batcher.submit(108, presence(3, 3))
+
+    # Act
+    flushed = await batcher.flush()
+
+    # Assert
+    assert flushed == 2
+    assert await redis_client.hgetall("cell:1:1") == {}
+    assert await redis_client.hgetall("cell:2:2") == {"107": "online"}
+    assert await redis_client.hgetall("cell:3:3") == {"108": "online"}
+
+
+async def test_tile_counters_follow_cell_changes(
+    driver_profile_service: DriverProfileService,
+    redis_client: FakeRedis
+):
+    """
+    Тест-кейс: Два водителя в одном тайле, затем один переезжает в другой тайл, второй уходит с линии.
+
+    Ожидаемый результат: счетчики `tile:8:*` и `tile:32:*` совпадают с числом
+    водителей в ячейках, опустевшие счетчики удалены.
+    """
+    # Arrange
+    def presence(status: DriverStatus, x: int, y: int) -> DriverPresenceSchema:
+        return DriverPresenceSchema(status=status, location=DriverLocationSchema(x=x, y=y))
+
+    await driver_profile_service.update_presence(109, presence(DriverStatus.ONLINE, 1, 1))
+    await driver_profile_service.update_presence(110, presence(DriverStatus.ONLINE, 2, 2))
+    await driver_profile_service.update_presence(110, presence(DriverStatus.ONLINE, 2, 2))
+    assert await redis_client.get("tile:8:0:0") == "2"
+
+    # Act
+    await driver_profile_service.update_presence(109, presence(DriverStatus.ONLINE, 40, 9))
+    await driver_profile_service.update_presence(110, presence(DriverStatus.OFFLINE, 2, 2))
+
+    # Assert
+    assert await redis_client.get("tile:8:0:0") is None
+    assert await redis_client.get("tile:32:0:0") is None
+    assert await redis_client.get("tile:8:5:1") == "1"
+    assert await redis_client.get("tile:32:1:0") == "1"
+
+
+@pytest.mark.parametrize("layout_name", [PresenceLayout.CLASSIC, PresenceLayout.COMPACT])
+async def test_rebuild_tile_counters_from_cells(layout_name: str, redis_client: FakeRedis):
+    """
+    Тест-кейс: Водители попали в ячейки геоиндекса без счетчиков тайлов
+    (например, до включения отсечения), один счетчик устарел.
+
+    Ожидаемый результат:
+    1. Счетчики всех тайлов пересчитаны по ячейкам.
+    2. Устаревший счетчик пустого тайла удален.
+    """
+    # Arrange
+    layout = PresenceLayout(layout_name)
+    service = DriverProfileService(redis=redis_client, layout=layout)
+    async with redis_client.pipeline(transaction=False) as pipe:
+        layout.queue_add_driver(pipe, 1, 2, 3)
+        layout.queue_add_driver(pipe, 2, 2, 3)
+        layout.queue_add_driver(pipe, 3, 40, 9)
+        pipe.set("tile:8:9:9", 5)
+        await pipe.execute()
+
+    # Act
+    drivers = await service.rebuild_tile_counters(100, 100)
+
+    # Assert
+    assert drivers == 3
+    assert await redis_client.get("tile:8:0:0") == "2"
+    assert await redis_client.get("tile:32:0:0") == "2"
+    assert await redis_client.get("tile:8:5:1") == "1"
+    assert await redis_client.get("tile:32:1:0") == "1"
+    assert await redis_client.get("tile:8:9:9") is None
+
+
+async def test_compact_layout_stores_packed_locations(redis_client: FakeRedis):
+    """
+    Тест-кейс: Водители выходят на линию, перемещаются и вытесняются в компактной схеме хранения.
+
+    Ожидаемый результат:
+    1. Состав ячейки хранится в множестве `cellset:X:Y`, ключи `cell:*` не создаются.
+    2. Локации упакованы в число x * M + y в общей корзине `driver_locations:{id // 100}`.
+    3. Вытеснение убирает водителя из множества и из корзины.
+    """
+    # Arrange
+    layout = PresenceLayout(PresenceLayout.COMPACT)
+    service = DriverProfileService(redis=redis_client, layout=layout)
+
+    def presence(x: int, y: int) -> DriverPresenceSchema:
+        return DriverPresenceSchema(status=DriverStatus.ONLINE, location=DriverLocationSchema(x=x, y=y))
+
+    # Act
+    await service.update_presence(110, presence(5, 7))
+    await service.update_presence(111, presence(5, 7))
+    moved = await service.update_presence(110, presence(6, 7))
+
+    # Assert
+    assert moved is True
+    assert await redis_client.smembers("cellset:5:7") == {"111"}
+    assert await redis_client.smembers("cellset:6:7") == {"110"}
+    assert await redis_client.keys("cell:*") == []
+    assert await redis_client.hgetall("driver_locations:1") == {
+        "110": str(6 * settings.CITY_GRID_M + 7),
+        "111": str(5 * settings.CITY_GRID_M + 7),
+    }
+
+    # Act: 111 перестал отправлять heartbeat
+    await redis_client.zadd(service.LAST_SEEN_KEY, {"111": 100.0})
+    evicted, _ = await service.evict_stale_drivers(seen_before=200.0, batch_size=10)
+
+    # Assert
+    assert evicted == 1
+    assert await redis_client.exists("cellset:5:7") == 0
+    assert await redis_client.hgetall("driver_locations:1") == {"110": str(6 * settings.CITY_GRID_M + 7)}
@@ -0,0 +1,34 @@
+"""Unit-тесты для порядка обхода сетки ManhattanRings."""
+
+from src.services.grid_search import ManhattanRings
+
+
+def test_rings_are_ordered_by_manhattan_distance():
+    """
+    Тест-кейс: Кольца вокруг точки в центре сетки.
+
+    Ожидаемый результат: кольцо d содержит ровно 4d ячеек на расстоянии d.
+    """
+    rings = ManhattanRings(grid_n=50, grid_m=50, max_radius=5)
+
+    assert rings.cells(20, 20, 0) == [(20, 20)]
+    for d in range(1, 8):
+        cells = rings.cells(20, 20, d)
+        assert len(cells) == len(set(cells)) == 4 * d
+        assert all(abs(x - 20) + abs(y - 20) == d for x, y in cells)
+
+
+def test_rings_are_clipped_to_city_bounds():
+    """
+    Тест-кейс: Заказ в углу сетки.
+
+    Ожидаемый результат:
+    1. В кольцах нет ячеек с отрицательными или выходящими за сетку координатами.
+    2. За пределами максимального расстояния кольца пусты.
+    """
+    rings = ManhattanRings(grid_n=3, grid_m=4, max_radius=20)
+
+    assert rings.cells(0, 0, 1) == [(0, 1), (1, 0)]
+    assert rings.cells(0, 0, 5) == [(2, 3)]
+    assert rings.cells(0, 0, 6) == []
+    assert rings.cell_key(2, 3) == "cell:2:3"
@@ -0,0 +1,484 @@
+"""Unit-тесты для DriverMatchingService."""
+
+import asyncio
+import json
+import time
+
+import pytest
+from fakeredis.aioredis import FakeRedis
+
+from src.core.config import settings
+from src.schemas.driver import DriverPresenceSchema, DriverLocationSchema, DriverStatus
+from src.services.driver_profile_service import DriverProfileService
+from src.services.matching_service import DriverMatchingService
+from src.services.presence_layout import PresenceLayout
+
+# Помечаем все тесты в этом модуле как асинхронные
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture
+async def redis_client() -> FakeRedis:
+    """Фикстура для предоставления чистого in-memory Redis клиента для каждого теста."""
+    client = FakeRedis(decode_responses=True)
+    yield client
+    await client.flushall()
+
+
+@pytest.fixture
+def driver_profile_service(redis_client: FakeRedis) -> DriverProfileService:
+    """Фикстура для создания экземпляра DriverProfileService."""
+    return DriverProfileService(redis=redis_client)
+
+
+async def _go_online(service: DriverProfileService, driver_id: int, x: int, y: int) -> None:
+    """Вспомогательная функция: переводит водителя в online в точке (x, y)."""
+    await service.update_presence(
+        driver_id,
+        DriverPresenceSchema(status=DriverStatus.ONLINE, location=DriverLocationSchema(x=x, y=y)),
+    )
+
+
+@pytest.mark.parametrize("search_mode", ["redis", "local", "lua"])
+async def test_find_and_lock_nearest_driver(
+    search_mode: str,
+    driver_profile_service: DriverProfileService,
+    redis_client: FakeRedis,
+):
+    """
+    Тест-кейс: В городе три водителя, ближайший к точке заказа уже заблокирован.
+
+    Ожидаемый результат:
+    1. Выбирается следующий по удаленности свободный водитель.
+    2. На него ставится блокировка `driver_lock:{id}` с ID заказа.
+    """
+    # Arrange
+    await _go_online(driver_profile_service, 1, 10, 10)
+    await _go_online(driver_profile_service, 2, 12, 10)
+    await _go_online(driver_profile_service, 3, 30, 30)
+    await redis_client.set("driver_lock:1", "other_ride")
+
+    matcher = DriverMatchingService(redis=redis_client, search_mode=search_mode)
+    if matcher.grid_index is not None:
+        await matcher.grid_index.load_snapshot(redis_client, settings.DRIVER_PRESENCE_STREAM)
+
+    # Act
+    driver_id = await matcher._find_and_lock_nearest_driver(10, 10, "ride_1")
+
+    # Assert
+    assert driver_id == 2
+    assert await redis_client.get("driver_lock:2") == "ride_1"
+
+
+async def test_grid_index_follows_presence_feed(
+    driver_profile_service: DriverProfileService,
+    redis_client: FakeRedis,
+):
+    """
+    Тест-кейс: После загрузки снимка водители перемещаются и уходят с линии.
+
+    Ожидаемый результат: индекс, применивший события ленты присутствия,
+    совпадает с геоиндексом в Redis.
+    """
+    # Arrange
+    await _go_online(driver_profile_service, 7, 5, 5)
+    await _go_online(driver_profile_service, 8, 6, 6)
+
+    matcher = DriverMatchingService(redis=redis_client, search_mode="local")
+    last_id = await matcher.grid_index.load_snapshot(redis_client, settings.DRIVER_PRESENCE_STREAM)
+    assert len(matcher.grid_index) == 2
+
+    # Act: водитель 7 переезжает, водитель 8 уходит с линии
+    await _go_online(driver_profile_service, 7, 40, 41)
+    await driver_profile_service.update_presence(
+        8,
+        DriverPresenceSchema(status=DriverStatus.OFFLINE, location=DriverLocationSchema(x=6, y=6)),
+    )
+    events = await redis_client.xrange(settings.DRIVER_PRESENCE_STREAM, min=f"({last_id}")
+    for _, event in events:
+        matcher.grid_index.apply_event(event)
+
+    # Assert
+    assert matcher.grid_index.drivers_in_cells([(5, 5), (6, 6)]) == []
+    assert matcher.grid_index.drivers_in_cells([(40, 41)]) == [7]
+    assert len(matcher.grid_index) == 1
+
+
+async def test_batch_assignment_minimizes_total_pickup_distance(
+    driver_profile_service: DriverProfileService,
+    redis_client: FakeRedis,
+):
+    """
+    Тест-кейс: Два заказа и два водителя на одной линии.
+    Жадная обработка первого заказа забрала бы водителя 1 и дала сумму 1 + 4 = 5.
+
+    Ожидаемый результат:
+    1. Пакетный режим назначает пары с суммой 2 + 1 = 3.
+    2. Оба сообщения подтверждены, таймауты предложений поставлены.
+    """
+    # Arrange
+    await _go_online(driver_profile_service, 1, 1, 0)
+    await _go_online(driver_profile_service, 2, 4, 0)
+
+    matcher = DriverMatchingService(redis=redis_client, search_mode="redis")
+    matcher.BATCH_SIZE = 10
+    matcher.BATCH_WINDOW_MS = 0
+    await matcher._ensure_consumer_group()
+    for ride_id, x in (("ride_a", 2), ("ride_b", 0)):
+        await redis_client.xadd(matcher.STREAM_KEY, {
+            "event": "OrderCreated",
+            "data": json.dumps({"ride_id": ride_id, "start_x": x, "start_y": 0, "end_x": 9, "end_y": 9}),
+        })
+
+    # Act
+    messages = await matcher._read_orders(matcher.consumer_names[0])
+    orders = [(message_id, matcher._parse_order_message(message_id, raw)) for message_id, raw in messages]
+    all_matched = await matcher._process_order_batch(orders)
+
+    # Assert
+    assert all_matched
+    assert await redis_client.get("driver_lock:2") == "ride_a"
+    assert await redis_client.get("driver_lock:1") == "ride_b"
+    assert await redis_client.zcard(matcher.TIMEOUT_ZSET_KEY) == 2
+    pending = await redis_client.xpending(matcher.STREAM_KEY, matcher.CONSUMER_GROUP)
+    assert pending["pending"] == 0
+
+
+async def test_dead_consumer_orders_are_reclaimed(
+    driver_profile_service: DriverProfileService,
+    redis_client: FakeRedis,
+):
+    """
+    Тест-кейс: Реплика прочитала заказ и упала, не подтвердив его.
+
+    Ожидаемый результат:
+    1. Живая реплика забирает запись PEL мертвого потребителя и назначает водителя.
+    2. Мертвый потребитель удален из группы и из реестра.
+    """
+    # Arrange
+    await _go_online(driver_profile_service, 5, 3, 3)
+
+    crashed = DriverMatchingService(redis=redis_client)
+    alive = DriverMatchingService(redis=redis_client)
+    await crashed._ensure_consumer_group()
+    await crashed._ensure_consumer_group(crashed.RETRY_STREAM_KEY)
+    await redis_client.xadd(crashed.STREAM_KEY, {
+        "event": "OrderCreated",
+        "data": json.dumps({"ride_id": "ride_x", "start_x": 3, "start_y": 3, "end_x": 0, "end_y": 0}),
+    })
+    await crashed._read_orders(crashed.consumer_names[0])
+    await redis_client.zadd(crashed.CONSUMERS_ZSET_KEY, {crashed.consumer_names[0]: 1})
+
+    # Act
+    claimed = await alive._release_dead_consumer(crashed.consumer_names[0])
+    all_matched = await alive._handle_messages(claimed[alive.STREAM_KEY])
+
+    # Assert
+    assert all_matched
+    assert await redis_client.get("driver_lock:5") == "ride_x"
+    consumers = await redis_client.xinfo_consumers(alive.STREAM_KEY, alive.CONSUMER_GROUP)
+    assert [c["name"] for c in consumers] == [alive.consumer_names[0]]
+    assert await redis_client.zscore(alive.CONSUMERS_ZSET_KEY, crashed.consumer_names[0]) is None
+
+
+@pytest.mark.parametrize("search_mode", ["redis", "lua"])
+async def test_retry_excludes_previous_driver(
+    search_mode: str,
+    driver_profile_service: DriverProfileService,
+    redis_client: FakeRedis,
+):
+    """
+    Тест-кейс: Ближайший водитель проигнорировал предложение, сработал таймаут.
+
+    Ожидаемый результат:
+    1. Повторный поиск берет координаты из кеша `ride_pickup:{id}`.
+    2. Проигнорировавший водитель исключен, заказ уходит следующему.
+    """
+    # Arrange
+    await _go_online(driver_profile_service, 1, 10, 10)
+    await _go_online(driver_profile_service, 2, 14, 10)
+
+    matcher = DriverMatchingService(redis=redis_client, search_mode=search_mode)
+    await matcher._ensure_consumer_group()
+    await matcher._ensure_consumer_group(matcher.RETRY_STREAM_KEY)
+    await redis_client.xadd(matcher.STREAM_KEY, {
+        "event": "OrderCreated",
+        "data": json.dumps({"ride_id": "ride_r", "start_x": 10, "start_y": 10, "end_x": 0, "end_y": 0, "price": 100.0}),
+    })
+    assert await matcher._handle_messages(await matcher._read_orders(matcher.consumer_names[0]))
+    assert await redis_client.get("driver_lock:1") == "ride_r"
+
+    # Таймаут: блокировка снята, событие повторного поиска опубликовано
+    await redis_client.delete("driver_lock:1")
+    await redis_client.xadd(matcher.RETRY_STREAM_KEY, {"ride_id": "ride_r", "exclude_driver_id": 1})
+    response = await redis_client.xreadgroup(
+        matcher.CONSUMER_GROUP, matcher.consumer_names[0], {matcher.RETRY_STREAM_KEY: ">"}
+    )
+    message_id, fields = response[0][1][0]
+
+    # Act
+    processed = await matcher._process_retry(message_id, fields)
+
+    # Assert
+    assert processed
+    assert await redis_client.get("driver_lock:1") is None
+    assert await redis_client.get("driver_lock:2") == "ride_r"
+    assert await redis_client.smembers("ride_exclusions:ride_r") == {"1"}
+    assert await redis_client.hget("ride_pickup:ride_r", "attempts") == "1"
+
+
+async def test_expire_proposals_batch(redis_client: FakeRedis):
+    """
+    Тест-кейс: Два предложения истекли, одно еще действует.
+    Блокировка одного из истекших уже снята (водитель принял другой заказ).
+
+    Ожидаемый результат:
+    1. Оба истекших предложения удалены из ZSET одним вызовом скрипта.
+    2. Повторный поиск публикуется только для заказа, который все еще держит блокировку.
+    3. Возвращается дедлайн оставшегося предложения.
+    """
+    # Arrange
+    matcher = DriverMatchingService(redis=redis_client)
+    now = time.time()
+    await redis_client.zadd(matcher.TIMEOUT_ZSET_KEY, {
+        "ride_1:1": now - 5,
+        "ride_2:2": now - 1,
+        "ride_3:3": now + 100,
+    })
+    await redis_client.set("driver_lock:1", "ride_1")
+    await redis_client.set("driver_lock:2", "ride_other")
+
+    # Act
+    processed, retried, next_deadline = await matcher._expire_proposals_batch()
+
+    # Assert
+    assert processed == 2
+    assert retried == ["ride_1:1"]
+    assert next_deadline == pytest.approx(now + 100)
+    assert await redis_client.zrange(matcher.TIMEOUT_ZSET_KEY, 0, -1) == ["ride_3:3"]
+    assert await redis_client.get("driver_lock:1") is None
+    assert await redis_client.get("driver_lock:2") == "ride_other"
+    retry_events = await redis_client.xrange(matcher.RETRY_STREAM_KEY)
+    assert [fields for _, fields in retry_events] == [{"ride_id": "ride_1", "exclude_driver_id": "1"}]
+
+
+@pytest.mark.parametrize("search_mode", ["redis", "local", "lua"])
+async def test_search_prefers_manhattan_nearest_driver(
+    search_mode: str,
+    driver_profile_service: DriverProfileService,
+    redis_client: FakeRedis,
+):
+    """
+    Тест-кейс: Водитель 1 ближе по "квадратному" радиусу (3), но дальше по
+    манхэттенскому расстоянию (6), чем водитель 2 (5).
+
+    Ожидаемый результат: выбирается водитель 2 — ближайший по метрике,
+    по которой считаются цена и ETA.
+    """
+    # Arrange
+    await _go_online(driver_profile_service, 1, 3, 3)
+    await _go_online(driver_profile_service, 2, 0, 5)
+
+    matcher = DriverMatchingService(redis=redis_client, search_mode=search_mode)
+    if matcher.grid_index is not None:
+        await matcher.grid_index.load_snapshot(redis_client, settings.DRIVER_PRESENCE_STREAM)
+
+    # Act
+    driver_id = await matcher._find_and_lock_nearest_driver(0, 0, "ride_m")
+
+    # Assert
+    assert driver_id == 2
+
+
+@pytest.mark.parametrize("scan_limit", [256, 0])
+async def test_pending_order_is_offered_to_driver_coming_online(
+    scan_limit: int,
+    driver_profile_service: DriverProfileService,
+    redis_client: FakeRedis,
+):
+    """
+    Тест-кейс: Заказ пришел, когда рядом не было свободных водителей.
+
+    Ожидаемый результат:
+    1. Сообщение подтверждено, заказ помещен в индекс ожидающих заказов.
+    2. Водитель, вышедший на линию рядом, получает предложение по этому заказу.
+    3. Водитель из исключений заказа его не получает.
+    Проверяются оба пути скрипта: полный перебор и обход колец ячеек.
+    """
+    # Arrange
+    matcher = DriverMatchingService(redis=redis_client)
+    matcher.PENDING_SCAN_LIMIT = scan_limit
+    await matcher._ensure_consumer_group()
+    await redis_client.xadd(matcher.STREAM_KEY, {
+        "event": "OrderCreated",
+        "data": json.dumps({"ride_id": "ride_p", "start_x": 20, "start_y": 20, "end_x": 0, "end_y": 0, "price": 50.0}),
+    })
+    assert not await matcher._handle_messages(await matcher._read_orders(matcher.consumer_names[0]))
+    pending = await redis_client.xpending(matcher.STREAM_KEY, matcher.CONSUMER_GROUP)
+    assert pending["pending"] == 0
+    assert await redis_client.hget(matcher.PENDING_ORDERS_KEY, "ride_p") == "20:20"
+    await redis_client.sadd("ride_exclusions:ride_p", 3)
+
+    # Act
+    await _go_online(driver_profile_service, 3, 20, 21)
+    excluded = await matcher._match_pending_order(3, 20, 21)
+    await _go_online(driver_profile_service, 4, 22, 19)
+    offered = await matcher._match_pending_order(4, 22, 19)
+
+    # Assert
+    assert excluded is None
+    assert offered == "ride_p"
+    assert await redis_client.get("driver_lock:4") == "ride_p"
+    assert await redis_client.zscore(matcher.TIMEOUT_ZSET_KEY, "ride_p:4") is not None
+    assert await redis_client.hlen(matcher.PENDING_ORDERS_KEY) == 0
+    assert await redis_client.smembers("pending_cell:20:20") == set()
+
+
+async def test_pending_order_is_offered_to_released_driver_in_same_cell(
+    driver_profile_service: DriverProfileService,
+    redis_client: FakeRedis,
+):
+    """
+    Тест-кейс: Заказ ждет, пока единственный водитель рядом занят другим
+    предложением; водитель освобождается, не покидая ячейку.
+
+    Ожидаемый результат:
+    1. Пока водитель заблокирован, heartbeat из той же ячейки не публикуется в ленту.
+    2. После снятия блокировки heartbeat из той же ячейки приводит к предложению заказа.
+    """
+    # Arrange
+    matcher = DriverMatchingService(redis=redis_client, search_mode="redis")
+    await matcher._ensure_consumer_group()
+    await _go_online(driver_profile_service, 5, 20, 20)
+    await redis_client.set("driver_lock:5", "ride_other")
+    await redis_client.xadd(matcher.STREAM_KEY, {
+        "event": "OrderCreated",
+        "data": json.dumps({"ride_id": "ride_p", "start_x": 20, "start_y": 20, "end_x": 0, "end_y": 0, "price": 50.0}),
+    })
+    await matcher._handle_messages(await matcher._read_orders(matcher.consumer_names[0]))
+    assert await redis_client.hget(matcher.PENDING_ORDERS_KEY, "ride_p") == "20:20"
+
+    matcher._running = True
+    listener = asyncio.create_task(matcher._reverse_matching_listener(matcher.consumer_names[0]))
+    await asyncio.sleep(0.05)
+    feed_length = await redis_client.xlen(settings.DRIVER_PRESENCE_STREAM)
+
+    # Act
+    await _go_online(driver_profile_service, 5, 20, 20)
+    locked_feed_length = await redis_client.xlen(settings.DRIVER_PRESENCE_STREAM)
+    await redis_client.delete("driver_lock:5")
+    await _go_online(driver_profile_service, 5, 20, 20)
+    for _ in range(100):
+        if await redis_client.get("driver_lock:5"):
+            break
+        await asyncio.sleep(0.02)
+    matcher._running = False
+    listener.cancel()
+    await asyncio.gather(listener, return_exceptions=True)
+
+    # Assert
+    assert locked_feed_length == feed_length
+    assert await redis_client.get("driver_lock:5") == "ride_p"
+    assert await redis_client.zscore(matcher.TIMEOUT_ZSET_KEY, "ride_p:5") is not None
+    assert await redis_client.hlen(matcher.PENDING_ORDERS_KEY) == 0
+
+
+async def test_orders_serialized_only_within_overlapping_regions(redis_client: FakeRedis):
+    """
+    Тест-кейс: Заказы обрабатываются параллельно в пуле задач матчера.
+
+    Ожидаемый результат:
+    1. Заказы с пересекающимися областями поиска обрабатываются по очереди.
+    2. Заказы в разных частях города обрабатываются одновременно.
+    """
+    # Arrange
+    matcher = DriverMatchingService(redis=redis_client)
+    active = 0
+    max_active = 0
+
+    async def slow_process_order(message_id, order):
+        nonlocal active, max_active
+        active += 1
+        max_active = max(max_active, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+        return True
+
+    matcher._process_order = slow_process_order
+
+    def order(ride_id, x, y):
+        return {"ride_id": ride_id, "start_x": x, "start_y": y, "end_x": 0, "end_y": 0, "price": 0.0}
+
+    # Act: два заказа по соседству
+    await asyncio.gather(
+        matcher._process_order_in_region("1-0", order("near_1", 5, 5)),
+        matcher._process_order_in_region("2-0", order("near_2", 10, 10)),
+    )
+    overlapping_max = max_active
+
+    # Act: два заказа на противоположных концах города
+    max_active = 0
+    await asyncio.gather(
+        matcher._process_order_in_region("3-0", order("far_1", 5, 5)),
+        matcher._process_order_in_region("4-0", order("far_2", 95, 95)),
+    )
+
+    # Assert
+    assert overlapping_max == 1
+    assert max_active == 2
+
+
+@pytest.mark.parametrize("search_mode", ["redis", "lua"])
+async def test_search_skips_empty_tiles(
+    search_mode: str,
+    driver_profile_service: DriverProfileService,
+    redis_client: FakeRedis,
+):
+    """
+    Тест-кейс: Единственный водитель стоит за границей крупного тайла от точки заказа.
+
+    Ожидаемый результат:
+    1. Непустым считается только мелкий тайл водителя.
+    2. Водитель найден и заблокирован.
+    """
+    # Arrange
+    await _go_online(driver_profile_service, 9, 33, 34)
+    matcher = DriverMatchingService(redis=redis_client, search_mode=search_mode)
+
+    # Act
+    occupied = await matcher._occupied_tiles(30, 30, matcher.MAX_SEARCH_RADIUS)
+    driver_id = await matcher._find_and_lock_nearest_driver(30, 30, "ride_t")
+
+    # Assert
+    assert occupied == {(4, 4)}
+    assert driver_id == 9
+    assert await redis_client.get("driver_lock:9") == "ride_t"
+
+
+@pytest.mark.parametrize("search_mode", ["redis", "local", "lua"])
+async def test_search_in_compact_layout(search_mode: str, redis_client: FakeRedis):
+    """
+    Тест-кейс: Водители размещены в компактной схеме хранения геоиндекса.
+
+    Ожидаемый результат:
+    1. Во всех режимах поиска находится ближайший водитель.
+    2. In-memory индекс загружается из упакованных локаций.
+    """
+    # Arrange
+    layout = PresenceLayout(PresenceLayout.COMPACT)
+    profile_service = DriverProfileService(redis=redis_client, layout=layout)
+    await _go_online(profile_service, 1, 10, 10)
+    await _go_online(profile_service, 250, 11, 10)
+    await _go_online(profile_service, 3, 40, 40)
+
+    matcher = DriverMatchingService(redis=redis_client, search_mode=search_mode, layout=layout)
+    if matcher.grid_index is not None:
+        await matcher.grid_index.load_snapshot(redis_client, settings.DRIVER_PRESENCE_STREAM, layout)
+        assert len(matcher.grid_index) == 3
+
+    # Act
+    driver_id = await matcher._find_and_lock_nearest_driver(12, 10, "ride_1")
+
+    # Assert
+    assert driver_id == 250
+    assert await redis_client.get("driver_lock:250") == "ride_1"
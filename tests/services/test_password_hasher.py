@@ -0,0 +1,56 @@
+"""Unit-тесты для PasswordHasher."""
+
+import asyncio
+
+import pytest
+
+from src.services.password_hasher import PasswordHasher, PasswordHasherBusy
+
+# Помечаем все тесты в этом модуле как асинхронные
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture
+def hasher() -> PasswordHasher:
+    """Фикстура: пул на один процесс без очереди ожидания."""
+    hasher = PasswordHasher(workers=1, max_queue=0)
+    yield hasher
+    hasher.shutdown()
+
+
+async def test_hash_and_verify_in_process_pool(hasher: PasswordHasher):
+    """
+    Тест-кейс: Пароль хешируется и проверяется в пуле процессов.
+
+    Ожидаемый результат:
+    1. Верный пароль проходит проверку, неверный — нет.
+    2. Счетчик завершенных вызовов учитывает все три вызова.
+    """
+    # Act
+    hashed = await hasher.hash("secret-password")
+
+    # Assert
+    assert hashed.startswith("$2b$")
+    assert await hasher.verify("secret-password", hashed) is True
+    assert await hasher.verify("wrong-password", hashed) is False
+    assert hasher.stats()["completed"] == 3
+
+
+async def test_full_queue_rejects_immediately(hasher: PasswordHasher):
+    """
+    Тест-кейс: Пока единственный процесс занят, приходит второй вызов.
+
+    Ожидаемый результат:
+    1. Второй вызов сразу отклоняется PasswordHasherBusy.
+    2. Первый вызов завершается успешно, отказ учтен в метриках.
+    """
+    # Arrange
+    first = asyncio.create_task(hasher.hash("first"))
+    await asyncio.sleep(0)
+
+    # Act / Assert
+    with pytest.raises(PasswordHasherBusy):
+        await hasher.hash("second")
+    assert (await first).startswith("$2b$")
+    assert hasher.stats()["rejected"] == 1
+    assert hasher.stats()["in_flight"] == 0
@@ -0,0 +1,22 @@
+"""Unit-тесты для сервиса расчета цены и ETA."""
+
+from src.services.pricing_service import calculate_price_and_eta, calculate_prices_and_etas
+
+
+def test_batch_pricing_matches_single():
+    """
+    Тест-кейс: Пачка маршрутов рассчитывается пакетной функцией.
+
+    Ожидаемый результат:
+    1. Результаты идут в порядке маршрутов.
+    2. Каждый результат совпадает с расчетом calculate_price_and_eta.
+    """
+    # Arrange
+    routes = [(0, 0, 3, 4), (10, 2, 1, 7), (5, 5, 5, 5)]
+
+    # Act
+    results = calculate_prices_and_etas(routes)
+
+    # Assert
+    assert results == [calculate_price_and_eta(*route) for route in routes]
+    assert [result["distance"] for result in results] == [7, 14, 0]
@@ -0,0 +1,93 @@
+"""Unit-тесты для EventPublisher."""
+
+import asyncio
+import json
+
+import pytest
+from fakeredis.aioredis import FakeRedis
+
+from src.services.redis_publisher import EventPublisher, PublisherQueueFull, STREAM_ORDERS
+
+# Помечаем все тесты в этом модуле как асинхронные
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture
+async def redis_client() -> FakeRedis:
+    """Фикстура для предоставления чистого in-memory Redis клиента для каждого теста."""
+    client = FakeRedis(decode_responses=True)
+    yield client
+    await client.flushall()
+
+
+async def test_events_are_published_in_one_batch(redis_client: FakeRedis):
+    """
+    Тест-кейс: Несколько событий поставлены в очередь до запуска публикатора,
+    одно из них — с ожиданием подтверждения.
+
+    Ожидаемый результат:
+    1. Все события опубликованы одной пачкой в порядке постановки.
+    2. Ожидающий вызов получает ID записи в потоке.
+    """
+    # Arrange
+    publisher = EventPublisher(redis=redis_client, queue_size=10, batch_size=10, maxlen=0)
+    await publisher.publish("OrderCreated", {"ride_id": "1"})
+    await publisher.publish("OrderCreated", {"ride_id": "2"})
+    acked = asyncio.create_task(publisher.publish("RideCompleted", {"ride_id": "1"}, wait=True))
+    await asyncio.sleep(0)
+
+    # Act
+    published = await publisher.flush_batch()
+
+    # Assert
+    assert published == 3
+    entries = await redis_client.xrange(STREAM_ORDERS)
+    assert [json.loads(fields["data"])["ride_id"] for _, fields in entries] == ["1", "2", "1"]
+    assert await acked == entries[2][0]
+    assert publisher.stats()["batches"] == 1
+
+
+async def test_fire_and_forget_rejected_when_queue_full(redis_client: FakeRedis):
+    """
+    Тест-кейс: Очередь публикатора заполнена.
+
+    Ожидаемый результат:
+    1. Событие без ожидания сразу отклоняется PublisherQueueFull.
+    2. При остановке публикатора оставшиеся события отправляются.
+    """
+    # Arrange
+    publisher = EventPublisher(redis=redis_client, queue_size=1, batch_size=10, maxlen=0)
+    await publisher.publish("OrderCreated", {"ride_id": "1"})
+
+    # Act / Assert
+    with pytest.raises(PublisherQueueFull):
+        await publisher.publish("OrderCreated", {"ride_id": "2"})
+    assert publisher.stats()["rejected"] == 1
+
+    task = asyncio.create_task(publisher.run())
+    await asyncio.sleep(0)
+    task.cancel()
+    await task
+    assert await redis_client.xlen(STREAM_ORDERS) == 1
+
+
+async def test_encoded_event_is_acked_after_xadd(redis_client: FakeRedis):
+    """
+    Тест-кейс: Событие из outbox (данные уже в JSON) публикуется с ожиданием подтверждения.
+
+    Ожидаемый результат:
+    1. Данные попадают в поток без повторной сериализации.
+    2. Вызов завершается ID записи только после работы публикатора.
+    """
+    # Arrange
+    publisher = EventPublisher(redis=redis_client, queue_size=10, batch_size=10, maxlen=100)
+    task = asyncio.create_task(publisher.run())
+
+    # Act
+    entry_id = await publisher.publish_encoded("DriverAssigned", '{"ride_id": "7"}', wait=True)
+    task.cancel()
+    await task
+
+    # Assert
+    entries = await redis_client.xrange(STREAM_ORDERS)
+    assert entries == [(entry_id, {"event": "DriverAssigned", "data": '{"ride_id": "7"}'})]
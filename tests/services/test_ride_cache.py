@@ -0,0 +1,40 @@
+"""Unit-тесты для кеша карточек поездок."""
+
+import pytest
+from fakeredis.aioredis import FakeRedis
+
+from src.services.ride_cache import RideCache
+
+# Помечаем все тесты в этом модуле как асинхронные
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture
+async def redis_client() -> FakeRedis:
+    """Фикстура для предоставления чистого in-memory Redis клиента для каждого теста."""
+    client = FakeRedis(decode_responses=True)
+    yield client
+    await client.flushall()
+
+
+async def test_older_version_does_not_overwrite_newer(redis_client: FakeRedis):
+    """
+    Тест-кейс: Сервис поездок записал версию 2, после чего читатель,
+    загрузивший поездку до коммита, пытается записать версию 1.
+
+    Ожидаемый результат:
+    1. Версия 1 отклоняется, в кеше остается версия 2.
+    2. Запись получает TTL.
+    """
+    # Arrange
+    cache = RideCache(redis_client)
+    await cache.store(7, 2, {"ride": {"status": "driver_assigned"}})
+
+    # Act
+    stored = await cache.store(7, 1, {"ride": {"status": "pending"}})
+
+    # Assert
+    assert stored is False
+    assert await cache.get(7) == (2, {"ride": {"status": "driver_assigned"}})
+    assert 0 < await redis_client.ttl("ride:7") <= cache.TTL
+    assert await cache.get(8) is None
@@ -0,0 +1,82 @@
+"""Unit-тесты для курсоров истории поездок, таблицы переходов статусов и чтения карточки поездки."""
+
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+from fakeredis import FakeServer
+from fakeredis.aioredis import FakeRedis
+
+from src.models.ride import RideStatusEnum
+from src.services import rides_service
+from src.services.rides_service import decode_history_cursor, encode_history_cursor, get_ride
+from src.services.ride_cache import RideCache
+
+
+def test_history_cursor_round_trip():
+    """
+    Тест-кейс: Курсор строится по последней поездке страницы и разбирается обратно.
+
+    Ожидаемый результат:
+    1. Время создания (с микросекундами и часовым поясом) и ID восстанавливаются без потерь.
+    2. Некорректный курсор отклоняется ValueError.
+    """
+    # Arrange
+    created_at = datetime(2026, 3, 1, 12, 30, 15, 123456, tzinfo=timezone.utc)
+
+    # Act
+    cursor = encode_history_cursor(created_at, 4242)
+
+    # Assert
+    assert decode_history_cursor(cursor) == (created_at, 4242)
+    with pytest.raises(ValueError):
+        decode_history_cursor("not-a-cursor")
+
+
+def test_status_transitions_allowed_from():
+    """
+    Тест-кейс: Статусы, из которых разрешен переход, берутся из таблицы переходов.
+
+    Ожидаемый результат:
+    1. Водителя можно назначить только на ожидающий заказ.
+    2. Отменить можно только до посадки пассажира, завершить — только идущую поездку.
+    3. В начальный статус перейти нельзя.
+    """
+    # Act / Assert
+    assert RideStatusEnum.allowed_from(RideStatusEnum.DRIVER_ASSIGNED) == ["pending"]
+    assert set(RideStatusEnum.allowed_from(RideStatusEnum.CANCELLED)) == {
+        "pending", "driver_assigned", "driver_arrived",
+    }
+    assert RideStatusEnum.allowed_from(RideStatusEnum.COMPLETED) == ["in_progress"]
+    assert RideStatusEnum.allowed_from(RideStatusEnum.PENDING) == []
+
+
+async def test_get_ride_falls_back_to_db_when_redis_is_down(monkeypatch: pytest.MonkeyPatch):
+    """
+    Тест-кейс: Redis недоступен, карточка поездки запрашивается ее пассажиром.
+
+    Ожидаемый результат:
+    1. Ошибки чтения и записи кеша не пробрасываются.
+    2. Карточка и версия возвращаются из БД.
+    """
+    # Arrange
+    server = FakeServer()
+    server.connected = False
+    monkeypatch.setattr(rides_service, "ride_cache", RideCache(FakeRedis(server=server, decode_responses=True)))
+    row = SimpleNamespace(
+        id=7, price=120.0, status="pending", start_x=1, start_y=2, end_x=3, end_y=4,
+        created_at=datetime(2026, 3, 1, tzinfo=timezone.utc),
+        version=3, passenger_user_id=11, driver_user_id=None,
+    )
+
+    class StubSession:
+        async def execute(self, statement):
+            return SimpleNamespace(one_or_none=lambda: row)
+
+    # Act
+    ride, version = await get_ride(7, 11, StubSession())
+
+    # Assert
+    assert version == 3
+    assert ride.ride_id == "7"
+    assert ride.status == "pending"
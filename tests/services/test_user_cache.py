@@ -0,0 +1,84 @@
+"""Unit-тесты для кеша проверенных пользователей."""
+
+import asyncio
+
+import pytest
+from fakeredis.aioredis import FakeRedis
+
+from src.core.config import settings
+from src.services.user_cache import VerifiedUserCache, user_invalidation_listener
+
+# Помечаем все тесты в этом модуле как асинхронные
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture
+async def redis_client() -> FakeRedis:
+    """Фикстура для предоставления чистого in-memory Redis клиента для каждого теста."""
+    client = FakeRedis(decode_responses=True)
+    yield client
+    await client.flushall()
+
+
+async def test_cache_evicts_least_recently_used_and_expired():
+    """
+    Тест-кейс: В кеш на два пользователя добавляется третий; у другого кеша истекает TTL.
+
+    Ожидаемый результат:
+    1. Вытесняется пользователь, к которому дольше всего не обращались.
+    2. Запись с истекшим TTL считается промахом.
+    3. Счетчики hits/misses отражают обращения.
+    """
+    # Arrange
+    cache = VerifiedUserCache(max_size=2, ttl_sec=60)
+    cache.add(1)
+    cache.add(2)
+    assert cache.contains(1)
+
+    # Act
+    cache.add(3)
+
+    # Assert
+    assert cache.contains(1)
+    assert not cache.contains(2)
+    assert cache.contains(3)
+    assert cache.stats() == {"size": 2, "hits": 3, "misses": 1, "hit_ratio": 0.75}
+
+    expired = VerifiedUserCache(max_size=2, ttl_sec=0.01)
+    expired.add(1)
+    await asyncio.sleep(0.02)
+    assert not expired.contains(1)
+    assert len(expired) == 0
+
+
+async def test_invalidation_message_drops_cached_user(redis_client: FakeRedis):
+    """
+    Тест-кейс: Другой процесс публикует сброс кеша для пользователя.
+
+    Ожидаемый результат:
+    1. Запись о пользователе удаляется, остальные записи остаются.
+    """
+    # Arrange
+    cache = VerifiedUserCache(max_size=10, ttl_sec=60)
+    listener = asyncio.create_task(user_invalidation_listener(redis_client, cache))
+    for _ in range(100):
+        [(_, subscribers)] = await redis_client.pubsub_numsub(settings.USER_CACHE_INVALIDATION_CHANNEL)
+        if subscribers:
+            break
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.05)  # слушатель очищает кеш сразу после подписки
+    cache.add(1)
+    cache.add(2)
+
+    # Act
+    await redis_client.publish(settings.USER_CACHE_INVALIDATION_CHANNEL, "1")
+    for _ in range(100):
+        if len(cache) == 1:
+            break
+        await asyncio.sleep(0.01)
+    listener.cancel()
+    await listener
+
+    # Assert
+    assert not cache.contains(1)
+    assert cache.contains(2)